@@ -1,44 +1,384 @@
-from flask import Flask, render_template, flash, redirect, session, g, request, jsonify, json
+from flask import Flask, Blueprint, current_app, render_template, flash, redirect, session, g, request, jsonify, abort, make_response, url_for
+from flask.cli import with_appcontext
 from flask_debugtoolbar import DebugToolbarExtension
-import requests
 from forms import CreateUserForm, LoginForm, ListForm, EditUserForm
+from sqlalchemy import case, cast, Integer
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import Markup
+from datetime import timedelta
+import click
+import hashlib
 import os
+import re
+import requests
 
-from models import db, connect_db, User, Follows, Character, List, ListCharacter, DEFAULT_IMAGE_URL
+from config import CONFIGS
+from models import db, connect_db, User, Follows, Character, List, ListCharacter, FeedEntry, ListJob, DEFAULT_IMAGE_URL, SEARCH_CONFIG
+from cache import make_cache, SharedFlight
+from giantbomb import GiantBombClient, character_url, search_url
+from instrumentation import init_instrumentation, MetricsReporter
+from passwords import init_passwords, LoginThrottle, PasswordHasherBusy
+from images import ImageProxy, ImageFetchError, IMAGE_SIZES
+from character_sync import CharacterSync, SharedTokenBucket
+from list_jobs import ListJobRunner
+
+bp = Blueprint("epiclist", __name__)
+
+# Shared by every request, built from the config by create_app(). All
+# outbound GiantBomb traffic shares api_client's connection pool.
+search_cache = None
+card_cache = None
+identity_cache = None
+api_client = None
+character_sync = None
+list_jobs = None
+metrics_reporter = None
+login_throttle = None
+image_proxy = None
+# Searches being loaded by any worker, so identical ones running at the
+# same time share one call to GiantBomb
+search_flights = None
 
-app = Flask(__name__)
+CURR_USER_KEY = "curr_user"
 
+# Shown when a list's characters couldn't be fetched, the list isn't saved
+GIANTBOMB_ERROR_MESSAGE = "Couldn't get the characters from GiantBomb, please try again"
 
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "postgres:///epiclist")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ECHO"] = True
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
-app.config["SECRET_KEY"] = os.environ.get('SECRET_KEY', "secretkey2")
+# Most lists sent by one call to the batched list API
+MAX_BATCH_LISTS = 100
 
-toolbar = DebugToolbarExtension(app)
-connect_db(app)
+# Bounds on searches sent to /search-characters
+MAX_SEARCH_LIMIT = 10
+MAX_SEARCH_PAGE = 100
+MAX_SEARCH_TERM_LENGTH = 100
 
-db.create_all()
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
 
-CURR_USER_KEY = "curr_user"
-HEADERS = {"User-Agent": "EpicListSearchBot"}
 
+def create_app(config="production"):
+    """
+    Builds the app from a config profile name (development, testing or
+    production) or a config object
+
+    Nothing here touches the database, so gunicorn can preload the app and
+    fork workers from it. Tables are created by the init-db and migrate
+    commands instead.
+    """
 
-@app.before_request
-def add_user_to_g():
-    """If user logged in, add to global flask variable"""
+    app = Flask(__name__)
+    app.config.from_object(CONFIGS[config] if isinstance(config, str) else config)
+
+    if app.config["DEBUG_TB_ENABLED"]:
+        DebugToolbarExtension(app)
+
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+    connect_db(app)
+    init_instrumentation(app)
+    init_passwords(app)
+    init_services(app)
+
+    app.register_blueprint(bp)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(sync_characters_command)
+    app.cli.add_command(run_list_jobs_command)
+    app.cli.add_command(retry_list_jobs_command)
+
+    if app.config["WARM_TEMPLATES"]:
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+
+    return app
+
+
+def init_services(app):
+    """Builds the caches, GiantBomb client, character sync, list job runner,
+    metrics reporter, login throttle and image proxy from the app's config"""
+
+    global search_cache, search_flights, card_cache, identity_cache, api_client, character_sync, list_jobs, metrics_reporter, login_throttle, image_proxy
+
+    search_cache = make_cache(app.config, "search",
+                              app.config["SEARCH_CACHE_TTL"],
+                              app.config["SEARCH_CACHE_MAX_ENTRIES"])
+    search_flights = SharedFlight(
+        make_cache(app.config, "search-lock", app.config["SEARCH_WAIT"], 10000),
+        search_cache, wait=app.config["SEARCH_WAIT"])
+    card_cache = make_cache(app.config, "card",
+                            app.config["CARD_CACHE_TTL"],
+                            app.config["CARD_CACHE_MAX_ENTRIES"])
+    identity_cache = make_cache(app.config, "identity",
+                                app.config["IDENTITY_CACHE_TTL"],
+                                app.config["IDENTITY_CACHE_MAX_ENTRIES"])
+
+    api_client = GiantBombClient(
+        timeout=app.config["GIANTBOMB_TIMEOUT"],
+        pool_size=max(app.config["GIANTBOMB_POOL_SIZE"],
+                      app.config["GIANTBOMB_MAX_WORKERS"]),
+        retries=app.config["GIANTBOMB_RETRIES"],
+        backoff=app.config["GIANTBOMB_BACKOFF"]
+    )
+
+    character_sync = CharacterSync(
+        app, api_client,
+        SharedTokenBucket("giantbomb-sync", app.config["GIANTBOMB_SYNC_RATE"],
+                          app.config["GIANTBOMB_SYNC_BURST"]),
+        max_age=timedelta(days=app.config["CHARACTER_MAX_AGE_DAYS"]),
+        interval=app.config["CHARACTER_SYNC_INTERVAL"],
+        batch_size=app.config["CHARACTER_SYNC_BATCH"]
+    )
+
+    login_throttle = LoginThrottle(
+        make_cache(app.config, "login", app.config["LOGIN_THROTTLE_WINDOW"], 100000),
+        per_username=app.config["LOGIN_THROTTLE_PER_USERNAME"],
+        per_address=app.config["LOGIN_THROTTLE_PER_ADDRESS"]
+    )
+
+    image_proxy = ImageProxy(
+        app.config["SECRET_KEY"], app.config["IMAGE_CACHE_DIR"],
+        timeout=app.config["IMAGE_PROXY_TIMEOUT"],
+        deadline=app.config["IMAGE_PROXY_DEADLINE"],
+        max_bytes=app.config["IMAGE_PROXY_MAX_BYTES"],
+        pool_size=app.config["IMAGE_PROXY_POOL_SIZE"],
+        failures=make_cache(app.config, "image-failures",
+                            app.config["IMAGE_PROXY_FAILURE_TTL"], 10000)
+    )
+
+    list_jobs = ListJobRunner(
+        app, run_list_job,
+        workers=app.config["LIST_JOB_WORKERS"],
+        interval=app.config["LIST_JOB_INTERVAL"],
+        max_attempts=app.config["LIST_JOB_MAX_ATTEMPTS"],
+        backoff=app.config["LIST_JOB_BACKOFF"],
+        timeout=app.config["LIST_JOB_TIMEOUT"]
+    )
+
+    metrics_reporter = MetricsReporter(
+        app, {
+            "giantbomb": api_client.metrics.snapshot,
+            "search_cache": search_cache.stats,
+            "card_cache": card_cache.stats,
+            "identity_cache": identity_cache.stats
+        },
+        interval=app.config["METRICS_LOG_INTERVAL"]
+    )
+
+
+####### CLI COMMANDS ###########################
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Creates every table in a new database"""
+
+    create_tables()
+    click.echo("Created tables")
+
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Applies the SQL migrations that haven't been applied yet, or creates
+    the tables of a new database"""
+
+    # A first deploy runs this on an empty database
+    if not db.engine.dialect.has_table(db.engine, "users"):
+        create_tables()
+        click.echo("Created tables")
+        return
+
+    for name in pending_migrations():
+        with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+            sql = f.read()
+
+        # Run through the driver directly, since migrations can hold several
+        # statements and characters SQLAlchemy would read as bind parameters
+        with db.engine.begin() as conn:
+            conn.connection.cursor().execute(sql)
+
+        record_migration(name)
+        db.session.commit()
+        click.echo(f"Applied {name}")
+
+    click.echo("Database is up to date")
+
+
+@click.command("sync-characters")
+@click.option("--forever", is_flag=True, help="Keep syncing every CHARACTER_SYNC_INTERVAL seconds")
+@with_appcontext
+def sync_characters_command(forever):
+    """Refreshes the stalest stored characters from GiantBomb"""
+
+    if forever:
+        character_sync.run_forever()
+    else:
+        click.echo(f"Synced {character_sync.run_once()} characters")
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
 
+@click.command("run-list-jobs")
+@click.option("--forever", is_flag=True, help="Keep running jobs as they're queued")
+@with_appcontext
+def run_list_jobs_command(forever):
+    """Runs the queued list jobs that are due"""
+
+    if forever:
+        list_jobs.run_forever()
     else:
+        click.echo(f"Ran {list_jobs.run_once()} list jobs")
+
+
+@click.command("retry-list-jobs")
+@with_appcontext
+def retry_list_jobs_command():
+    """Queues the dead list jobs to run again"""
+
+    count = ListJob.requeue_dead()
+    db.session.commit()
+    click.echo(f"Queued {count} dead list jobs")
+
+
+def create_tables():
+    """Creates every table, recording every migration as applied since
+    create_all builds the latest schema"""
+
+    db.create_all()
+
+    for name in pending_migrations():
+        record_migration(name)
+
+    db.session.commit()
+
+
+def pending_migrations():
+    """Names of the migration files not recorded as applied, in order"""
+
+    db.session.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now())""")
+
+    applied = {row[0] for row in db.session.execute("SELECT name FROM schema_migrations")}
+
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR)
+                  if name.endswith(".sql") and name not in applied)
+
+
+def record_migration(name):
+    db.session.execute("INSERT INTO schema_migrations (name) VALUES (:name)", {"name": name})
+
+
+@bp.before_app_request
+def start_character_sync():
+    """Starts the character sync in this worker process on its first request"""
+
+    if current_app.config["CHARACTER_SYNC_ENABLED"]:
+        character_sync.start()
+
+
+@bp.before_app_request
+def start_list_jobs():
+    """Starts the list job worker threads in this worker process on its first
+    request"""
+
+    if current_app.config["LIST_JOB_MODE"] == "thread":
+        list_jobs.start()
+
+
+@bp.before_app_request
+def start_metrics_reporter():
+    """Starts logging this worker process's GiantBomb and cache metrics on
+    its first request"""
+
+    if current_app.config["METRICS_LOG_INTERVAL"]:
+        metrics_reporter.start()
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If user logged in, add to global flask variable"""
+
+    if CURR_USER_KEY not in session:
         g.user = None
+        return
+
+    user_id = session[CURR_USER_KEY]
+    username = identity_cache.get(str(user_id))
+
+    if username is None:
+        username = db.session.query(User.username).filter(User.id == user_id).scalar()
+
+        # The user has been deleted since logging in
+        if username is None:
+            session.pop(CURR_USER_KEY, None)
+            g.user = None
+            return
+
+        remember_identity(user_id, username)
+
+    g.user = CurrentUser(user_id, username)
+
+
+def remember_identity(user_id, username):
+    """Caches the username of a logged in user, so requests that only need
+    the id and username don't query the database"""
+
+    identity_cache.set(str(user_id), username)
+
+
+def forget_identity(user_id):
+    """Drops a user's cached username after it changes or the user is
+    deleted, so every session looks it up again"""
+
+    identity_cache.delete(str(user_id))
+
+
+class CurrentUser:
+    """
+    The logged in user
+
+    id comes from the signed session cookie and username from the identity
+    cache, so requests that only need those don't load the user. Any other
+    attribute loads the full User row the first time it's used and is passed
+    through to it.
+    """
+
+    def __init__(self, user_id, username):
+        self.__dict__["id"] = user_id
+        self.__dict__["username"] = username
+        self.__dict__["_row"] = None
+
+    @property
+    def row(self):
+        """The full User row, loaded on first use. If the user has been
+        deleted since logging in, the session is cleared."""
+
+        if self._row is None:
+            user = User.query.get(self.id)
+
+            if user is None:
+                session.pop(CURR_USER_KEY, None)
+                forget_identity(self.id)
+                abort(redirect("/register-home"))
+
+            self.__dict__["_row"] = user
+
+        return self._row
+
+    def __getattr__(self, name):
+        return getattr(self.row, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.row, name, value)
 
 ####### GENERAL ROUTES ###########################
 
 
-@app.route("/")
+@bp.route("/")
 def index():
     """Home screen, if not logged in, redirect to registration home screen"""
 
@@ -46,23 +386,94 @@ def index():
         return redirect("/register-home")
 
     list_filter = request.args.get("filter", False)
+    before = request.args.get("before", None, type=int)
 
     if list_filter:
-        lists = List.query.filter(
-            List.user_id.in_(g.user.following_ids())).filter(List.is_private == False).all()
+        # Lists from followed users are written to each follower's feed
+        # entries when published, so this is one read of the user's entries
+        query = List.query.join(FeedEntry, FeedEntry.list_id == List.id).filter(
+            FeedEntry.user_id == g.user.id).filter(List.is_private == False)
     else:
-        lists = List.query.filter(List.is_private == False).all()
+        query = List.query.filter(List.is_private == False)
 
-    lists.reverse()
+    lists, next_before = paginate_lists(query, before)
 
-    lists = format_lists(lists)
+    cards = render_list_cards(lists, "index")
 
-    return render_template("index.html", lists=lists, filtered=list_filter)
+    return render_template("index.html", cards=cards, filtered=list_filter, next_before=next_before)
+
+
+def paginate_lists(query, before=None, page_size=None):
+    """
+    Keyset pagination for feeds of lists, newest lists first
+
+    Returns one page of lists with an id lower than before (or the newest
+    page if before is None), along with the cursor for the next page. The
+    cursor is None when there are no more lists to load.
+    """
+
+    if page_size is None:
+        page_size = current_app.config["FEED_PAGE_SIZE"]
+
+    if before is not None:
+        query = query.filter(List.id < before)
+
+    # Fetch one extra row to find out if there is another page without
+    # having to count every list
+    lists = query.options(db.joinedload(List.user)).order_by(
+        List.id.desc()).limit(page_size + 1).all()
+
+    next_before = None
+    if len(lists) > page_size:
+        lists = lists[:page_size]
+        next_before = lists[-1].id
+
+    return lists, next_before
+
+####### IMAGE PROXY ###############################
+
+
+@bp.app_template_filter("proxied")
+def proxied_image_url(url, size="thumb"):
+    """Rewrites an image url to go through the image proxy, at one of the
+    sizes in IMAGE_SIZES"""
+
+    if not current_app.config["IMAGE_PROXY_ENABLED"] or not url or \
+            not url.startswith(("http://", "https://")):
+        return url
+
+    return url_for("epiclist.proxy_image", size=size,
+                   signature=image_proxy.sign(url, size), url=url)
+
+
+@bp.route("/images/<size>/<signature>", methods=["GET"])
+def proxy_image(size, signature):
+    """Serves a downscaled copy of the image at a signed url. Images that
+    can't be fetched are left to the browser to load from their url."""
+
+    url = request.args.get("url", "")
+
+    if size not in IMAGE_SIZES or not image_proxy.verify(url, size, signature):
+        abort(404)
+
+    try:
+        data, content_type = image_proxy.get(url, size)
+    except ImageFetchError:
+        response = redirect(url)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    response = current_app.response_class(data, mimetype=content_type)
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+
+    return response.make_conditional(request)
 
 ####### LOGIN FUNCTIONS ###############################
 
 
-@app.route("/register-home")
+@bp.route("/register-home")
 def show_register_home():
     """Shows register home page (not the actual register form)"""
 
@@ -72,13 +483,16 @@ def show_register_home():
     return render_template("register-home.html")
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def show_register():
     """Shows register form if GET. Attempts to create user and add to db if POST"""
 
     form = CreateUserForm()
 
     if form.validate_on_submit():
+        if not login_throttle.allow(request.remote_addr):
+            return too_many_attempts("register.html", form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -97,19 +511,23 @@ def show_register():
         return render_template('register.html', form=form)
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def show_login():
     """Shows login form if GET. Attempts to authenticate data if POST."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
+        if not login_throttle.allow(request.remote_addr, form.username.data):
+            return too_many_attempts("login.html", form)
+
         user = User.authenticate(
             username=form.username.data,
             password=form.password.data
         )
         if user:
             do_login(user)
+            db.session.commit()
             return redirect("/")
         else:
             flash("Invalid username or password", "danger")
@@ -119,7 +537,7 @@ def show_login():
         return render_template("login.html", form=form)
 
 
-@app.route("/logout", methods=["GET"])
+@bp.route("/logout", methods=["GET"])
 def logout():
     """Route to logout user"""
 
@@ -131,10 +549,29 @@ def logout():
     return redirect("/register-home")
 
 
+def too_many_attempts(template, form):
+    """Turns away a password check over the login throttle's limits, before
+    any hashing is done"""
+
+    flash("Too many attempts, try again in a few minutes", "danger")
+
+    response = make_response(render_template(template, form=form), 429)
+    response.headers["Retry-After"] = str(current_app.config["LOGIN_THROTTLE_WINDOW"])
+    return response
+
+
+@bp.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Too many passwords are already being hashed by this worker"""
+
+    return "Too many logins at once, try again in a moment", 503, {"Retry-After": "1"}
+
+
 def do_login(user):
     """Logs in user (authentication happens in route)"""
 
     session[CURR_USER_KEY] = user.id
+    remember_identity(user.id, user.username)
 
 
 def do_logout():
@@ -145,7 +582,7 @@ def do_logout():
 ####### LIST FUNCTIONS ###############################
 
 
-@app.route("/lists/new", methods=["GET", "POST"])
+@bp.route("/lists/new", methods=["GET", "POST"])
 def create_list():
     """Shows create list form if GET. Submits new list if POST"""
 
@@ -172,16 +609,34 @@ def create_list():
             is_private=is_private
         )
         db.session.add(newList)
-        db.session.commit()
 
-        organize_characters(queries, newList, True)
+        if not is_private:
+            newList.publish()
+
+        if queue_list_characters(newList, characters, True):
+            db.session.commit()
+            invalidate_list_cards(newList)
+            list_jobs.notify()
+            return redirect(f"/lists/{newList.id}")
+
+        # The list is committed along with its characters, so it's never seen
+        # (or its cards cached) without them
+        try:
+            organize_characters(queries, newList, True)
+        except requests.exceptions.RequestException:
+            db.session.rollback()
+            flash(GIANTBOMB_ERROR_MESSAGE, "danger")
+            return render_template("new_list.html", form=form)
+
+        db.session.commit()
+        invalidate_list_cards(newList)
 
         return redirect("/")
 
     return render_template("new_list.html", form=form)
 
 
-@app.route("/lists/<int:list_id>", methods=["GET"])
+@bp.route("/lists/<int:list_id>", methods=["GET"])
 def view_list(list_id):
     """Shows single full list"""
 
@@ -189,16 +644,43 @@ def view_list(list_id):
     user = g.user
     own_list = False
 
-    if lst.user == user:
+    if user and lst.user_id == user.id:
         own_list = True
 
     if lst.is_private and not own_list:
         flash("You are not permitted to see that private list", "danger")
         return redirect("/")
 
-    lst = format_lists(lst)
+    def build():
+        card = render_list_cards([lst], "full")[0]
+        progress = list_job_progress(lst)
+
+        return render_template("list.html", user=user, list=lst, card=card,
+                               own_list=own_list, progress=progress)
+
+    # Pending lists show progress that changes without a new revision
+    if lst.status == "pending":
+        return build()
+
+    return conditional_response(page_etag(lst.id, lst.revision, lst.status),
+                                build, lst.updated_at)
+
 
-    return render_template("list.html", user=user, list=lst, own_list=own_list)
+def list_job_progress(lst):
+    """How far along the latest job of a pending or failed list is, or None
+    if the list is ready"""
+
+    if lst.status == "ready":
+        return None
+
+    job = ListJob.query.filter(ListJob.list_id == lst.id).order_by(ListJob.id.desc()).first()
+    if job is None:
+        return None
+
+    guids = set(job.characters.split(", "))
+    ready = Character.query.filter(Character.guid.in_(guids)).count()
+
+    return {"ready": ready, "total": len(guids), "attempts": job.attempts}
 
 
 def format_lists(lists):
@@ -212,11 +694,7 @@ def format_lists(lists):
     # than if you have a list of EpicLists like in the home screen or
     # user page.
     if type(lists) == list:
-        ranked_lists = []
-        for lst in lists:
-            l = format_list(lst)
-            ranked_lists.append(l)
-        return ranked_lists
+        return load_list_characters(lists)
 
     else:
         return format_list(lists)
@@ -224,29 +702,80 @@ def format_lists(lists):
 
 def format_list(lst):
     """Format single list, used in format_lists()"""
-    chars = []
-    lc = ListCharacter.query.filter(
-        ListCharacter.list_id == lst.id).all()
 
-    for character in lst.characters:
+    return load_list_characters([lst])[0]
 
-        rank = ""
-        for list_char in lc:
-            if list_char.character_id == character.id:
-                rank = list_char.rank
 
-        info = {"character": character, "rank": rank}
+def load_list_characters(lists):
+    """
+    Batched loader behind format_lists()
 
-        if lst.is_ranked:
-            chars.insert(rank-1, info)
-        else:
-            chars.append(info)
+    Fetches the characters and ranks of every given list in a single query,
+    ordered by rank in the database, and groups them by list. Unranked lists
+    keep the order their characters were added in.
+    """
+
+    chars_by_list = {lst.id: [] for lst in lists}
+
+    if chars_by_list:
+        rows = db.session.query(ListCharacter.list_id, ListCharacter.rank, Character).join(
+            Character, ListCharacter.character_id == Character.id).filter(
+            ListCharacter.list_id.in_(list(chars_by_list))).order_by(
+            ListCharacter.list_id, ListCharacter.rank, ListCharacter.id).all()
+
+        for list_id, rank, character in rows:
+            chars_by_list[list_id].append(
+                {"character": character, "rank": rank})
+
+    return [{"list": lst, "characters": chars_by_list[lst.id]} for lst in lists]
+
+
+####### LIST CARD CACHE ###############################
+
+CARD_TEMPLATES = {
+    "index": "card-index.html",
+    "profile": "card-profile.html",
+    "full": "card-full.html"
+}
 
-    char_info = {"list": lst, "characters": chars}
-    return char_info
+
+def render_list_cards(lists, variant):
+    """
+    Returns the rendered HTML of each list's card for a variant (index,
+    profile or full page)
+
+    Cards are cached by list id and revision, so only the lists that aren't
+    cached are formatted and rendered.
+    """
+
+    keys = [card_cache_key(variant, lst.id, lst.revision) for lst in lists]
+    cards = card_cache.get_many(keys)
+
+    missing = [lst for lst, card in zip(lists, cards) if card is None]
+    formatted = {item["list"].id: item for item in format_lists(missing)}
+
+    for index, lst in enumerate(lists):
+        if cards[index] is None:
+            cards[index] = render_template(CARD_TEMPLATES[variant],
+                                           dict_item=formatted[lst.id])
+            card_cache.set(keys[index], cards[index])
+
+    return [Markup(card) for card in cards]
+
+
+def card_cache_key(variant, list_id, revision):
+    return f"{variant}:{list_id}:{revision}"
 
 
-@app.route("/lists/<int:list_id>/delete", methods=["POST"])
+def invalidate_list_cards(lst):
+    """Drops every cached card of a list's current revision. Edits don't need
+    this, since they move the list on to a new revision."""
+
+    for variant in CARD_TEMPLATES:
+        card_cache.delete(card_cache_key(variant, lst.id, lst.revision))
+
+
+@bp.route("/lists/<int:list_id>/delete", methods=["POST"])
 def delete_list(list_id):
     """Deletes list"""
 
@@ -260,13 +789,17 @@ def delete_list(list_id):
         flash("You don't have permission to do that", "danger")
         return redirect("/")
 
+    if not lst.is_private:
+        lst.unpublish()
+
+    invalidate_list_cards(lst)
     db.session.delete(lst)
     db.session.commit()
     flash("List deleted", "primary")
     return redirect("/")
 
 
-@app.route("/lists/<int:list_id>/edit", methods=["GET", "POST"])
+@bp.route("/lists/<int:list_id>/edit", methods=["GET", "POST"])
 def edit_list(list_id):
     """Sends POST request to edit a list or sends edit list screen with characters
     from list in the form"""
@@ -286,41 +819,196 @@ def edit_list(list_id):
 
     if request.method == 'POST' and form.validate_on_submit():
 
+        if lst.is_private and not form.is_private.data:
+            lst.publish()
+        elif not lst.is_private and form.is_private.data:
+            lst.unpublish()
+
         lst.title = form.title.data
         lst.is_ranked = form.is_ranked.data
         lst.is_private = form.is_private.data
+        lst.revision = List.revision + 1
 
         characters = form.characters.data
 
+        if queue_list_characters(lst, characters, False):
+            db.session.commit()
+            list_jobs.notify()
+            return redirect(f"/lists/{lst.id}")
+
         queries = convert_guids_to_api_queries(characters)
 
-        organize_characters(queries, lst, False)
+        # Committed with the edit and its new revision
+        try:
+            organize_characters(queries, lst, False)
+        except requests.exceptions.RequestException:
+            db.session.rollback()
+            flash(GIANTBOMB_ERROR_MESSAGE, "danger")
+            return render_template("edit-list.html", list=l, form=form)
+
+        db.session.commit()
 
         return redirect(f"/lists/{lst.id}")
 
     return render_template("edit-list.html", list=l, form=form)
 
 
-@app.route("/get-list/<int:list_id>", methods=["GET"])
+@bp.route("/get-list/<int:list_id>", methods=["GET"])
 def send_list(list_id):
     """Accepts a list id from the front end, sends characters to display
     while editing lists"""
 
-    lst = format_lists(List.query.get_or_404(list_id))
-    chars = lst["characters"]
+    lst = List.query.get_or_404(list_id)
 
-    to_send = []
-    for c in chars:
-        char = c["character"]
-        character = {
-            "name": char.name,
-            "image_url": char.image_url,
-            "guid": char.guid
-        }
-        to_send.append(character)
+    def build():
+        chars = load_list_contents([lst.id])[0]["characters"]
+
+        to_send = []
+        for char in chars:
+            character = {
+                "name": char["name"],
+                "image_url": char["image_url"],
+                "guid": char["guid"]
+            }
+            to_send.append(character)
+
+        return {"characters": to_send}
+
+    return conditional_response(page_etag(lst.id, lst.revision), build, lst.updated_at)
+
+
+@bp.route("/api/lists", methods=["GET"])
+def send_lists():
+    """
+    Sends the characters and ranks of many lists at once, newest lists
+    first, for the lists in ids (comma separated) or a page of user_id's
+    lists older than before
+
+    Private lists are only sent to their author. Clients sending back the
+    ETag of their copy get a 304 when none of the lists changed.
+    """
+
+    viewer_id = g.user.id if g.user else None
+    query = List.query.filter(db.or_(List.is_private == False, List.user_id == viewer_id))
+    next_before = None
+
+    if "ids" in request.args:
+        try:
+            ids = {int(list_id) for list_id in request.args["ids"].split(",") if list_id.strip()}
+        except ValueError:
+            abort(400)
+
+        if len(ids) > MAX_BATCH_LISTS:
+            abort(400)
+
+        versions = query.filter(List.id.in_(ids)).with_entities(
+            List.id, List.revision).order_by(List.id.desc()).all()
+
+    elif "user_id" in request.args:
+        user_id = request.args.get("user_id", type=int)
+        before = request.args.get("before", None, type=int)
+
+        query = query.filter(List.user_id == user_id)
+        if before is not None:
+            query = query.filter(List.id < before)
+
+        versions = query.with_entities(List.id, List.revision).order_by(
+            List.id.desc()).limit(MAX_BATCH_LISTS + 1).all()
+
+        if len(versions) > MAX_BATCH_LISTS:
+            versions = versions[:MAX_BATCH_LISTS]
+            next_before = versions[-1][0]
+
+    else:
+        abort(400)
+
+    def build():
+        return {"lists": load_list_contents([list_id for list_id, revision in versions]),
+                "next_before": next_before}
+
+    return conditional_response(page_etag(versions, next_before), build)
+
+
+def load_list_contents(list_ids):
+    """
+    Plain dictionaries of the given lists with their characters and ranks,
+    in the given order, fetched with a single joined query
+    """
+
+    contents = {}
+
+    if list_ids:
+        rows = db.session.query(
+            List.id, List.title, List.user_id, User.username, List.is_ranked,
+            List.is_private, List.status, ListCharacter.rank,
+            Character.name, Character.image_url, Character.guid).join(
+            User, List.user_id == User.id).outerjoin(
+            ListCharacter, ListCharacter.list_id == List.id).outerjoin(
+            Character, ListCharacter.character_id == Character.id).filter(
+            List.id.in_(list_ids)).order_by(
+            List.id, ListCharacter.rank, ListCharacter.id).all()
+
+        for (list_id, title, user_id, username, is_ranked, is_private, status,
+             rank, name, image_url, guid) in rows:
+
+            if list_id not in contents:
+                contents[list_id] = {
+                    "id": list_id,
+                    "title": title,
+                    "user_id": user_id,
+                    "username": username,
+                    "is_ranked": is_ranked,
+                    "is_private": is_private,
+                    "status": status,
+                    "characters": []
+                }
+
+            if guid is not None:
+                contents[list_id]["characters"].append(
+                    {"name": name, "image_url": image_url, "guid": guid, "rank": rank})
+
+    return [contents[list_id] for list_id in list_ids if list_id in contents]
+
+
+def page_etag(*versions):
+    """ETag of a response from the versions of everything shown on it, like
+    list revisions, and who is viewing it"""
+
+    viewer = (g.user.id, g.user.username) if g.user else None
+
+    return hashlib.sha1(repr((viewer,) + versions).encode("utf-8")).hexdigest()
 
-    characters = {"characters": to_send}
-    return jsonify(characters)
+
+def conditional_response(etag, build, last_modified=None):
+    """
+    Responds with 304 Not Modified if the client's copy is still current, or
+    with build()'s result otherwise
+
+    Responses only depend on the viewer through etag, so Last-Modified is
+    only checked for anonymous visitors, whose responses can be shared by
+    caches. Responses are always built while flashed messages are waiting,
+    so the messages get shown.
+    """
+
+    anonymous = g.user is None
+
+    current = not is_resource_modified(request.environ, etag=etag,
+                                       last_modified=last_modified if anonymous else None)
+
+    if current and "_flashes" not in session:
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    # Clients must check back before reusing a response
+    response.headers["Cache-Control"] = "public, no-cache" if anonymous else "private, no-cache"
+    response.vary.add("Cookie")
+
+    return response
 
 
 def organize_characters(queries, lst, new):
@@ -330,64 +1018,191 @@ def organize_characters(queries, lst, new):
     Prepares and adds characters to a list (ranked and unranked)
 
     Last field regards to if list is a new list or editing an already made list
+
+    Nothing is committed, so callers save the characters in one transaction
+    with the list and its new revision. Otherwise cards and pages cached
+    while the characters were being fetched would show the list without
+    them, under the revision it ends up with.
     """
-    # Add characters to list
-    # Add char ids to a list to iterate later if list is ranked
-    char_ids = []
-    lst.characters.clear()
-
-    # If the list is ranked and being edited (not a new list) then delete
-    # the current ranks of the characters in the list so any ranking changes
-    # are replaced without duplicates
-    if lst.is_ranked and not new:
-        lc = ListCharacter.query.filter(ListCharacter.list_id == lst.id).all()
-        for char in lc:
-            db.session.delete(char)
-            db.session.commit()
 
+    characters = resolve_characters(queries)
+
+    # Characters the list should end up with, in order and without duplicates,
+    # along with their ranks (None if the list is unranked)
+    wanted = {}
     for q in queries:
-        char = initialize_character(q)
-        lst.characters.append(char)
+        char_id = characters[q["guid"]].id
+        if char_id not in wanted:
+            wanted[char_id] = len(wanted) + 1 if lst.is_ranked else None
 
-        if lst.is_ranked:
-            char_ids.append(char.id)
+    # Make sure the list has a row for the characters to point at
+    db.session.flush()
 
-    db.session.commit()
+    # Compare against what the list has now, so only the characters that
+    # were added, removed or moved are written
+    current = {}
+    if not new:
+        current = dict(db.session.query(ListCharacter.character_id, ListCharacter.rank).filter(
+            ListCharacter.list_id == lst.id).all())
 
-    # Add ranks to characters if list is ranked
-    if lst.is_ranked:
-        lc = ListCharacter.query.filter(
-            ListCharacter.list_id == lst.id).all()
-        for index, char in enumerate(char_ids):
-            lc[index].rank = index + 1
-        print(lc, char_ids)
-        db.session.commit()
+    removed = [char_id for char_id in current if char_id not in wanted]
+    added = [char_id for char_id in wanted if char_id not in current]
+    reranked = {char_id: rank for char_id, rank in wanted.items()
+                if char_id in current and current[char_id] != rank}
+
+    if removed:
+        ListCharacter.query.filter(ListCharacter.list_id == lst.id).filter(
+            ListCharacter.character_id.in_(removed)).delete(synchronize_session=False)
+
+    if added:
+        db.session.execute(ListCharacter.__table__.insert(), [
+            {"list_id": lst.id, "character_id": char_id, "rank": wanted[char_id]}
+            for char_id in added])
+
+    if reranked:
+        ListCharacter.query.filter(ListCharacter.list_id == lst.id).filter(
+            ListCharacter.character_id.in_(list(reranked))).update(
+            {ListCharacter.rank: cast(case(reranked, value=ListCharacter.character_id), Integer)},
+            synchronize_session=False)
 
+    db.session.flush()
+
+
+def queue_list_characters(lst, characters, new):
+    """Queues a list's characters to be saved by a list job, unless
+    LIST_JOB_MODE is inline. Returns whether they were queued."""
+
+    if current_app.config["LIST_JOB_MODE"] == "inline":
+        return False
+
+    ListJob.enqueue(lst, characters, new)
+    return True
+
+
+def run_list_job(job):
+    """Saves a queued list job's characters to its list, committed by the
+    runner along with the end of the job"""
+
+    lst = List.query.get(job.list_id)
+
+    # The list was deleted since
+    if lst is None:
         return
 
+    organize_characters(convert_guids_to_api_queries(job.characters), lst, job.new)
+
 
 ####### CHARACTER FUNCTIONS ###############################
 
 
-@app.route("/search-characters", methods=["POST"])
+@bp.route("/search-characters", methods=["POST"])
 def search_api():
-    """Accepts request from the front end to look for new characters from the API"""
+    """
+    Accepts request from the front end to look for new characters from the API
+
+    Takes a JSON body with the search term and optionally the number of
+    results (up to MAX_SEARCH_LIMIT) and page. The GiantBomb url is built
+    here, so the API key stays on the server.
+    """
 
     if not g.user:
         flash("You need to be signed in to do that", "danger")
         return redirect("/register-home")
 
-    # Get information from request from front-end
-    req = request.json
-    data = json.loads(req["data"])
+    data = request.get_json(silent=True) or {}
+    term = " ".join(str(data.get("term", "")).lower().split())
+
+    try:
+        limit = int(data.get("limit", MAX_SEARCH_LIMIT))
+        page = int(data.get("page", 1))
+    except (TypeError, ValueError):
+        abort(400)
+
+    if not term or len(term) > MAX_SEARCH_TERM_LENGTH:
+        abort(400)
+
+    limit = min(max(limit, 1), MAX_SEARCH_LIMIT)
+    page = min(max(page, 1), MAX_SEARCH_PAGE)
+
+    # Popular searches are answered from the cache, and the same search
+    # arriving while it's being loaded waits for that load
+    cache_key = search_cache_key(term, limit, page)
+    char_list = search_cache.get(cache_key)
+
+    if char_list is None:
+        char_list = search_flights.do(cache_key, lambda: load_search(term, limit, page))
+
+    # Send to front end
+    character_results = {"character_results": char_list}
+    return jsonify(character_results)
+
+
+def search_cache_key(term, limit, page):
+    """Normalizes a search so searches that only differ by case or spacing
+    share the same cache entry"""
+
+    term = " ".join(term.lower().split())
+    return f"{limit}:{page}:{term}"
+
+
+def load_search(term, limit, page):
+    """
+    Finds the characters for a search and caches them
+
+    Searches with enough matches among the characters stored locally don't
+    need the API. Later pages always come from the API, so they carry on
+    from its first page.
+    """
+
+    char_list = []
+
+    if page == 1:
+        char_list = search_local_characters(term, limit)
+
+    if page > 1 or len(char_list) < min(limit, current_app.config["LOCAL_SEARCH_MIN_RESULTS"]):
+        char_list = fetch_search_results(term, limit, page)
+
+        # Store the results in the background, so adding one to a list
+        # doesn't have to wait on the API
+        if current_app.config["CHARACTER_SYNC_ENABLED"]:
+            character_sync.prefetch([char["guid"] for char in char_list])
+
+    search_cache.set(search_cache_key(term, limit, page), char_list)
+    return char_list
+
+
+def search_local_characters(term, limit):
+    """
+    Full text search of the characters stored locally, by name and game
+
+    Every word of term matches as a prefix, so results show up while a name
+    is still being typed. Exact name matches come first, then the best
+    ranked, with name matches ranked above game matches.
+    """
+
+    words = re.findall(r"\w+", term.lower())
+    if not words:
+        return []
+
+    query = db.func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words))
+    vector = Character.search_vector()
+
+    chars = Character.query.filter(Character.guid != None).filter(
+        vector.op("@@")(query)).order_by(
+        (db.func.lower(Character.name) == " ".join(words)).desc(),
+        db.func.ts_rank(vector, query).desc(),
+        db.func.length(Character.name),
+        Character.name).limit(limit).all()
 
-    # Information to send in request
-    api_query = data["query"]
+    return [{"name": char.name, "image_url": char.image_url, "guid": char.guid}
+            for char in chars]
+
+
+def fetch_search_results(term, limit, page):
+    """Searches the API and keeps only the character info the front end needs"""
 
     # Send request and unpack information
-    res = requests.get(api_query, headers=HEADERS)
-    data = json.loads(res.text)
-    search_results = data["results"]
+    search_results = api_client.search(search_url(term, limit, page))[:limit]
 
     char_list = []
 
@@ -405,9 +1220,7 @@ def search_api():
 
         char_list.append(character)
 
-    # Send to front end
-    character_results = {"character_results": char_list}
-    return jsonify(character_results)
+    return char_list
 
 
 def convert_guids_to_api_queries(guid_string):
@@ -418,7 +1231,7 @@ def convert_guids_to_api_queries(guid_string):
 
     query_list = []
     for guid in guid_list:
-        query = f"https://www.giantbomb.com/api/character/{guid}/?api_key=7257597392c1160f53ddc5354ec336518380ec17&format=json"
+        query = character_url(guid)
         g_and_q = {"guid": guid,
                    "query": query}
         query_list.append(g_and_q)
@@ -431,46 +1244,91 @@ def initialize_character(query):
     if char not added queries API to get character data and creates
     character in DB"""
 
-    char = Character.query.filter(
-        Character.guid == query["guid"]).all()
+    return resolve_characters([query])[query["guid"]]
 
-    if not char:
-        res = requests.get(query["query"], headers=HEADERS)
-        data = json.loads(res.text)
-        char_info = data["results"]
 
-        new_char = Character(
-            guid=char_info["guid"],
-            name=char_info["name"],
-            game=game_list_to_string(char_info["games"]),
-            image_url=char_info["image"]["thumb_url"]
-        )
+def resolve_characters(queries):
+    """
+    Returns a dictionary of guid -> Character for every query
 
-        db.session.add(new_char)
-        db.session.commit()
+    Characters already in the db are found with one query. The rest are
+    fetched from the API concurrently and then added to the db in one
+    statement.
+    """
+
+    characters = find_characters([q["guid"] for q in queries])
+
+    missing = {}
+    for query in queries:
+        if query["guid"] not in characters:
+            missing[query["guid"]] = query
+
+    if missing:
+        fetched = fetch_characters(list(missing.values()))
+        insert_characters(fetched.values())
+
+        characters.update(find_characters(list(fetched)))
+
+    return characters
 
-        return new_char
 
-    return char[0]
+def find_characters(guids):
+    """Looks up every character with one of the given guids in a single query,
+    returns a dictionary of guid -> Character"""
 
+    if not guids:
+        return {}
 
-def game_list_to_string(game_list):
-    """Converts list of games a character has appeared in to a string to store in db"""
+    chars = Character.query.filter(Character.guid.in_(guids)).all()
 
-    games = ""
-    for game in game_list:
-        name = game["name"]
-        if games == "":
-            games = name
-        elif len(games) < 100:
-            games = games + ", " + name
+    return {char.guid: char for char in chars}
 
-    return games
+
+def insert_characters(char_infos):
+    """
+    Adds characters from API data to the db in one statement
+
+    Characters another request added in the meantime are skipped rather than
+    duplicated, thanks to the unique index on characters.guid. Nothing is
+    committed, so they're saved with the list they were fetched for.
+    """
+
+    rows = [Character.values_from_api(char_info) for char_info in char_infos]
+
+    if rows:
+        stmt = insert(Character.__table__).values(rows).on_conflict_do_nothing(
+            index_elements=["guid"])
+        db.session.execute(stmt)
+
+
+def fetch_characters(queries):
+    """
+    Queries the API for every character in queries at the same time, using
+    a bounded pool of threads so one slow character doesn't hold up the rest
+
+    Returns a dictionary of guid -> character data from the API
+    """
+
+    if not queries:
+        return {}
+
+    workers = min(current_app.config["GIANTBOMB_MAX_WORKERS"], len(queries))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(fetch_character, queries)
+
+        return {query["guid"]: char_info for query, char_info in zip(queries, results)}
+
+
+def fetch_character(query):
+    """Gets a single character's data from the API"""
+
+    return api_client.get_character(query["query"])
 
 
 ####### USER FUNCTIONS ###############################
 
-@app.route("/users/<username>")
+@bp.route("/users/<username>")
 def show_profile(username):
     """Shows user profile"""
 
@@ -483,16 +1341,56 @@ def show_profile(username):
     if g.user.username == username:
         own_profile = True
 
-    user = User.query.filter(User.username == username).first()
-    lists = List.query.filter(List.user_id == user.id).all()
-    lists.reverse()
+    before = request.args.get("before", None, type=int)
 
-    lists = format_lists(lists)
+    profile = load_profile(username, g.user.id, before)
+    if profile is None:
+        abort(404)
 
-    return render_template("user.html", own_profile=own_profile, user=user, lists=lists)
+    user = profile["user"]
+    lists = profile["lists"]
 
+    def build():
+        cards = render_list_cards(lists, "profile")
 
-@app.route("/users/<username>/edit", methods=["GET", "POST"])
+        return render_template("user.html", own_profile=own_profile, user=user, cards=cards,
+                               is_followed=profile["is_followed"],
+                               next_before=profile["next_before"])
+
+    etag = page_etag(user.id, user.updated_at, profile["is_followed"],
+                     [(lst.id, lst.revision) for lst in lists])
+    last_modified = max([user.updated_at] + [lst.updated_at for lst in lists])
+
+    return conditional_response(etag, build, last_modified)
+
+
+def load_profile(username, viewer_id, before=None):
+    """
+    Loads what the profile page shows about a user in two queries: the user
+    with their counters and whether viewer_id follows them (an EXISTS
+    subquery), then one page of their public lists older than before
+
+    Returns None if there's no such user.
+    """
+
+    is_followed = db.exists().where(Follows.user_being_followed == User.id).where(
+        Follows.user_following == viewer_id)
+
+    row = db.session.query(User, is_followed.label("is_followed")).filter(
+        User.username == username).first()
+
+    if row is None:
+        return None
+
+    user, is_followed = row
+
+    lists, next_before = paginate_lists(
+        List.query.filter(List.user_id == user.id).filter(List.is_private == False), before)
+
+    return {"user": user, "is_followed": is_followed, "lists": lists, "next_before": next_before}
+
+
+@bp.route("/users/<username>/edit", methods=["GET", "POST"])
 def edit_profile(username):
     """Edit form for user profile"""
 
@@ -500,7 +1398,9 @@ def edit_profile(username):
         flash("You must sign in or register before you can do that", "danger")
         return redirect("/register-home")
 
-    if g.user.username != username:
+    # Permission checks on the account itself use the username from the db,
+    # in case it was changed from another session
+    if g.user.row.username != username:
         flash("You don't have permission to do that", "danger")
         return redirect("/")
 
@@ -510,12 +1410,18 @@ def edit_profile(username):
     form = EditUserForm(obj=g.user)
 
     if form.validate_on_submit():
+        if not login_throttle.allow(request.remote_addr, g.user.row.username):
+            return too_many_attempts("edit-profile.html", form)
+
         user = User.authenticate(
-            username=g.user.username,
+            username=g.user.row.username,
             password=form.password.data
         )
         if user:
             try:
+                if user.username != form.username.data:
+                    List.bump_revisions(List.user_id == user.id)
+
                 user.username = form.username.data
                 user.image_url = form.image_url.data or DEFAULT_IMAGE_URL
                 user.favorite_character = form.favorite_character.data
@@ -526,8 +1432,9 @@ def edit_profile(username):
                 flash("Username taken", "danger")
                 return render_template('register.html', form=form)
 
+            # Also caches the new username for the user's other sessions
             do_login(user)
-            return redirect(f"/users/{g.user.username}")
+            return redirect(f"/users/{user.username}")
 
         flash("Invalid password", "danger")
         return render_template("edit-profile.html", form=form)
@@ -535,7 +1442,7 @@ def edit_profile(username):
     return render_template("edit-profile.html", form=form)
 
 
-@app.route("/users/<username>/delete", methods=["GET", "POST"])
+@bp.route("/users/<username>/delete", methods=["GET", "POST"])
 def delete_profile(username):
     """Shows a warning message to confirm deletion"""
 
@@ -543,22 +1450,26 @@ def delete_profile(username):
         flash("You don't have permission to do that", "danger")
         return redirect("/")
 
-    if g.user.username != username:
+    if g.user.row.username != username:
         flash("You don't have permission to do that", "danger")
         return redirect("/")
 
     if request.method == 'POST':
 
         do_logout()
-        db.session.delete(g.user)
+        g.user.remove_from_follow_counts()
+        db.session.delete(g.user.row)
         db.session.commit()
 
+        # Other sessions of the user are logged out on their next request
+        forget_identity(g.user.id)
+
         return redirect("/register-home")
 
     return render_template("delete-profile.html")
 
 
-@app.route("/users/<int:user_id>/follow", methods=["POST"])
+@bp.route("/users/<int:user_id>/follow", methods=["POST"])
 def follow_user(user_id):
     """Currently logged in user will start following the selected user"""
 
@@ -568,13 +1479,13 @@ def follow_user(user_id):
 
     user_to_follow = User.query.get_or_404(user_id)
 
-    g.user.following.append(user_to_follow)
+    g.user.follow(user_to_follow)
     db.session.commit()
 
     return redirect(f"/users/{user_to_follow.username}")
 
 
-@app.route("/users/<int:user_id>/unfollow", methods=["POST"])
+@bp.route("/users/<int:user_id>/unfollow", methods=["POST"])
 def unollow_user(user_id):
     """Currently logged in user will stop following the selected user"""
 
@@ -584,27 +1495,30 @@ def unollow_user(user_id):
 
     user_to_follow = User.query.get_or_404(user_id)
 
-    g.user.following.remove(user_to_follow)
+    g.user.unfollow(user_to_follow)
     db.session.commit()
 
     return redirect(f"/users/{user_to_follow.username}")
 
 
-@app.route("/users/<username>/private-lists", methods=["GET"])
+@bp.route("/users/<username>/private-lists", methods=["GET"])
 def see_private_lists(username):
     """Page to see user's private lists (only way you can see private lists)"""
 
-    if not g.user or g.user.username != username:
+    if not g.user or g.user.row.username != username:
         flash("You don't have permission to see that", "danger")
         return redirect("/")
 
     user = User.query.filter(User.username == username).first()
 
     l = List.query.filter(List.user_id == user.id).filter(
-        List.is_private == True).all()
+        List.is_private == True).order_by(List.id.desc()).all()
+
+    cards = render_list_cards(l, "index")
 
-    l.reverse()
+    return render_template("private-lists.html", cards=cards)
 
-    lists = format_lists(l)
 
-    return render_template("private-lists.html", lists=lists)
+# The app gunicorn and the tests import, built from the profile named by
+# EPICLIST_CONFIG
+app = create_app(os.environ.get("EPICLIST_CONFIG", "production"))
@@ -0,0 +1,84 @@
+"""
+Threads running work in the background of each web process
+
+CharacterSync and ListJobRunner both repeat a unit of work every interval
+seconds, or as soon as they're woken up, in daemon threads started by
+create_app() or by their `--forever` command.
+"""
+
+import logging
+import threading
+
+
+class BackgroundWorker:
+    """
+    Runs run_once() in threads daemon threads, each with an app context,
+    every interval seconds or as soon as wake() is called
+
+    Subclasses define run_once() and set name, used for the threads and in
+    the log message when a run fails, and logger. run_once() can check
+    stopping() to finish early.
+    """
+
+    name = "worker"
+    logger = logging.getLogger("epiclist")
+
+    def __init__(self, app, interval, threads=1):
+        self.app = app
+        self.interval = interval
+        self.threads = threads
+
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def wake(self):
+        self._wake.set()
+
+    def stopping(self):
+        return self._stop.is_set()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Starts the threads unless they're already running in this process.
+        Workers forked from a preloaded app start their own."""
+
+        if self.is_running():
+            return
+
+        with self._start_lock:
+            if self.is_running():
+                return
+
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self.run_forever, daemon=True,
+                                 name=self.name if self.threads == 1 else f"{self.name}-{index}")
+                for index in range(self.threads)]
+
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+        for thread in self._threads:
+            thread.join()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.run_once()
+            except Exception:
+                self.logger.exception(f"Running {self.name} failed")
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self):
+        raise NotImplementedError
@@ -0,0 +1,535 @@
+"""
+Benchmarks for the request hot paths
+
+Seeds a separate database with synthetic users, follows, lists and
+characters, then times the index, following feed, list, profile, create list
+and character search routes against a local mock of the GiantBomb API.
+Requests go through the Flask test client by default, or through a local
+gunicorn with --gunicorn.
+
+For every route it reports p50/p95/p99 latency and the SQL queries per
+request, and for the test client also peak Python memory per request. Results can
+be saved as a baseline, and later runs compared against it, exiting with
+status 1 when a route got slower, uses more queries or more memory.
+
+    python benchmark.py --scale 1k --seed --save-baseline bench_baseline.json
+    python benchmark.py --scale 1k --baseline bench_baseline.json
+    python benchmark.py --scale 100k --seed --gunicorn --workers 4 --concurrency 8
+
+--seed drops and recreates every table in the benchmark database
+(BENCH_DATABASE_URL, postgres:///epiclist_bench by default).
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+from mock_giantbomb import MockGiantBomb
+
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+
+BENCH_PASSWORD = "benchpassword"
+CHARACTERS_PER_LIST = 5
+SEARCH_TERMS = [f"term{i}" for i in range(25)]
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+####### SEEDING ###############################
+
+SEED_STATEMENTS = [
+    """INSERT INTO users (id, username, password, image_url)
+       SELECT g, 'bench' || g, :password, :image_url
+       FROM generate_series(1, :users) g""",
+
+    # Every user follows the next few users along, so everyone has the same
+    # number of followers and people they follow
+    """INSERT INTO follows (user_following, user_being_followed)
+       SELECT u, ((u - 1 + j) % :users) + 1
+       FROM generate_series(1, :users) u, generate_series(1, :follows) j""",
+
+    """INSERT INTO characters (id, guid, name, game, image_url)
+       SELECT g, '3005-' || g, 'Character ' || g, 'Game ' || g,
+              'https://images.example.com/3005-' || g || '.png'
+       FROM generate_series(1, :characters) g""",
+
+    # Every tenth list is private and every other list is ranked
+    """INSERT INTO lists (id, title, user_id, is_ranked, is_private)
+       SELECT g, 'List ' || g, (g % :users) + 1, g % 2 = 0, g % 10 = 0
+       FROM generate_series(1, :lists) g""",
+
+    """INSERT INTO lists_characters (list_id, character_id, rank)
+       SELECT l, ((l * 31 + n * 7) % :characters) + 1,
+              CASE WHEN l % 2 = 0 THEN n END
+       FROM generate_series(1, :lists) l, generate_series(1, :per_list) n""",
+
+    """INSERT INTO feed_entries (user_id, list_id)
+       SELECT f.user_following, l.id
+       FROM lists l JOIN follows f ON f.user_being_followed = l.user_id
+       WHERE NOT l.is_private""",
+
+    """UPDATE users SET following_count = c.n
+       FROM (SELECT user_following AS id, count(*) AS n FROM follows GROUP BY 1) c
+       WHERE c.id = users.id""",
+
+    """UPDATE users SET followers_count = c.n
+       FROM (SELECT user_being_followed AS id, count(*) AS n FROM follows GROUP BY 1) c
+       WHERE c.id = users.id""",
+
+    """UPDATE users SET public_lists_count = c.n
+       FROM (SELECT user_id AS id, count(*) AS n FROM lists WHERE NOT is_private GROUP BY 1) c
+       WHERE c.id = users.id"""
+]
+
+
+def scale_sizes(lists, follows):
+    """Number of users, characters and follows per user for a number of lists"""
+
+    users = max(lists // 10, 10)
+
+    return {
+        "lists": lists,
+        "users": users,
+        "characters": max(lists // 5, 100),
+        "follows": min(follows, users - 1),
+        "per_list": CHARACTERS_PER_LIST
+    }
+
+
+def seed(db, hasher, sizes):
+    """Recreates every table and fills them with synthetic data"""
+
+    from models import DEFAULT_IMAGE_URL
+
+    db.drop_all()
+    db.create_all()
+
+    params = dict(sizes,
+                  password=hasher.hash(BENCH_PASSWORD),
+                  image_url=DEFAULT_IMAGE_URL)
+
+    for statement in SEED_STATEMENTS:
+        db.session.execute(statement, params)
+
+    for table in ["users", "characters", "lists", "lists_characters"]:
+        db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                           f"(SELECT max(id) FROM {table}))")
+
+    db.session.commit()
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+####### ROUTES ###############################
+
+def public_list_id(i, sizes):
+    """A public list, spread over the whole table"""
+
+    list_id = (i * 7919) % sizes["lists"] + 1
+    return list_id + 1 if list_id % 10 == 0 else list_id
+
+
+def new_list_form(i, sizes):
+    """Form for a new list of seeded characters plus one the app has to
+    fetch from the API"""
+
+    guids = [f"3005-{(i * 13 + n) % sizes['characters'] + 1}" for n in range(4)]
+    guids.append(f"3005-new{i}")
+
+    return {"title": f"Bench list {i}", "is_ranked": "y", "characters": ", ".join(guids)}
+
+
+def search_data(i):
+    return {"term": SEARCH_TERMS[i % len(SEARCH_TERMS)], "limit": 10}
+
+
+def make_routes(sizes):
+    """Route name -> function of the request number giving the request to send
+    as (method, path, form data, json body)"""
+
+    return {
+        "index": lambda i: ("GET", "/", None, None),
+        "index_following": lambda i: ("GET", "/?filter=true", None, None),
+        "view_list": lambda i: ("GET", f"/lists/{public_list_id(i, sizes)}", None, None),
+        "show_profile": lambda i: ("GET", f"/users/bench{i % sizes['users'] + 1}", None, None),
+        "create_list": lambda i: ("POST", "/lists/new", new_list_form(i, sizes), None),
+        "search_api": lambda i: ("POST", "/search-characters", None, search_data(i))
+    }
+
+
+####### MEASURING ###############################
+
+def timing(method, res, seconds):
+    """How long a request took, whether it succeeded and how many queries the
+    app reported running for it
+
+    Pages redirect when the session isn't logged in (or its user is gone),
+    so a redirect answering a GET counts as a failure rather than a fast
+    success."""
+
+    ok = res.status_code < 300 or res.status_code == 304 or (
+        method != "GET" and res.status_code < 400)
+
+    return seconds, ok, int(res.headers.get("X-DB-Query-Count", 0))
+
+
+def summarize(timings, peak_bytes=None):
+    """Latency percentiles in milliseconds and queries per request, plus
+    memory if measured"""
+
+    # Imported here since giantbomb picks its API url on import, which main()
+    # points at the mock first
+    from giantbomb import percentile
+
+    latencies = sorted(seconds for seconds, ok, queries in timings)
+    queries = [queries for seconds, ok, queries in timings]
+
+    summary = {
+        "requests": len(latencies),
+        "errors": sum(not ok for seconds, ok, queries in timings),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "queries_avg": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        "queries_max": max(queries, default=0)
+    }
+
+    if peak_bytes is not None:
+        summary["peak_kb"] = round(peak_bytes / 1024, 1)
+
+    return summary
+
+
+def run_test_client(epiclist, routes, args):
+    """Times every route through the Flask test client. Memory is measured in
+    a separate pass, since tracing allocations slows every request down."""
+
+    app = epiclist.app
+    app.config["WTF_CSRF_ENABLED"] = False
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[epiclist.CURR_USER_KEY] = 1
+        epiclist.remember_identity(1, "bench1")
+
+    def send(route, i):
+        method, path, data, body = routes[route](i)
+
+        start = time.perf_counter()
+        res = client.open(path, method=method, data=data, json=body)
+        return timing(method, res, time.perf_counter() - start)
+
+    results = {}
+    number = 0
+
+    for route in routes:
+        for i in range(args.warmup):
+            send(route, number)
+            number += 1
+
+        timings = []
+
+        for i in range(args.requests):
+            timings.append(send(route, number))
+            number += 1
+
+        peak = 0
+        for i in range(args.memory_requests):
+            tracemalloc.start()
+            send(route, number)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            number += 1
+
+        results[route] = summarize(timings, peak)
+
+    return results
+
+
+def run_gunicorn(routes, args, env):
+    """Times every route through a local gunicorn, from several concurrent
+    logged in clients"""
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+
+    server = subprocess.Popen(
+        ["gunicorn", "--preload", "--workers", str(args.workers),
+         "--bind", f"127.0.0.1:{port}", "app:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_server(f"{base}/register-home", server)
+
+        # Logged in once, so the clients don't trip the login throttle, and
+        # every client sends the same session cookie
+        login, csrf = gunicorn_login(base)
+        local = threading.local()
+
+        def send(route, i):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+                local.session.cookies.update(login.cookies)
+
+            method, path, data, body = routes[route](i)
+            if data is not None:
+                data = dict(data, csrf_token=csrf)
+
+            start = time.perf_counter()
+            res = local.session.request(method, f"{base}{path}", data=data, json=body,
+                                        allow_redirects=False)
+            return timing(method, res, time.perf_counter() - start)
+
+        results = {}
+        number = 0
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for route in routes:
+                list(pool.map(lambda i: send(route, i),
+                              range(number, number + args.warmup)))
+                number += args.warmup
+
+                start = time.perf_counter()
+                timings = list(pool.map(lambda i: send(route, i),
+                                        range(number, number + args.requests)))
+                elapsed = time.perf_counter() - start
+                number += args.requests
+
+                summary = summarize(timings)
+                summary["requests_per_sec"] = round(args.requests / elapsed, 1)
+                results[route] = summary
+
+        return results
+
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def gunicorn_login(base):
+    """Logs a new session in as the benchmark user, returning the session and
+    a CSRF token for its forms"""
+
+    session = requests.Session()
+
+    res = session.get(f"{base}/login")
+    csrf = CSRF_TOKEN.search(res.text).group(1)
+
+    res = session.post(f"{base}/login", allow_redirects=False,
+                       data={"username": "bench1", "password": BENCH_PASSWORD, "csrf_token": csrf})
+
+    # A successful login redirects to the index, a failed one shows the form
+    # again and a throttled one is a 429
+    if res.status_code != 302 or urlsplit(res.headers.get("Location", "")).path != "/":
+        raise RuntimeError(f"Logging in as bench1 failed with status {res.status_code}")
+
+    return session, csrf
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(url, server, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited before it started serving")
+
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+
+    raise RuntimeError(f"gunicorn did not start serving within {timeout} seconds")
+
+
+####### REPORTING ###############################
+
+def find_regressions(results, baseline, threshold, slack_ms):
+    """
+    Compares results with a baseline, returning a description of every
+    regression
+
+    Latencies and memory regress when they grow by more than threshold (a
+    fraction) and, for latencies, by more than slack_ms too so noise on very
+    fast routes isn't reported. Any increase in queries is a regression.
+    """
+
+    regressions = []
+
+    for route, base in baseline["routes"].items():
+        current = results["routes"].get(route)
+        if current is None:
+            continue
+
+        for metric in ["p50_ms", "p95_ms", "p99_ms"]:
+            limit = max(base[metric] * (1 + threshold), base[metric] + slack_ms)
+            if current[metric] > limit:
+                regressions.append(f"{route} {metric}: {current[metric]} > {round(limit, 2)}")
+
+        if "queries_max" in base and current.get("queries_max", 0) > base["queries_max"]:
+            regressions.append(f"{route} queries_max: {current['queries_max']} > {base['queries_max']}")
+
+        if "peak_kb" in base and current.get("peak_kb", 0) > base["peak_kb"] * (1 + threshold):
+            regressions.append(f"{route} peak_kb: {current['peak_kb']} > "
+                               f"{round(base['peak_kb'] * (1 + threshold), 1)}")
+
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{route} errors: {current['errors']} > {base['errors']}")
+
+    return regressions
+
+
+def format_report(results):
+    columns = ["requests", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+               "queries_avg", "queries_max", "peak_kb", "requests_per_sec"]
+    columns = [c for c in columns if any(c in r for r in results["routes"].values())]
+
+    lines = [f"EpicList benchmark | {results['mode']} | "
+             + ", ".join(f"{k}={v}" for k, v in results["sizes"].items()),
+             "",
+             f"{'route':<18}" + "".join(f"{c:>18}" for c in columns)]
+
+    for route, summary in results["routes"].items():
+        lines.append(f"{route:<18}" + "".join(f"{summary.get(c, ''):>18}" for c in columns))
+
+    # GiantBomb calls and cache hits of the app, only known in test client mode
+    metrics = results.get("metrics")
+
+    if metrics:
+        lines.append("")
+
+        for call, latency in metrics["giantbomb"].items():
+            lines.append(f"giantbomb {call}: " + ", ".join(f"{k}={v}" for k, v in latency.items()))
+
+        for name, stats in metrics.items():
+            if name != "giantbomb":
+                lines.append(f"{name}: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EpicList request hot paths")
+
+    parser.add_argument("--database-url",
+                        default=os.environ.get("BENCH_DATABASE_URL", "postgres:///epiclist_bench"))
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1k",
+                        help="number of lists to seed")
+    parser.add_argument("--follows", type=int, default=20, help="follows per user")
+    parser.add_argument("--seed", action="store_true",
+                        help="drop, recreate and fill every table before running")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per route")
+    parser.add_argument("--memory-requests", type=int, default=10,
+                        help="requests per route traced for memory")
+    parser.add_argument("--api-delay", type=float, default=0.0,
+                        help="seconds the mock GiantBomb API takes to respond")
+    parser.add_argument("--routes", nargs="+", help="only benchmark these routes")
+
+    parser.add_argument("--gunicorn", action="store_true",
+                        help="send requests to a local gunicorn instead of the test client")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="concurrent clients sending requests to gunicorn")
+
+    parser.add_argument("--output", default="bench_output.txt", help="file to write the report to")
+    parser.add_argument("--save-baseline", help="save the results as a baseline JSON file")
+    parser.add_argument("--baseline", help="baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction latencies and memory may grow by before failing")
+    parser.add_argument("--slack-ms", type=float, default=5.0,
+                        help="milliseconds latencies may always grow by before failing")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.database_url.rstrip("/").endswith("/epiclist"):
+        sys.exit("Refusing to benchmark against the app's own database")
+
+    mock = MockGiantBomb(delay=args.api_delay).start()
+
+    # Set before the app is imported, since it connects and picks its API url
+    # on import. The gunicorn workers inherit the same environment. The
+    # background character sync is left off so it can't skew the timings, and
+    # the app sends its query counts in the response headers.
+    env = dict(os.environ, DATABASE_URL=args.database_url, GIANTBOMB_API_URL=mock.url,
+               CHARACTER_SYNC_ENABLED="0", SQL_QUERY_HEADERS="1")
+    os.environ.update(env)
+
+    import app as epiclist
+    from passwords import hasher
+
+    sizes = scale_sizes(SCALES[args.scale], args.follows)
+
+    if args.seed:
+        start = time.perf_counter()
+        seed(epiclist.db, hasher, sizes)
+        print(f"Seeded {args.scale} in {time.perf_counter() - start:.1f}s")
+
+    routes = make_routes(sizes)
+    if args.routes:
+        routes = {name: routes[name] for name in args.routes}
+
+    try:
+        if args.gunicorn:
+            route_results = run_gunicorn(routes, args, env)
+        else:
+            route_results = run_test_client(epiclist, routes, args)
+    finally:
+        mock.stop()
+
+    results = {"mode": "gunicorn" if args.gunicorn else "test client",
+               "sizes": sizes, "routes": route_results}
+
+    if not args.gunicorn:
+        results["metrics"] = epiclist.metrics_reporter.collect()
+
+    report = format_report(results)
+    print(report)
+
+    with open(args.output, "w") as f:
+        f.write(report + "\n")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = find_regressions(results, baseline, args.threshold, args.slack_ms)
+
+        if regressions:
+            print("\nRegressions against " + args.baseline + ":")
+            print("\n".join(regressions))
+            return 1
+
+        print(f"\nNo regressions against {args.baseline}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Caches used by the app
+
+MemoryCache keeps entries inside the current process. RedisCache keeps them
+in Redis so every gunicorn worker shares the same entries, and needs the
+optional redis package. make_cache picks between them from the app config.
+
+SingleFlight makes concurrent misses for the same key share one load instead
+of each doing it, within a process. SharedFlight does the same across
+processes, through a cache every process shares.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """
+    In-process cache where every entry expires after ttl seconds
+
+    Once the cache holds max_entries, adding a new entry evicts the least
+    recently used one. Hits and misses are counted for stats().
+    """
+
+    def __init__(self, ttl=300, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if missing or expired"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, keys):
+        """Returns the cached values for keys, in order, with None for misses"""
+
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        """Adds one to a counter and returns its new value. Counters expire
+        ttl seconds after they were started."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                entry = (time.monotonic() + self.ttl, 0)
+
+            self._entries[key] = entry = (entry[0], entry[1] + 1)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class RedisCache:
+    """
+    Cache shared by every worker through Redis
+
+    Values are stored as JSON with a TTL. A sorted set of keys by last use
+    keeps the cache to max_entries, evicting the least recently used keys,
+    and a sorted set of keys by expiry drops keys that Redis expired from
+    it. Hit and miss counters are kept in Redis too, so stats() covers every
+    worker.
+    """
+
+    def __init__(self, url, prefix, ttl=300, max_entries=1000):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def _ttl_ms(self):
+        # In milliseconds, since TTLs under a second would round down to an
+        # expiry of 0 seconds, which Redis refuses
+        return max(int(self.ttl * 1000), 1)
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+
+        pipe = self.client.pipeline()
+        if value is None:
+            pipe.incr(f"{self.prefix}:__misses__")
+            pipe.zrem(f"{self.prefix}:__recent__", key)
+            pipe.zrem(f"{self.prefix}:__expires__", key)
+        else:
+            pipe.incr(f"{self.prefix}:__hits__")
+            pipe.zadd(f"{self.prefix}:__recent__", {key: time.time()})
+        pipe.execute()
+
+        if value is None:
+            return None
+
+        return json.loads(value)
+
+    def get_many(self, keys):
+        """Returns the cached values for keys in one round trip, in order,
+        with None for misses"""
+
+        if not keys:
+            return []
+
+        values = self.client.mget([self._key(key) for key in keys])
+        hits = {key: time.time() for key, value in zip(keys, values) if value is not None}
+
+        pipe = self.client.pipeline()
+        pipe.incrby(f"{self.prefix}:__hits__", len(hits))
+        pipe.incrby(f"{self.prefix}:__misses__", len(keys) - len(hits))
+        if hits:
+            pipe.zadd(f"{self.prefix}:__recent__", hits)
+        pipe.execute()
+
+        return [None if value is None else json.loads(value) for value in values]
+
+    def set(self, key, value):
+        recent = f"{self.prefix}:__recent__"
+        expires = f"{self.prefix}:__expires__"
+        now = time.time()
+
+        # Keys Redis already expired would otherwise count towards
+        # max_entries, and live keys would be evicted early
+        expired = self.client.zrangebyscore(expires, "-inf", now)
+
+        pipe = self.client.pipeline()
+        if expired:
+            pipe.zrem(recent, *expired)
+            pipe.zrem(expires, *expired)
+        pipe.set(self._key(key), json.dumps(value), px=self._ttl_ms())
+        pipe.zadd(recent, {key: now})
+        pipe.zadd(expires, {key: now + self.ttl})
+        pipe.zcard(recent)
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = [k for k, _ in self.client.zpopmin(recent, size - self.max_entries)]
+            if evicted:
+                self.client.pipeline().delete(
+                    *[self._key(k.decode("utf-8")) for k in evicted]).zrem(
+                    expires, *evicted).execute()
+
+    def incr(self, key):
+        """Adds one to a counter and returns its new value. Counters expire
+        ttl seconds after they were started, and aren't evicted before.
+
+        The counter is started with its expiry in the same transaction as the
+        increment, so it can't be left behind without one.
+        """
+
+        _, value = self.client.pipeline().set(
+            self._key(key), 0, nx=True, px=self._ttl_ms()).incr(
+            self._key(key)).execute()
+
+        return value
+
+    def delete(self, key):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(key))
+        pipe.zrem(f"{self.prefix}:__recent__", key)
+        pipe.zrem(f"{self.prefix}:__expires__", key)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        hits, misses, entries = self.client.pipeline().get(
+            f"{self.prefix}:__hits__").get(
+            f"{self.prefix}:__misses__").zcard(
+            f"{self.prefix}:__recent__").execute()
+
+        return {"hits": int(hits or 0), "misses": int(misses or 0), "entries": entries}
+
+
+class SingleFlight:
+    """
+    Runs one load at a time per key in this process
+
+    Callers asking for a key that's already being loaded wait for that load
+    and get its result, or its exception, instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, load):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = load()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+def make_cache(config, prefix, ttl, max_entries):
+    """Creates the cache backend chosen by CACHE_BACKEND in the app config"""
+
+    backend = config.get("CACHE_BACKEND", "memory")
+
+    if backend == "redis":
+        return RedisCache(config["CACHE_REDIS_URL"], prefix, ttl, max_entries)
+
+    if backend == "memory":
+        return MemoryCache(ttl, max_entries)
+
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class SharedFlight:
+    """
+    Runs one load at a time per key across every process sharing the locks
+    and results caches, for sync workers that each handle one request
+
+    The caller that takes a key's lock in locks runs the load, which stores
+    its result in results under the same key. Other callers poll results
+    for up to wait seconds, then load it themselves if the result still
+    isn't there. Locks expire with the locks cache's ttl, in case their
+    holder dies. Callers in the same process share their wait through a
+    SingleFlight.
+    """
+
+    def __init__(self, locks, results, wait=10, poll=0.05):
+        self.locks = locks
+        self.results = results
+        self.wait = wait
+        self.poll = poll
+        self._local = SingleFlight()
+
+    def do(self, key, load):
+        return self._local.do(key, lambda: self._do(key, load))
+
+    def _do(self, key, load):
+        if self.locks.incr(key) == 1:
+            try:
+                return load()
+            finally:
+                self.locks.delete(key)
+
+        deadline = time.monotonic() + self.wait
+
+        while time.monotonic() < deadline:
+            time.sleep(self.poll)
+
+            result = self.results.get(key)
+            if result is not None:
+                return result
+
+            # The holder finished without storing a result
+            if self.locks.get(key) is None:
+                break
+
+        result = self.results.get(key)
+        return result if result is not None else load()
+
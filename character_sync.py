@@ -0,0 +1,156 @@
+"""
+Background sync of the local copy of GiantBomb characters
+
+Characters are stored the first time they're added to a list. The sync
+worker fetches characters seen in search results ahead of time, so adding
+them to a list doesn't wait on the API, and refreshes stored characters once
+they're older than max_age. Calls to the API are paced by a token bucket to
+stay under GiantBomb's rate limit, kept in the database by SharedTokenBucket
+so the sync in every worker shares it.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from background import BackgroundWorker
+from giantbomb import character_url
+from models import db, Character, RateLimit
+
+logger = logging.getLogger("epiclist.sync")
+
+
+class SharedTokenBucket:
+    """
+    Rate limiter allowing rate calls per second on average across every
+    process using the bucket called name. Up to capacity calls can be made at
+    once after a quiet period.
+
+    Needs an app context.
+    """
+
+    def __init__(self, name, rate, capacity=1):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+    def try_acquire(self):
+        """Takes a token if one is available, returns whether it did"""
+
+        return RateLimit.take(self.name, self.rate, self.capacity) == 0
+
+    def acquire(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for a token, returns
+        whether one was taken"""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            wait = RateLimit.take(self.name, self.rate, self.capacity)
+            if wait == 0:
+                return True
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            time.sleep(wait)
+
+
+class CharacterSync(BackgroundWorker):
+    """
+    Worker thread fetching queued and stale characters every interval seconds,
+    or as soon as new characters are queued with prefetch()
+
+    Each run fetches at most batch_size characters. Only max_pending
+    characters are kept queued, later ones are dropped until there's room.
+    """
+
+    name = "character-sync"
+    logger = logger
+
+    def __init__(self, app, client, bucket, max_age, interval=60, batch_size=20, max_pending=1000):
+        super().__init__(app, interval)
+        self.client = client
+        self.bucket = bucket
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prefetch(self, guids):
+        """Queues characters to be stored before they're added to a list"""
+
+        with self._lock:
+            for guid in guids:
+                if len(self._pending) >= self.max_pending:
+                    break
+                self._pending[guid] = None
+
+        self.wake()
+
+    def _take_pending(self, limit):
+        with self._lock:
+            guids = list(self._pending)[:limit]
+
+            for guid in guids:
+                del self._pending[guid]
+
+            return guids
+
+    def run_once(self):
+        """
+        Fetches queued characters that aren't stored yet, then refreshes the
+        stalest stored characters, up to batch_size in all
+
+        Returns the number of characters stored or refreshed.
+        """
+
+        guids = []
+
+        while len(guids) < self.batch_size:
+            queued = self._take_pending(self.batch_size - len(guids))
+            if not queued:
+                break
+
+            stored = {guid for (guid,) in db.session.query(Character.guid).filter(
+                Character.guid.in_(queued))}
+            guids += [guid for guid in queued if guid not in stored]
+
+        claims = {}
+        if len(guids) < self.batch_size:
+            claims = Character.claim_stale(self.max_age, self.batch_size - len(guids))
+            guids += list(claims)
+            db.session.commit()
+
+        char_infos = []
+        unfetched = dict(claims)
+
+        for guid in guids:
+            while not self.bucket.acquire(timeout=1):
+                if self.stopping():
+                    Character.release_claims(unfetched)
+                    db.session.commit()
+                    return 0
+
+            try:
+                char_infos.append(self.client.get_character(character_url(guid)))
+                unfetched.pop(guid, None)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Couldn't fetch character {guid}: {e}")
+
+        Character.store_from_api(char_infos)
+        Character.release_claims(unfetched)
+        db.session.commit()
+
+        if char_infos:
+            logger.info(f"Synced {len(char_infos)} characters")
+
+        return len(char_infos)
@@ -0,0 +1,145 @@
+"""
+Config profiles for create_app()
+
+Config holds the settings shared by every profile, read from environment
+variables where they can be overridden. The debug toolbar and SQL echo are
+only turned on by the development profile.
+"""
+
+import os
+import tempfile
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgres:///epiclist")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "secretkey2")
+
+    DEBUG_TB_ENABLED = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Compile every template when the app is built, so gunicorn workers
+    # forked from a preloaded app don't each compile them on first use
+    WARM_TEMPLATES = False
+
+    FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", 20))
+
+    GIANTBOMB_MAX_WORKERS = int(os.environ.get("GIANTBOMB_MAX_WORKERS", 8))
+    GIANTBOMB_TIMEOUT = float(os.environ.get("GIANTBOMB_TIMEOUT", 10))
+    GIANTBOMB_POOL_SIZE = int(os.environ.get("GIANTBOMB_POOL_SIZE", 10))
+    GIANTBOMB_RETRIES = int(os.environ.get("GIANTBOMB_RETRIES", 3))
+    GIANTBOMB_BACKOFF = float(os.environ.get("GIANTBOMB_BACKOFF", 0.5))
+
+    # Background fetching of searched characters and refreshing of stored
+    # ones. GiantBomb allows 200 calls an hour. The sync in every worker
+    # draws on one token bucket kept in the database, and the default rate
+    # uses ~70 of them, leaving the rest for searches and new lists.
+    CHARACTER_SYNC_ENABLED = os.environ.get("CHARACTER_SYNC_ENABLED", "1") == "1"
+    CHARACTER_SYNC_INTERVAL = int(os.environ.get("CHARACTER_SYNC_INTERVAL", 60))
+    CHARACTER_SYNC_BATCH = int(os.environ.get("CHARACTER_SYNC_BATCH", 20))
+    CHARACTER_MAX_AGE_DAYS = int(os.environ.get("CHARACTER_MAX_AGE_DAYS", 7))
+    GIANTBOMB_SYNC_RATE = float(os.environ.get("GIANTBOMB_SYNC_RATE", 0.02))
+    GIANTBOMB_SYNC_BURST = int(os.environ.get("GIANTBOMB_SYNC_BURST", 5))
+
+    # Searches with at least this many matches among the characters stored
+    # locally are answered without calling GiantBomb
+    LOCAL_SEARCH_MIN_RESULTS = int(os.environ.get("LOCAL_SEARCH_MIN_RESULTS", 5))
+
+    # How list submissions resolve their characters: inline in the request,
+    # or queued for worker threads in each web process (thread) or for
+    # separate `flask run-list-jobs --forever` processes (worker)
+    LIST_JOB_MODE = os.environ.get("LIST_JOB_MODE", "inline")
+    LIST_JOB_WORKERS = int(os.environ.get("LIST_JOB_WORKERS", 2))
+    LIST_JOB_INTERVAL = int(os.environ.get("LIST_JOB_INTERVAL", 5))
+    LIST_JOB_MAX_ATTEMPTS = int(os.environ.get("LIST_JOB_MAX_ATTEMPTS", 5))
+    LIST_JOB_BACKOFF = int(os.environ.get("LIST_JOB_BACKOFF", 30))
+    LIST_JOB_TIMEOUT = int(os.environ.get("LIST_JOB_TIMEOUT", 300))
+
+    CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 60 * 60))
+    SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 5000))
+    # Longest a search waits on the same search loading in another request,
+    # in any worker when CACHE_BACKEND is redis, before loading it itself
+    SEARCH_WAIT = float(os.environ.get("SEARCH_WAIT", 10))
+    CARD_CACHE_TTL = int(os.environ.get("CARD_CACHE_TTL", 24 * 60 * 60))
+    CARD_CACHE_MAX_ENTRIES = int(os.environ.get("CARD_CACHE_MAX_ENTRIES", 20000))
+
+    # Usernames of logged in users. Profile edits and deletes drop the entry
+    # in this worker (in every worker with the redis backend), other workers
+    # see the change once it expires.
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.environ.get("IDENTITY_CACHE_MAX_ENTRIES", 10000))
+
+    SQL_QUERY_WARN_THRESHOLD = int(os.environ.get("SQL_QUERY_WARN_THRESHOLD", 15))
+    # Send each request's query count and time to the client as
+    # X-DB-Query-Count and X-DB-Time-Ms, for development and benchmarks
+    SQL_QUERY_HEADERS = os.environ.get("SQL_QUERY_HEADERS", "0") == "1"
+    # Seconds between the log lines with each process's GiantBomb call
+    # latencies and cache hits (0 turns them off)
+    METRICS_LOG_INTERVAL = int(os.environ.get("METRICS_LOG_INTERVAL", 5 * 60))
+
+    # Character and profile images are served from our host through the
+    # image proxy, downscaled and stored in IMAGE_CACHE_DIR
+    IMAGE_PROXY_ENABLED = os.environ.get("IMAGE_PROXY_ENABLED", "1") == "1"
+    IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "epiclist-images"))
+    IMAGE_PROXY_TIMEOUT = float(os.environ.get("IMAGE_PROXY_TIMEOUT", 5))
+    # Longest a whole fetch can take, and how long a failed one is remembered
+    # (images that failed are left for the browser to load)
+    IMAGE_PROXY_DEADLINE = float(os.environ.get("IMAGE_PROXY_DEADLINE", 10))
+    IMAGE_PROXY_FAILURE_TTL = int(os.environ.get("IMAGE_PROXY_FAILURE_TTL", 5 * 60))
+    IMAGE_PROXY_MAX_BYTES = int(os.environ.get("IMAGE_PROXY_MAX_BYTES", 5 * 1024 * 1024))
+    IMAGE_PROXY_POOL_SIZE = int(os.environ.get("IMAGE_PROXY_POOL_SIZE", 10))
+
+    # Password hashes are made and checked by PASSWORD_HASH_WORKERS processes
+    # per web process (0 hashes in the request). Changing the cost rehashes
+    # each password on its user's next login.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 1))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 8))
+
+    # Password checks allowed per username and per client address in each
+    # window, counted in the cache chosen by CACHE_BACKEND
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get("LOGIN_THROTTLE_WINDOW", 5 * 60))
+    LOGIN_THROTTLE_PER_USERNAME = int(os.environ.get("LOGIN_THROTTLE_PER_USERNAME", 10))
+    LOGIN_THROTTLE_PER_ADDRESS = int(os.environ.get("LOGIN_THROTTLE_PER_ADDRESS", 50))
+
+    # Number of proxies (like Heroku's router) in front of the app whose
+    # X-Forwarded-For is trusted for the client address
+    TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    SQLALCHEMY_ECHO = True
+    DEBUG_TB_ENABLED = True
+    SQL_QUERY_HEADERS = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "postgres:///epiclist_test")
+    WTF_CSRF_ENABLED = False
+    CACHE_BACKEND = "memory"
+    CHARACTER_SYNC_ENABLED = False
+    LIST_JOB_MODE = "inline"
+    BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASH_WORKERS = 0
+    IMAGE_PROXY_ENABLED = False
+    SQL_QUERY_HEADERS = True
+    METRICS_LOG_INTERVAL = 0
+
+
+class ProductionConfig(Config):
+    WARM_TEMPLATES = True
+    # Heroku's router is in front of the app, without it every client would
+    # share the router's address for the login throttle
+    TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 1))
+
+
+CONFIGS = {
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+    "production": ProductionConfig
+}
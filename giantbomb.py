@@ -0,0 +1,163 @@
+"""
+Client for the GiantBomb API
+
+Every call goes through one shared requests.Session, so connections to
+giantbomb.com are pooled and kept alive instead of paying for a new TCP and
+TLS handshake on every search.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Overridable so benchmarks can point the app at a local mock of the API
+API_URL = os.environ.get("GIANTBOMB_API_URL", "https://www.giantbomb.com/api")
+# Set GIANTBOMB_API_KEY in production, so the key can be rotated without a
+# deploy. The default is the project's original development key.
+API_KEY = os.environ.get("GIANTBOMB_API_KEY", "7257597392c1160f53ddc5354ec336518380ec17")
+HEADERS = {"User-Agent": "EpicListSearchBot"}
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def character_url(guid):
+    """API url for the details of a single character"""
+
+    return f"{API_URL}/character/{guid}/?api_key={API_KEY}&format=json"
+
+
+def search_url(term, limit=10, page=1):
+    """API url for a page of characters matching a search term"""
+
+    params = {"api_key": API_KEY, "format": "json", "query": term,
+              "resources": "character", "limit": limit, "page": page}
+
+    return f"{API_URL}/search/?{urlencode(params)}"
+
+
+class GiantBombClient:
+    """
+    Pooled, keep-alive HTTP client for GiantBomb
+
+    Requests time out after timeout seconds unless told otherwise. Rate
+    limited (429) and server error responses are retried up to retries times
+    with exponential backoff. Retry-After is ignored, since a long one would
+    hold the request (and its worker) for that long, and slow responses are
+    not retried, so a struggling API can't hold a request for several
+    timeouts.
+    """
+
+    def __init__(self, timeout=10, pool_size=10, retries=3, backoff=0.5):
+        self.timeout = timeout
+        self.metrics = LatencyMetrics()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=False,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            respect_retry_after_header=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, call="other", **kwargs):
+        """GETs url and returns the decoded JSON body, recording how long the
+        call took under the given call name"""
+
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            res = self.session.get(url, **kwargs)
+            res.raise_for_status()
+            data = res.json()
+            failed = False
+            return data
+
+        finally:
+            self.metrics.record(call, time.perf_counter() - start, failed)
+
+    def get_character(self, url):
+        """Returns the details of a single character"""
+
+        return self.get(url, "character")["results"]
+
+    def search(self, url):
+        """Returns the results of a search"""
+
+        return self.get(url, "search")["results"]
+
+
+class LatencyMetrics:
+    """Thread safe latency stats for each kind of API call, keeping only the
+    most recent samples for percentiles"""
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, call, seconds, failed=False):
+        with self._lock:
+            stats = self._calls.get(call)
+
+            if stats is None:
+                stats = {"count": 0, "errors": 0, "total": 0.0,
+                         "max": 0.0, "recent": deque(maxlen=self.samples)}
+                self._calls[call] = stats
+
+            stats["count"] += 1
+            stats["errors"] += int(failed)
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["recent"].append(seconds)
+
+    def snapshot(self):
+        """Returns call name -> count, errors and latencies in milliseconds"""
+
+        with self._lock:
+            snapshot = {}
+
+            for call, stats in self._calls.items():
+                recent = sorted(stats["recent"])
+                snapshot[call] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total"] / stats["count"] * 1000, 2),
+                    "p50_ms": round(percentile(recent, 50) * 1000, 2),
+                    "p95_ms": round(percentile(recent, 95) * 1000, 2),
+                    "max_ms": round(stats["max"] * 1000, 2)
+                }
+
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+
+    if not sorted_values:
+        return 0.0
+
+    index = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
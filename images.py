@@ -0,0 +1,366 @@
+"""
+Local proxy for character and avatar images
+
+Templates rewrite image urls with the proxied filter to signed /images/
+urls, so pages only link to images on our own host. The first request for
+an image and size fetches it through a pooled HTTP client, downscales it
+with Pillow, and stores it on disk under a hash of the url and size. Later
+requests are served from disk. Since the image behind a url is never
+refetched, responses can be cached by browsers for good.
+
+Only signed urls are fetched, so the proxy can't be used for arbitrary
+urls, and only http(s) urls of public addresses, since avatar urls are
+typed in by users. Hosts are resolved once, when connecting, and the
+connection goes to the address that was checked, so a host can't switch to
+a private address in between (DNS rebinding).
+
+Each fetch has a deadline for all its requests and reads, and failures are
+remembered for a few minutes so pages don't wait on a broken image again.
+"""
+
+import hashlib
+import hmac
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import create_connection
+
+# Longest side in pixels of each size the templates use: cards, the full
+# list page and profile pictures
+IMAGE_SIZES = {"thumb": 200, "full": 400, "avatar": 360}
+
+# Redirects followed when fetching an image, each checked like the url
+MAX_REDIRECTS = 3
+
+
+class ImageFetchError(Exception):
+    """Raised when an image can't be fetched or isn't an image"""
+
+
+# The fetch running in each thread, for the connections it opens
+_current = threading.local()
+
+
+def public_addresses(host, port):
+    """Addresses of host to connect to, refusing hosts with any private or
+    local address"""
+
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise ImageFetchError(f"Can't resolve {host}: {e}")
+
+    for info in infos:
+        if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+            raise ImageFetchError(f"{host} isn't a public address")
+
+    return [info[4][0] for info in infos]
+
+
+class FetchWatch:
+    """
+    Deadline of one fetch, shared by its redirects
+
+    Timeouts only bound each read, so a server sending a byte at a time could
+    hold a fetch open for good. Once the deadline passes, the sockets of the
+    connections used by the fetch are shut down, ending any read.
+    """
+
+    def __init__(self, seconds, allow_private):
+        self.deadline = time.monotonic() + seconds
+        self.allow_private = allow_private
+        self.expired = False
+        self.connections = []
+        self.lock = threading.Lock()
+        self.timer = threading.Timer(seconds, self.expire)
+        self.timer.daemon = True
+
+    def __enter__(self):
+        _current.watch = self
+        self.timer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.cancel()
+        _current.watch = None
+
+    def remaining(self):
+        return max(self.deadline - time.monotonic(), 0)
+
+    def watch(self, connection):
+        with self.lock:
+            self.connections.append(connection)
+
+    def expire(self):
+        with self.lock:
+            self.expired = True
+
+            for connection in self.connections:
+                if connection.sock is not None:
+                    try:
+                        connection.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+class CheckedConnectionMixin:
+    """
+    urllib3 connection that resolves its host once and connects to the
+    checked address, and is watched by the fetch using it
+    """
+
+    def _new_conn(self):
+        watch = getattr(_current, "watch", None)
+
+        if watch is not None and watch.allow_private:
+            return super()._new_conn()
+
+        addresses = public_addresses(self._dns_host, self.port)
+        options = {"socket_options": self.socket_options}
+        if self.source_address:
+            options["source_address"] = self.source_address
+
+        for address in addresses:
+            try:
+                return create_connection((address, self.port), self.timeout, **options)
+            except socket.timeout:
+                error = ConnectTimeoutError(
+                    self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})")
+            except OSError as e:
+                error = NewConnectionError(self, f"Failed to establish a new connection: {e}")
+
+        raise error
+
+    def request(self, *args, **kwargs):
+        watch = getattr(_current, "watch", None)
+        if watch is not None:
+            watch.watch(self)
+
+        return super().request(*args, **kwargs)
+
+
+class CheckedHTTPConnection(CheckedConnectionMixin, HTTPConnection):
+    pass
+
+
+class CheckedHTTPSConnection(CheckedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CheckedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CheckedHTTPConnection
+
+
+class CheckedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CheckedHTTPSConnection
+
+
+class CheckedAdapter(HTTPAdapter):
+    """Requests adapter making its connections with the checked connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CheckedHTTPConnectionPool, "https": CheckedHTTPSConnectionPool}
+
+
+def sniff_image_type(data):
+    """Content type of an image from its first bytes, or None if it isn't a
+    JPEG, PNG, GIF or WebP image"""
+
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+
+    return None
+
+
+def resize_image(data, box):
+    """
+    Downscales an image to fit in a box pixels wide and high, in the same
+    format
+
+    Images are returned as they are when they already fit, when they're
+    animated or when Pillow can't read them.
+    """
+
+    try:
+        image = Image.open(io.BytesIO(data))
+
+        if max(image.size) <= box or getattr(image, "is_animated", False):
+            return data
+
+        image_format = image.format
+        image.thumbnail((box, box))
+
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        options = {"JPEG": {"quality": 85}, "WEBP": {"quality": 85},
+                   "PNG": {"optimize": True}}.get(image_format, {})
+
+        out = io.BytesIO()
+        image.save(out, image_format, **options)
+        return out.getvalue()
+
+    except Exception:
+        return data
+
+
+class ImageProxy:
+    """
+    Fetches, downscales and stores images in cache_dir
+
+    timeout bounds each connect and read, and deadline a whole fetch. Images
+    larger than max_bytes are refused. Urls that couldn't be fetched are
+    remembered in the failures cache, when there is one, until its entries
+    expire. allow_private lets urls of private and local addresses through,
+    for development and tests.
+    """
+
+    def __init__(self, secret_key, cache_dir, timeout=5, deadline=10, max_bytes=5 * 1024 * 1024,
+                 pool_size=10, failures=None, allow_private=False):
+        self.secret_key = secret_key.encode("utf-8")
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.failures = failures
+        self.allow_private = allow_private
+
+        adapter = CheckedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+        self.session = requests.Session()
+        # Proxies from the environment would be connected to instead of the
+        # checked addresses
+        self.session.trust_env = False
+        self.session.headers.update({"User-Agent": "EpicListImageProxy"})
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def sign(self, url, size):
+        message = f"{size}|{url}".encode("utf-8")
+        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()[:32]
+
+    def verify(self, url, size, signature):
+        return hmac.compare_digest(self.sign(url, size), signature)
+
+    def path(self, url, size):
+        key = hashlib.sha256(f"{size}|{url}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, url, size):
+        """Returns the bytes and content type of the image at url downscaled
+        to size, from disk if it was stored before"""
+
+        path = self.path(url, size)
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = resize_image(self.fetch_unless_failed(url), IMAGE_SIZES[size])
+            self.store(path, data)
+
+        return data, sniff_image_type(data)
+
+    def fetch_unless_failed(self, url):
+        """Fetches the image at url, unless fetching it failed recently, and
+        remembers it when it fails"""
+
+        if self.failures is None:
+            return self.fetch(url)
+
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+        error = self.failures.get(key)
+        if error is not None:
+            raise ImageFetchError(error)
+
+        try:
+            return self.fetch(url)
+        except ImageFetchError as e:
+            self.failures.set(key, str(e))
+            raise
+
+    def store(self, path, data):
+        """Writes data to path in one step, so readers never see part of it"""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp_path, path)
+
+    def fetch(self, url):
+        """Downloads the image at url, following a few redirects, within
+        deadline seconds"""
+
+        with FetchWatch(self.deadline, self.allow_private) as watch:
+            for _ in range(MAX_REDIRECTS + 1):
+                self.check_url(url)
+
+                try:
+                    with self.session.get(url, timeout=min(self.timeout, watch.remaining()),
+                                          stream=True, allow_redirects=False) as res:
+
+                        if res.is_redirect:
+                            url = urljoin(url, res.headers["Location"])
+                            continue
+
+                        res.raise_for_status()
+                        data = self.read_limited(res)
+
+                except requests.exceptions.RequestException as e:
+                    raise ImageFetchError(f"Couldn't fetch {url}: {e}")
+
+                finally:
+                    # A shut down socket can also look like the end of the
+                    # image, so anything read after the deadline is dropped
+                    if watch.expired:
+                        raise ImageFetchError(f"Fetching {url} took over {self.deadline}s")
+
+                if sniff_image_type(data) is None:
+                    raise ImageFetchError(f"{url} isn't an image")
+
+                return data
+
+        raise ImageFetchError(f"Too many redirects fetching {url}")
+
+    def read_limited(self, res):
+        data = bytearray()
+
+        for chunk in res.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > self.max_bytes:
+                raise ImageFetchError(f"Image is over {self.max_bytes} bytes")
+
+        return bytes(data)
+
+    def check_url(self, url):
+        """Refuses urls that aren't http(s). Their addresses are checked when
+        connecting."""
+
+        parts = urlsplit(url)
+
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ImageFetchError(f"Can't fetch {url}")
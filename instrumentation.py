@@ -0,0 +1,142 @@
+"""
+Per-request SQL instrumentation
+
+Every statement run while handling a request is counted and timed through
+SQLAlchemy's cursor events. Once the request is done the totals are logged
+as one JSON line on the epiclist.sql logger, along with the slowest
+statement, and with SQL_QUERY_HEADERS on they're also added to the response
+as X-DB-Query-Count and X-DB-Time-Ms headers.
+Requests running more statements than SQL_QUERY_WARN_THRESHOLD log a
+warning, since that is usually a query running once per row (N+1).
+
+MetricsReporter logs the GiantBomb call latencies and the cache hit counts
+of each web process on the epiclist.metrics logger every
+METRICS_LOG_INTERVAL seconds.
+"""
+
+import json
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from background import BackgroundWorker
+
+logger = logging.getLogger("epiclist.sql")
+
+# Longest slowest statement kept for the log line
+MAX_STATEMENT_LENGTH = 500
+
+
+class QueryStats:
+    """Count, total time and slowest statement of the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.total += seconds
+
+        if seconds > self.slowest:
+            self.slowest = seconds
+            self.slowest_statement = statement[:MAX_STATEMENT_LENGTH]
+
+
+def current_query_stats():
+    """Stats of the request being handled, or None outside of a request"""
+
+    if not has_request_context():
+        return None
+
+    return g.get("query_stats")
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats()
+
+    start = getattr(context, "query_start", None)
+
+    if stats is not None and start is not None:
+        stats.record(statement, time.perf_counter() - start)
+
+
+def start_query_stats():
+    g.query_stats = QueryStats()
+
+
+def report_query_stats(response):
+    """Adds the request's query stats to the log, and to the response headers
+    if SQL_QUERY_HEADERS is on, warning when the request ran too many
+    queries"""
+
+    stats = current_query_stats()
+    if stats is None:
+        return response
+
+    if current_app.config.get("SQL_QUERY_HEADERS"):
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.total * 1000:.2f}"
+
+    logger.info(json.dumps({
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "queries": stats.count,
+        "db_ms": round(stats.total * 1000, 2),
+        "slowest_ms": round(stats.slowest * 1000, 2),
+        "slowest": stats.slowest_statement
+    }))
+
+    threshold = current_app.config.get("SQL_QUERY_WARN_THRESHOLD")
+
+    if threshold and stats.count > threshold:
+        logger.warning(f"Possible N+1 queries: {request.method} {request.path} "
+                       f"({request.endpoint}) ran {stats.count} queries, "
+                       f"over the threshold of {threshold}")
+
+    return response
+
+
+def init_instrumentation(app):
+    """Starts counting and timing the queries of every request of app"""
+
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    app.before_request(start_query_stats)
+    app.after_request(report_query_stats)
+
+
+class MetricsReporter(BackgroundWorker):
+    """
+    Logs one JSON line with the stats of every source every interval seconds
+
+    sources maps a name to a function returning that source's stats, like a
+    cache's stats() or the GiantBomb client's metrics.snapshot().
+    """
+
+    name = "metrics-reporter"
+    logger = logging.getLogger("epiclist.metrics")
+
+    def __init__(self, app, sources, interval=300):
+        super().__init__(app, interval)
+        self.sources = sources
+
+    def collect(self):
+        return {name: source() for name, source in self.sources.items()}
+
+    def run_once(self):
+        self.logger.info(json.dumps(self.collect()))
@@ -0,0 +1,127 @@
+"""
+Queued list submissions
+
+With LIST_JOB_MODE set to thread or worker, creating or editing a list
+saves it straight away as pending and queues its characters as a ListJob,
+so the request doesn't wait on GiantBomb. Jobs are run by worker threads in
+each web process (thread) or by separate `flask run-list-jobs --forever`
+processes (worker), which claim them from the list_jobs table.
+
+Jobs failing on GiantBomb are retried with a doubling delay. Once they've
+used up their attempts, or fail for any other reason, they're left dead for
+`flask retry-list-jobs` and their list is marked failed.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+import requests
+
+from background import BackgroundWorker
+from models import db, ListJob
+
+logger = logging.getLogger("epiclist.jobs")
+
+# Longest error kept on a job
+MAX_ERROR_LENGTH = 500
+
+
+def is_retryable(error):
+    """Whether a job failing with error could work if run again. GiantBomb
+    refusing a request outright (like an unknown guid) won't change."""
+
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status == 429
+
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+class ListJobRunner(BackgroundWorker):
+    """
+    Claims and runs queued list jobs, passing each one to handler
+
+    Jobs are attempted max_attempts times, waiting backoff seconds before
+    the first retry and twice as long before each one after. Jobs left
+    running for longer than timeout seconds are claimed again.
+    """
+
+    name = "list-jobs"
+    logger = logger
+
+    def __init__(self, app, handler, workers=2, interval=5, max_attempts=5, backoff=30, timeout=300):
+        super().__init__(app, interval, threads=workers)
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timedelta(seconds=timeout)
+
+    def notify(self):
+        """Wakes the worker threads up to run a job that was just queued"""
+
+        self.wake()
+
+    def run_once(self):
+        """Runs jobs until none are due, returns how many were run"""
+
+        count = 0
+
+        while not self.stopping():
+            job = ListJob.claim(self.timeout)
+            db.session.commit()
+
+            if job is None:
+                break
+
+            self.run_job(job)
+            count += 1
+
+        return count
+
+    def run_job(self, job):
+        # Keep the claimed job's values around whatever the handler does to
+        # the session
+        db.session.refresh(job)
+        db.session.expunge(job)
+
+        if job.attempts > self.max_attempts:
+            self.fail(job, "Worker stopped while running the job", retry=False)
+            db.session.commit()
+            return
+
+        try:
+            self.handler(job)
+
+        except Exception as e:
+            db.session.rollback()
+
+            if not is_retryable(e):
+                logger.exception(f"List job {job.id} failed")
+
+            self.fail(job, f"{type(e).__name__}: {e}", retry=is_retryable(e))
+
+        else:
+            ListJob.query.filter(ListJob.id == job.id).delete(synchronize_session=False)
+            ListJob.settle_list(job, "ready")
+
+        db.session.commit()
+
+    def fail(self, job, error, retry):
+        """Queues job to be retried later, or leaves it dead and marks its list
+        failed once it can't be retried"""
+
+        error = error[:MAX_ERROR_LENGTH]
+        jobs = ListJob.query.filter(ListJob.id == job.id)
+
+        if retry and job.attempts < self.max_attempts:
+            delay = self.backoff * 2 ** (job.attempts - 1)
+            jobs.update({ListJob.status: "queued", ListJob.last_error: error,
+                         ListJob.run_at: datetime.utcnow() + timedelta(seconds=delay)},
+                        synchronize_session=False)
+            logger.warning(f"List job {job.id} failed, retrying in {delay}s: {error}")
+
+        else:
+            jobs.update({ListJob.status: "dead", ListJob.last_error: error},
+                        synchronize_session=False)
+            ListJob.settle_list(job, "failed")
+            logger.error(f"List job {job.id} is dead after {job.attempts} attempts: {error}")
@@ -0,0 +1,16 @@
+-- Makes characters.guid unique so the same GiantBomb character can't be
+-- added twice by concurrent list submissions.
+
+-- Point list entries for duplicate characters at the oldest copy, then
+-- remove the duplicates
+UPDATE lists_characters lc
+SET character_id = keep.id
+FROM characters c
+JOIN (SELECT guid, MIN(id) AS id FROM characters GROUP BY guid) keep ON keep.guid = c.guid
+WHERE lc.character_id = c.id AND c.id <> keep.id;
+
+DELETE FROM characters c
+USING characters keep
+WHERE c.guid = keep.guid AND c.id > keep.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_characters_guid ON characters (guid);
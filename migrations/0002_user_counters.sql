@@ -0,0 +1,13 @@
+-- Adds follower, following and public list counters to users, so pages can
+-- show them without loading every follow and list, and fills them in from
+-- the current follows and lists.
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS public_lists_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users u SET
+    followers_count = (SELECT COUNT(*) FROM follows f WHERE f.user_being_followed = u.id),
+    following_count = (SELECT COUNT(*) FROM follows f WHERE f.user_following = u.id),
+    public_lists_count = (SELECT COUNT(*) FROM lists l WHERE l.user_id = u.id AND NOT l.is_private);
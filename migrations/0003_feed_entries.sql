@@ -0,0 +1,15 @@
+-- Adds feed_entries, the precomputed following feed of every user, and fills
+-- it in with the public lists of everyone each user already follows.
+
+CREATE TABLE IF NOT EXISTS feed_entries (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    list_id INTEGER NOT NULL REFERENCES lists (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, list_id)
+);
+
+INSERT INTO feed_entries (user_id, list_id)
+SELECT f.user_following, l.id
+FROM follows f
+JOIN lists l ON l.user_id = f.user_being_followed
+WHERE NOT l.is_private
+ON CONFLICT DO NOTHING;
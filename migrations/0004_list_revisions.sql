@@ -0,0 +1,4 @@
+-- Adds a revision number to lists, bumped whenever something shown on the
+-- list changes, so cached copies of older revisions stop being used.
+
+ALTER TABLE lists ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 1;
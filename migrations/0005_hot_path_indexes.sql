@@ -0,0 +1,27 @@
+-- Indexes matching the feed, profile and list detail queries, and
+-- uniqueness of a character within a list.
+
+-- Keep the first copy of any character added to the same list twice. Ranks
+-- of the removed copies are left as gaps, which keeps the order the same.
+DELETE FROM lists_characters lc
+USING lists_characters keep
+WHERE lc.list_id = keep.list_id
+  AND lc.character_id = keep.character_id
+  AND lc.id > keep.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_lists_characters_list_character
+    ON lists_characters (list_id, character_id);
+
+CREATE INDEX IF NOT EXISTS ix_lists_characters_list_rank ON lists_characters (list_id, rank);
+
+CREATE INDEX IF NOT EXISTS ix_lists_characters_character_id ON lists_characters (character_id);
+
+-- The public feed, newest first
+CREATE INDEX IF NOT EXISTS ix_lists_public_id ON lists (id DESC) WHERE is_private = false;
+
+-- A user's public or private lists, newest first
+CREATE INDEX IF NOT EXISTS ix_lists_user_private_id ON lists (user_id, is_private, id);
+
+CREATE INDEX IF NOT EXISTS ix_follows_user_following ON follows (user_following);
+
+CREATE INDEX IF NOT EXISTS ix_feed_entries_list_id ON feed_entries (list_id);
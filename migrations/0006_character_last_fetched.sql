@@ -0,0 +1,7 @@
+-- Records when each character was last fetched from GiantBomb, so the
+-- character sync can refresh the stalest ones first. Existing characters
+-- are left NULL, making them the first to be refreshed.
+
+ALTER TABLE characters ADD COLUMN IF NOT EXISTS last_fetched TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS ix_characters_last_fetched ON characters (last_fetched NULLS FIRST);
@@ -0,0 +1,8 @@
+-- Full text search over the characters stored locally, so searches with
+-- enough local matches don't call GiantBomb. Built in full text search is
+-- used rather than pg_trgm, which isn't installed on every server.
+
+CREATE INDEX IF NOT EXISTS ix_characters_search ON characters USING GIN (
+    (setweight(to_tsvector('simple'::regconfig, name), 'A')
+     || setweight(to_tsvector('simple'::regconfig, game), 'B'))
+);
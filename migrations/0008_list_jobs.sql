@@ -0,0 +1,21 @@
+-- Queue of list submissions whose characters are saved by a job worker,
+-- used when LIST_JOB_MODE is thread or worker. Lists are pending while
+-- their job runs and failed if it gave up.
+
+ALTER TABLE lists ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'ready';
+
+CREATE TABLE IF NOT EXISTS list_jobs (
+    id SERIAL PRIMARY KEY,
+    list_id INTEGER NOT NULL REFERENCES lists (id) ON DELETE CASCADE,
+    characters TEXT NOT NULL,
+    new BOOLEAN NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at TIMESTAMP NOT NULL,
+    started_at TIMESTAMP,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_list_jobs_status_run_at ON list_jobs (status, run_at);
+
+CREATE INDEX IF NOT EXISTS ix_list_jobs_list_id ON list_jobs (list_id);
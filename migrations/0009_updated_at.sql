@@ -0,0 +1,7 @@
+-- Records when users and lists were last updated, sent as Last-Modified
+-- and part of the ETags of profile and list pages. Existing rows count as
+-- updated now.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+ALTER TABLE lists ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
@@ -0,0 +1,8 @@
+-- Token buckets shared by every process, so the character sync in each
+-- worker draws on one budget of GiantBomb calls.
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name VARCHAR(50) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
@@ -0,0 +1,5 @@
+-- Most lists are public, so the public feed reads lists_pkey backwards from
+-- its cursor and skips the few private lists just as quickly as the partial
+-- index did. Dropping it saves a write on every list insert.
+
+DROP INDEX IF EXISTS ix_lists_public_id;
@@ -0,0 +1,163 @@
+"""Local stand-in for the GiantBomb API, used by tests instead of the real API"""
+
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHARACTER_PATH = re.compile(r"^/api/character/(?P<guid>[\w-]+)/?$")
+SEARCH_PATH = re.compile(r"^/api/search/?$")
+IMAGE_PATH = re.compile(r"^/images/(?P<width>\d+)x(?P<height>\d+)\.png$")
+
+
+def fake_character(guid):
+    """Character details in the same shape as GiantBomb's character resource"""
+
+    return {
+        "guid": guid,
+        "name": f"Character {guid}",
+        "games": [{"name": f"Game {guid}"}, {"name": f"Sequel {guid}"}],
+        "image": {"thumb_url": f"https://images.example.com/{guid}.png"}
+    }
+
+
+def fake_png(width, height):
+    """A plain purple PNG image, like the character thumbs GiantBomb serves"""
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data)))
+
+    rows = b"".join(b"\x00" + b"\x80\x00\x80" * width for _ in range(height))
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows)) +
+            chunk(b"IEND", b""))
+
+
+class MockGiantBomb:
+    """
+    Serves fake characters, search results and images on a random local port
+
+    Every request path is recorded in self.requests, and the client address
+    of every connection in self.connections. delay adds latency to
+    every response, and fail_with makes responses that status code, either
+    for every request or only the first fail_times requests, with a
+    Retry-After header of retry_after seconds if it's set. drip sends
+    response bodies a few bytes at a time, drip seconds apart.
+    """
+
+    def __init__(self, delay=0, fail_with=None, fail_times=None, retry_after=None, drip=0):
+        self.delay = delay
+        self.drip = drip
+        self.fail_with = fail_with
+        self.fail_times = fail_times
+        self.retry_after = retry_after
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """Base url to use in place of https://www.giantbomb.com/api"""
+
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/api"
+
+    def image_url(self, width, height):
+        """Url of a fake PNG image of that size"""
+
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/images/{width}x{height}.png"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # Keep connections open between requests like the real API does
+            protocol_version = "HTTP/1.1"
+
+            # Send small responses straight away instead of waiting on the
+            # client's delayed ACK, which adds ~40ms to every call
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with mock.lock:
+                    mock.requests.append(self.path)
+                    mock.connections.add(self.client_address)
+                    failing = mock.fail_with and (
+                        mock.fail_times is None or len(mock.requests) <= mock.fail_times)
+
+                if mock.delay:
+                    time.sleep(mock.delay)
+
+                if failing:
+                    headers = {"Retry-After": str(mock.retry_after)} if mock.retry_after else {}
+                    return self.send_json(mock.fail_with, {"error": "Mock failure"}, headers)
+
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+
+                match = CHARACTER_PATH.match(url.path)
+                if match:
+                    return self.send_json(200, {"results": fake_character(match.group("guid"))})
+
+                match = IMAGE_PATH.match(url.path)
+                if match:
+                    return self.send_data(200, "image/png", fake_png(
+                        int(match.group("width")), int(match.group("height"))))
+
+                if SEARCH_PATH.match(url.path):
+                    term = params.get("query", [""])[0]
+                    limit = int(params.get("limit", ["10"])[0])
+                    results = [fake_character(f"3005-{i}") for i in range(1, limit + 1)]
+                    for result in results:
+                        result["name"] = f"{term} {result['guid']}"
+                    return self.send_json(200, {"results": results})
+
+                self.send_json(404, {"error": "Object Not Found"})
+
+            def send_json(self, status, body, headers=None):
+                self.send_data(status, "application/json", json.dumps(body).encode("utf-8"), headers)
+
+            def send_data(self, status, content_type, data, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+
+                if not mock.drip:
+                    return self.wfile.write(data)
+
+                try:
+                    for start in range(0, len(data), 4):
+                        self.wfile.write(data[start:start + 4])
+                        self.wfile.flush()
+                        time.sleep(mock.drip)
+                except OSError:
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
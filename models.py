@@ -1,11 +1,17 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects.postgresql import insert
+
+from passwords import hasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 DEFAULT_IMAGE_URL = "https://www.edmundsgovtech.com/wp-content/uploads/2020/01/default-picture_0_0.png"
 
+# Character names aren't words in any one language, so search documents are
+# made without stemming or stop words
+SEARCH_CONFIG = db.literal_column("'simple'::regconfig")
+
 
 def connect_db(app):
     """Connect db to flask app"""
@@ -24,6 +30,12 @@ class Follows(db.Model):
 
     user_following = db.Column(db.Integer, db.ForeignKey(
         'users.id', ondelete="cascade"), primary_key=True)
+
+    # The primary key starts with the followed user, so looking up who a
+    # user follows needs its own index
+    __table_args__ = (
+        db.Index("ix_follows_user_following", user_following),
+    )
     
     def __repr__(self):
         return f"<Follow Instance | Being Followed: {self.user_being_followed} | Follower: {self.user_following}>"
@@ -46,6 +58,19 @@ class User(db.Model):
 
     favorite_character = db.Column(db.Text, nullable=True)
 
+    # Counters kept in sync by follow/unfollow and list create/delete/privacy
+    # changes, so pages can show them without loading whole collections
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    public_lists_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Set by every update of the row, counters included, so it changes
+    # whenever anything shown on the user's profile does
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
+
     followers = db.relationship("User",
                                 secondary="follows",
                                 primaryjoin=(
@@ -81,11 +106,75 @@ class User(db.Model):
         return List.query.filter(List.user_id == self.id).filter(
             List.is_private == False).all()
 
+    def is_following(self, other_user):
+        """Checks if this user follows other_user without loading who they follow"""
+
+        return Follows.query.get((other_user.id, self.id)) is not None
+
+    def follow(self, other_user):
+        """Starts following other_user and updates both users' counters.
+
+        Returns False if already following"""
+
+        if self.is_following(other_user):
+            return False
+
+        db.session.add(Follows(user_being_followed=other_user.id,
+                               user_following=self.id))
+        db.session.flush()
+
+        User.change_counts(self.id, following_count=1)
+        User.change_counts(other_user.id, followers_count=1)
+        FeedEntry.backfill(self.id, other_user.id)
+        return True
+
+    def unfollow(self, other_user):
+        """Stops following other_user and updates both users' counters.
+
+        Returns False if not following"""
+
+        removed = Follows.query.filter(Follows.user_being_followed == other_user.id).filter(
+            Follows.user_following == self.id).delete(synchronize_session=False)
+
+        if not removed:
+            return False
+
+        User.change_counts(self.id, following_count=-1)
+        User.change_counts(other_user.id, followers_count=-1)
+        FeedEntry.prune(self.id, other_user.id)
+        return True
+
+    def remove_from_follow_counts(self):
+        """Takes this user out of the counters of everyone they follow or are
+        followed by, used right before deleting the user"""
+
+        followed_ids = db.session.query(Follows.user_being_followed).filter(
+            Follows.user_following == self.id)
+        follower_ids = db.session.query(Follows.user_following).filter(
+            Follows.user_being_followed == self.id)
+
+        User.query.filter(User.id.in_(followed_ids.subquery())).update(
+            {User.followers_count: User.followers_count - 1}, synchronize_session=False)
+        User.query.filter(User.id.in_(follower_ids.subquery())).update(
+            {User.following_count: User.following_count - 1}, synchronize_session=False)
+
+    @classmethod
+    def change_counts(cls, user_id, **changes):
+        """Adds to a user's counters in the database itself (rather than in
+        Python) so concurrent changes aren't lost"""
+
+        values = {}
+        for name, change in changes.items():
+            column = getattr(cls, name)
+            values[column] = column + change
+
+        cls.query.filter(cls.id == user_id).update(values, synchronize_session=False)
+
     @classmethod
     def signup(cls, username, password, image_url=DEFAULT_IMAGE_URL):
         """Creates user with hashed password"""
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -100,11 +189,15 @@ class User(db.Model):
     def authenticate(cls, username, password):
         """Authenticates user with saved password hash.
 
-        Returns False if user/password combo don't match"""
+        Returns False if user/password combo don't match. Hashes made with an
+        older cost are redone while the password is at hand, for the caller
+        to commit."""
 
         user = cls.query.filter_by(username=username).first()
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and hasher.check(user.password, password):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.hash(password)
             return user
 
         return False
@@ -126,12 +219,288 @@ class List(db.Model):
 
     is_private = db.Column(db.Boolean, nullable=False)
 
+    # Bumped whenever anything shown on the list's cards changes, so cached
+    # copies of older revisions stop being used
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # pending while a queued job is still adding its characters, failed if
+    # that job gave up (see ListJob)
+    status = db.Column(db.String(10), nullable=False, default="ready", server_default="ready")
+
+    # Set by every update of the row, revision bumps included
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, server_default=db.func.now())
+
+    # A user's public or private lists newest first on their profile. The
+    # public feed walks the primary key backwards, since most lists are public.
+    __table_args__ = (
+        db.Index("ix_lists_user_private_id", user_id, is_private, id),
+    )
+
     characters = db.relationship('Character', secondary="lists_characters")
 
     def __repr__(self):
         """Representation of instance"""
         return f"<List Instance | List ID: {self.id} | Name: {self.title} | User ID: {self.user_id}>"
 
+    def publish(self):
+        """Used when a list is created public or made public. Counts it for
+        its author and adds it to the feeds of the author's followers."""
+
+        db.session.flush()
+        User.change_counts(self.user_id, public_lists_count=1)
+        FeedEntry.fan_out(self)
+
+    def unpublish(self):
+        """Used when a public list is made private or deleted. Reverses
+        publish()."""
+
+        User.change_counts(self.user_id, public_lists_count=-1)
+        FeedEntry.retract(self)
+
+    @classmethod
+    def bump_revisions(cls, *criteria):
+        """Moves every list matching criteria on to a new revision, used when
+        something shown on them changes (like a character or author name)"""
+
+        cls.query.filter(*criteria).update(
+            {cls.revision: cls.revision + 1}, synchronize_session=False)
+
+    @classmethod
+    def containing_characters(cls, character_ids):
+        """Criteria for bump_revisions() matching every list with any of the
+        given characters in it"""
+
+        list_ids = db.session.query(ListCharacter.list_id).filter(
+            ListCharacter.character_id.in_(character_ids))
+
+        return cls.id.in_(list_ids.subquery())
+
+
+class RateLimit(db.Model):
+    """
+    Token bucket shared by every process, for rate limits on outside APIs
+    that apply to the whole site rather than to each worker
+    """
+
+    __tablename__ = "rate_limits"
+
+    name = db.Column(db.String(50), primary_key=True)
+
+    tokens = db.Column(db.Float, nullable=False)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def take(cls, name, rate, capacity):
+        """
+        Takes a token from the bucket called name, refilled at rate tokens a
+        second up to capacity. Returns 0 if it took one, or else how many
+        seconds until one is available.
+
+        Runs in its own transaction, so the bucket is never locked for longer
+        than one statement.
+        """
+
+        now = db.func.timezone("utc", db.func.clock_timestamp())
+        level = db.func.least(capacity, cls.tokens + rate * db.func.extract(
+            "epoch", now - cls.updated_at))
+
+        with db.engine.begin() as conn:
+            conn.execute(insert(cls.__table__).values(
+                name=name, tokens=capacity, updated_at=now).on_conflict_do_nothing())
+
+            taken = conn.execute(cls.__table__.update().where(cls.name == name).where(
+                level >= 1).values(tokens=level - 1, updated_at=now)).rowcount
+
+            if taken:
+                return 0
+
+            current = conn.execute(db.select([level]).where(cls.name == name)).scalar()
+
+        return max(1 - current, 0) / rate
+
+
+class ListJob(db.Model):
+    """
+    Characters waiting to be resolved and saved to a list, used when list
+    submissions are queued rather than handled in the request
+
+    Jobs are queued until a worker claims them, running while it works on
+    them, and dead once they've failed for good. Jobs that ran are deleted.
+    """
+
+    __tablename__ = "list_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    list_id = db.Column(db.Integer, db.ForeignKey(
+        'lists.id', ondelete="CASCADE"), nullable=False)
+
+    # guids as sent by the list form
+    characters = db.Column(db.Text, nullable=False)
+
+    new = db.Column(db.Boolean, nullable=False)
+
+    status = db.Column(db.String(10), nullable=False, default="queued", server_default="queued")
+
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    started_at = db.Column(db.DateTime)
+
+    last_error = db.Column(db.Text)
+
+    # Claiming the next job due, and a list's outstanding jobs
+    __table_args__ = (
+        db.Index("ix_list_jobs_status_run_at", status, run_at),
+        db.Index("ix_list_jobs_list_id", list_id),
+    )
+
+    def __repr__(self):
+        """Representation of instance"""
+        return f"<ListJob Instance | ID: {self.id} | List ID: {self.list_id} | Status: {self.status}>"
+
+    @classmethod
+    def enqueue(cls, lst, characters, new):
+        """Queues characters to be saved to lst and marks it pending. Its
+        jobs that haven't started or are dead are replaced, since only the
+        latest submission counts."""
+
+        db.session.flush()
+
+        cls.query.filter(cls.list_id == lst.id).filter(
+            cls.status.in_(["queued", "dead"])).delete(synchronize_session=False)
+
+        lst.status = "pending"
+        job = cls(list_id=lst.id, characters=characters, new=new)
+        db.session.add(job)
+        return job
+
+    @classmethod
+    def claim(cls, timeout):
+        """
+        Marks the job due the longest as running and returns it, or None if
+        no job is due
+
+        Jobs left running for longer than timeout (their worker died) are
+        claimed again. A list's jobs are never run at the same time, and
+        workers running at the same time each claim a different job.
+        """
+
+        now = datetime.utcnow()
+        running = cls.__table__.alias("running")
+
+        due = db.select([cls.id]).where(db.or_(
+            db.and_(cls.status == "queued", cls.run_at <= now),
+            db.and_(cls.status == "running", cls.started_at < now - timeout))).where(
+            ~db.exists().where(running.c.list_id == cls.list_id).where(
+                running.c.status == "running").where(running.c.id != cls.id).where(
+                running.c.started_at >= now - timeout)).order_by(
+            cls.run_at).limit(1).with_for_update(skip_locked=True)
+
+        claimed = db.session.execute(cls.__table__.update().where(cls.id.in_(due)).values(
+            status="running", started_at=now, attempts=cls.attempts + 1).returning(cls.id)).first()
+
+        return cls.query.get(claimed[0]) if claimed else None
+
+    @classmethod
+    def settle_list(cls, job, status):
+        """Moves job's list on to a new revision with status, or leaves it
+        pending if more of its jobs are still to run"""
+
+        values = {List.revision: List.revision + 1}
+
+        outstanding = cls.query.filter(cls.list_id == job.list_id).filter(
+            cls.id != job.id).filter(cls.status.in_(["queued", "running"])).count()
+        if not outstanding:
+            values[List.status] = status
+
+        List.query.filter(List.id == job.list_id).update(values, synchronize_session=False)
+
+    @classmethod
+    def requeue_dead(cls):
+        """Queues every dead job to run again straight away, returns how many
+        there were"""
+
+        dead = cls.query.filter(cls.status == "dead")
+
+        List.query.filter(List.id.in_(dead.with_entities(cls.list_id).subquery())).update(
+            {List.status: "pending"}, synchronize_session=False)
+
+        return dead.update({cls.status: "queued", cls.attempts: 0,
+                            cls.run_at: datetime.utcnow()}, synchronize_session=False)
+
+
+class FeedEntry(db.Model):
+    """
+    A public list in the following feed of one of its author's followers
+
+    Entries are written when a list is published and when a follow starts,
+    so the following feed is a single indexed read of one user's entries.
+    """
+
+    __tablename__ = "feed_entries"
+
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete="CASCADE"), primary_key=True)
+
+    list_id = db.Column(db.Integer, db.ForeignKey(
+        'lists.id', ondelete="CASCADE"), primary_key=True)
+
+    # Removing an unpublished list from every feed
+    __table_args__ = (
+        db.Index("ix_feed_entries_list_id", list_id),
+    )
+
+    def __repr__(self):
+        """Representation of instance"""
+        return f"<FeedEntry Instance | User ID: {self.user_id} | List ID: {self.list_id}>"
+
+    @classmethod
+    def fan_out(cls, lst):
+        """Adds a list to the feed of everyone following its author"""
+
+        followers = db.select([Follows.user_following, db.literal(lst.id)]).where(
+            Follows.user_being_followed == lst.user_id)
+
+        db.session.execute(insert(cls.__table__).from_select(
+            ["user_id", "list_id"], followers).on_conflict_do_nothing())
+
+    @classmethod
+    def retract(cls, lst):
+        """Removes a list from every feed"""
+
+        cls.query.filter(cls.list_id == lst.id).delete(synchronize_session=False)
+
+    @classmethod
+    def backfill(cls, follower_id, followed_id):
+        """Adds every public list of a newly followed user to the follower's feed"""
+
+        lists = db.select([db.literal(follower_id), List.id]).where(
+            List.user_id == followed_id).where(List.is_private == False)
+
+        db.session.execute(insert(cls.__table__).from_select(
+            ["user_id", "list_id"], lists).on_conflict_do_nothing())
+
+    @classmethod
+    def prune(cls, follower_id, unfollowed_id):
+        """Removes the lists of an unfollowed user from the follower's feed"""
+
+        lists = db.session.query(List.id).filter(List.user_id == unfollowed_id)
+
+        cls.query.filter(cls.user_id == follower_id).filter(
+            cls.list_id.in_(lists.subquery())).delete(synchronize_session=False)
+
+
+def character_search_vector(name, game):
+    """Full text search document of a character, with matches on its name
+    ranked above matches on its games"""
+
+    return db.func.setweight(db.func.to_tsvector(SEARCH_CONFIG, name), db.literal_column("'A'")).op("||")(
+        db.func.setweight(db.func.to_tsvector(SEARCH_CONFIG, game), db.literal_column("'B'")))
+
 
 class Character(db.Model):
     """Characters to be added to lists"""
@@ -140,7 +509,7 @@ class Character(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
 
-    guid = db.Column(db.Text, nullable=True)
+    guid = db.Column(db.Text, nullable=True, unique=True, index=True)
 
     name = db.Column(db.Text, nullable=False)
 
@@ -148,10 +517,122 @@ class Character(db.Model):
 
     image_url = db.Column(db.Text, nullable=True)
 
+    # When the details were last fetched from GiantBomb, NULL if never
+    last_fetched = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+
+    # Finding the characters most in need of a refresh, and full text search
+    __table_args__ = (
+        db.Index("ix_characters_last_fetched", last_fetched.asc().nullsfirst()),
+        db.Index("ix_characters_search", character_search_vector(name, game),
+                 postgresql_using="gin"),
+    )
+
     def __repr__(self):
         """Representation of instance"""
         return f"<Character Instance | ID: {self.id} | Name: {self.name} | Game: {self.game}>"
 
+    @classmethod
+    def search_vector(cls):
+        """The full text search document of characters, matching the index"""
+
+        return character_search_vector(cls.name, cls.game)
+
+    @staticmethod
+    def values_from_api(char_info):
+        """Column values for a character from GiantBomb's character resource"""
+
+        return {
+            "guid": char_info["guid"],
+            "name": char_info["name"],
+            "game": game_list_to_string(char_info["games"]),
+            "image_url": char_info["image"]["thumb_url"],
+            "last_fetched": datetime.utcnow()
+        }
+
+    @classmethod
+    def store_from_api(cls, char_infos):
+        """
+        Adds new characters and refreshes stored ones from API data in one
+        statement
+
+        Lists showing a character whose details changed move on to a new
+        revision, so their cached cards are rendered again.
+        """
+
+        rows = {}
+        for char_info in char_infos:
+            values = cls.values_from_api(char_info)
+            rows[values["guid"]] = values
+
+        if not rows:
+            return
+
+        changed = []
+        for char in cls.query.filter(cls.guid.in_(list(rows))):
+            row = rows[char.guid]
+            if (char.name, char.game, char.image_url) != (row["name"], row["game"], row["image_url"]):
+                changed.append(char.id)
+
+        stmt = insert(cls.__table__).values(list(rows.values()))
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["guid"],
+            set_={column: stmt.excluded[column]
+                  for column in ["name", "game", "image_url", "last_fetched"]}))
+
+        if changed:
+            List.bump_revisions(List.containing_characters(changed))
+
+    @classmethod
+    def claim_stale(cls, max_age, limit):
+        """
+        Returns up to limit characters last fetched longer than max_age ago
+        (or never), stalest first, as a dictionary of guid -> when they were
+        last fetched
+
+        They are marked as fetched straight away, so sync workers running at
+        the same time each refresh different characters. Characters that
+        then can't be fetched are handed back with release_claims().
+        """
+
+        stale = db.select([cls.id, cls.last_fetched]).where(cls.guid != None).where(
+            db.or_(cls.last_fetched == None,
+                   cls.last_fetched < datetime.utcnow() - max_age)).order_by(
+            cls.last_fetched.asc().nullsfirst()).limit(limit).with_for_update(
+            skip_locked=True).alias("stale")
+
+        claimed = db.session.execute(cls.__table__.update().where(
+            cls.id == stale.c.id).values(last_fetched=datetime.utcnow()).returning(
+            cls.guid, stale.c.last_fetched))
+
+        return {guid: last_fetched for guid, last_fetched in claimed}
+
+    @classmethod
+    def release_claims(cls, claims):
+        """Puts back when claimed characters were last fetched, for those that
+        weren't refreshed, so the next sync tries them again"""
+
+        if not claims:
+            return
+
+        db.session.execute(cls.__table__.update().where(
+            cls.guid == db.bindparam("claimed_guid")).values(
+            last_fetched=db.bindparam("previous")),
+            [{"claimed_guid": guid, "previous": previous} for guid, previous in claims.items()])
+
+
+def game_list_to_string(game_list):
+    """Converts list of games a character has appeared in to a string to store in db"""
+
+    games = ""
+    for game in game_list:
+        name = game["name"]
+        if games == "":
+            games = name
+        elif len(games) < 100:
+            games = games + ", " + name
+
+    return games
+
 
 class ListCharacter(db.Model):
     """Connection between List and Character"""
@@ -168,6 +649,14 @@ class ListCharacter(db.Model):
 
     rank = db.Column(db.Integer, nullable=True)
 
+    # A character is in a list at most once. Lists' characters are loaded in
+    # rank order, and a character's lists are found when it changes.
+    __table_args__ = (
+        db.Index("uq_lists_characters_list_character", list_id, character_id, unique=True),
+        db.Index("ix_lists_characters_list_rank", list_id, rank),
+        db.Index("ix_lists_characters_character_id", character_id),
+    )
+
     characters = db.relationship('Character', backref="lists_characters")
 
     def __repr__(self):
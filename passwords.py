@@ -0,0 +1,135 @@
+"""
+Password hashing and the login throttle
+
+bcrypt is slow on purpose. Hashes are made and checked by a small pool of
+processes (PASSWORD_HASH_WORKERS per web process) so a burst of logins can
+only keep that many cores busy, and requests past PASSWORD_HASH_MAX_PENDING
+are turned away instead of queueing up behind them. The cost factor comes
+from BCRYPT_LOG_ROUNDS, and hashes made with another cost are redone on the
+user's next login.
+
+LoginThrottle caps password checks per username and per client address, so
+floods are refused before any hashing is done.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many passwords are already waiting to be hashed"""
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def check_password(pw_hash, password):
+    return bcrypt.checkpw(password.encode("utf-8"), pw_hash.encode("utf-8"))
+
+
+def hash_rounds(pw_hash):
+    """Cost factor a hash was made with, from its $2b$<rounds>$ prefix"""
+
+    return int(pw_hash.split("$")[2])
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with bcrypt at a cost of rounds
+
+    With workers set to 0 the work is done on the calling thread. Otherwise
+    it's sent to a pool of that many processes, started in each process the
+    first time it's needed, so gunicorn workers forked from a preloaded app
+    get their own.
+    """
+
+    def __init__(self, rounds=12, workers=0, max_pending=8):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.configure(rounds, workers, max_pending)
+
+    def configure(self, rounds, workers, max_pending):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Whether a hash was made with a cost other than the current one"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        if not self._pending.acquire(blocking=False):
+            raise PasswordHasherBusy(f"{self.max_pending} passwords already waiting to be hashed")
+
+        try:
+            return self._pool().submit(func, *args).result()
+        finally:
+            self._pending.release()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Spawned rather than forked, since forking a process with
+                # threads running (like the character sync) isn't safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+                self._pid = os.getpid()
+
+            return self._executor
+
+
+class LoginThrottle:
+    """
+    Allows up to per_username password checks for one username and
+    per_address checks from one client address in each window of the
+    cache's ttl
+
+    Counters live in the cache, so with the redis backend every worker
+    shares them.
+    """
+
+    def __init__(self, cache, per_username, per_address):
+        self.cache = cache
+        self.per_username = per_username
+        self.per_address = per_address
+
+    def allow(self, address, username=None):
+        """Counts an attempt, returns whether it's within the limits"""
+
+        allowed = self.cache.incr(f"address:{address}") <= self.per_address
+
+        if username is not None:
+            count = self.cache.incr(f"username:{username.lower()}")
+            allowed = allowed and count <= self.per_username
+
+        return allowed
+
+
+# Shared by the models and routes, configured from the app by init_passwords()
+hasher = PasswordHasher()
+
+
+def init_passwords(app):
+    """Sets the cost and pool size of the password hasher from app's config"""
+
+    hasher.configure(rounds=app.config["BCRYPT_LOG_ROUNDS"],
+                     workers=app.config["PASSWORD_HASH_WORKERS"],
+                     max_pending=app.config["PASSWORD_HASH_MAX_PENDING"])
@@ -6,13 +6,19 @@ const searchContainer = document.getElementById("search-results");
 const listContainer = document.getElementById("list-container");
 const submitBtn = document.getElementById("submit-btn");
 const formCharacters = document.getElementById("characters");
-const KEY_AND_FORMAT = "?api_key=7257597392c1160f53ddc5354ec336518380ec17&format=json";
-const URL = "http://giantbomb.com/api";
 const TO_BACKEND = "/search-characters";
-const FIELDS = "&resources=character&limit=10";
+const SEARCH_LIMIT = 10;
 const FOR_SEARCH = "search";
 const FOR_LIST = "list";
 
+// Typing waits this long for the next key before searching
+const DEBOUNCE_MS = 300;
+// Shorter terms are only searched with the search button
+const MIN_TERM_LENGTH = 2;
+// Searches remembered for the rest of the browser tab's session
+const CACHE_SIZE = 50;
+const CACHE_KEY = "epiclist-character-searches";
+
 let ranked_check = document.getElementById("is_ranked")
 let currentSearch = [];
 let currentList = [];
@@ -20,180 +26,312 @@ let currentList = [];
 
 /********************* SEARCHING *********************/
 
-// This combines the constants above into a search query that will be sent to the back-end
-// The back-end will query the API and return a response with specific attributes
-async function searchForCharacter(char_name) {
-    const api_query = URL + "/search" + KEY_AND_FORMAT + "&query=" + char_name + FIELDS;
-    const query = { "query": api_query };
-    const data = JSON.stringify(query);
+// Remembers the results of the last CACHE_SIZE searches, least recently used
+// first, in sessionStorage so they survive moving between the new and edit pages
+class SearchCache {
+    constructor(size, storageKey) {
+        this.size = size;
+        this.storageKey = storageKey;
+        this.entries = new Map();
+
+        try {
+            const stored = JSON.parse(sessionStorage.getItem(storageKey) || "[]");
+            for (const [term, results] of stored) {
+                this.entries.set(term, results);
+            }
+        } catch (err) {
+            // Storage is unavailable or holds something else, start empty
+        }
+    }
 
-    const res = await axios.post(TO_BACKEND, { data });
+    get(term) {
+        if (!this.entries.has(term)) {
+            return undefined;
+        }
 
-    handleResponse(res)
-};
+        // Move to the end as the most recently used
+        const results = this.entries.get(term);
+        this.entries.delete(term);
+        this.entries.set(term, results);
+        return results;
+    }
+
+    set(term, results) {
+        this.entries.delete(term);
+        this.entries.set(term, results);
+
+        while (this.entries.size > this.size) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+
+        try {
+            sessionStorage.setItem(this.storageKey, JSON.stringify([...this.entries]));
+        } catch (err) {
+            // Storage is full or unavailable, the cache still works for this page
+        }
+    }
+}
+
+
+// Runs searches as the user types, once they stop typing for DEBOUNCE_MS.
+// A new search cancels the one still in flight, so results of an older term
+// can never replace newer ones, and repeated terms are answered from the cache.
+class SearchController {
+    constructor(cache) {
+        this.cache = cache;
+        this.timer = null;
+        this.inFlight = null;
+    }
+
+    // Called on every keystroke
+    schedule(term) {
+        clearTimeout(this.timer);
+
+        if (normalizeTerm(term).length < MIN_TERM_LENGTH) {
+            return;
+        }
+
+        this.timer = setTimeout(() => this.search(term), DEBOUNCE_MS);
+    }
 
+    // Searches straight away, for the search button and the enter key
+    async search(term) {
+        clearTimeout(this.timer);
 
-// Called in searchForCharacter
-// Takes response object and displays character results from it on screen
-function handleResponse(res) {
-    currentSearch = [];
-    const data = res["data"]["character_results"];
-    showResults(data);
+        const key = normalizeTerm(term);
+        if (!key) {
+            return;
+        }
+
+        const cached = this.cache.get(key);
+        if (cached !== undefined) {
+            this.cancel();
+            showResults(cached);
+            return;
+        }
+
+        this.cancel();
+        const controller = new AbortController();
+        this.inFlight = controller;
+
+        try {
+            const results = await searchForCharacter(key, controller.signal);
+            this.cache.set(key, results);
+            showResults(results);
+        } catch (err) {
+            if (err.name !== "AbortError") {
+                console.error(err);
+            }
+        } finally {
+            if (this.inFlight === controller) {
+                this.inFlight = null;
+            }
+        }
+    }
+
+    cancel() {
+        if (this.inFlight) {
+            this.inFlight.abort();
+            this.inFlight = null;
+        }
+    }
+}
+
+
+// Terms differing only by case or spacing are the same search
+function normalizeTerm(term) {
+    return term.trim().toLowerCase().replace(/\s+/g, " ");
+}
+
+
+// Sends the search term to the back-end
+// The back-end will query the API and return a response with specific attributes
+async function searchForCharacter(char_name, signal) {
+    const res = await fetch(TO_BACKEND, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ term: char_name, limit: SEARCH_LIMIT }),
+        signal
+    });
+
+    if (!res.ok) {
+        throw new Error(`Search failed with status ${res.status}`);
+    }
+
+    const body = await res.json();
+    return body["character_results"];
 };
 
 
-// Adds HTML of the results from searching for characters
+// Shows the results from searching for characters
 function showResults(data) {
+    currentSearch = data;
 
-    searchContainer.innerHTML = "";
-    searchContainer.innerHTML = `<div class="list-group" id="list-results"></div>`;
+    const group = document.createElement("div");
+    group.className = "list-group";
+    group.id = "list-results";
+    group.appendChild(makeListGroup(data, FOR_SEARCH));
 
-    makeListGroupHTML(data, FOR_SEARCH);
+    searchContainer.replaceChildren(group);
 };
 
 // Shows current list
 function showList() {
-    listContainer.innerHTML = "";
-    listContainer.innerHTML = `<div class="list-group" id="current-list"></div>`;
+    const group = document.createElement("div");
+    group.className = "list-group";
+    group.id = "current-list";
+    group.appendChild(makeListGroup(currentList, FOR_LIST));
 
-    makeListGroupHTML(currentList, FOR_LIST);
+    listContainer.replaceChildren(group);
 };
 
 
-// Create button elements to be list group items in search results. Each button will have a button inside
-// that can be clicked to add the character to the list the user is making.
-function makeListGroupHTML(data, location) {
+// Builds list group items for search results or the current list in a
+// DocumentFragment, so they're added to the page in one go. Search results get
+// an "add" button and the current list a "remove" button, plus ranks and
+// arrows to move characters when the list is ranked.
+function makeListGroup(data, location) {
+    const fragment = document.createDocumentFragment();
+    const ranked = ranked_check.checked && location == FOR_LIST;
 
     for (let i = 0; i < data.length; i++) {
+        const item = document.createElement("div");
+        item.className = "list-group-item list-group-item-action row list-character justify-content-between";
+        item.dataset.index = i;
+
+        if (ranked) {
+            const rank = document.createElement("p");
+            rank.className = "display-4 col-1 float-left";
+            rank.textContent = i + 1;
+            item.appendChild(rank);
+        }
 
-        let btnClass = null;
-        let btnTitle = null;
+        const image = document.createElement("img");
+        image.src = data[i]["image_url"];
+        image.alt = `Picture of ${data[i]["name"]}`;
+        image.className = "col-8 search-char-image";
+        item.appendChild(image);
 
-        // If list is being implemented for search, an "add" button should appear
-        // If list is being implemented for current list, a "remove" button should appear
-        if (location == FOR_SEARCH) {
-            btnClass = "btn-primary add-btn";
-            btnTitle = "Add";
-        } else if (location == FOR_LIST) {
-            btnClass = "btn-danger remove-btn";
-            btnTitle = "Remove";
-        };
-
-        let arrows = "";
-        let rank = "";
-        if (ranked_check.checked && location == FOR_LIST) {
-            arrows = `<span class="arrow-btns float-right col-1" style="font-size:1.5em; color:lightblue;"><i class="fas fa-caret-square-up m-2"></i><i class="fas fa-caret-square-down m-2"></i></span>`;
-            rank = `<p class="display-4 col-1 float-left">${i + 1}</p>`;
-        }
+        item.appendChild(document.createTextNode(` ${data[i]["name"]} `));
 
-        // Creates necessary HTML for a list-group, with appropriate properties
-        // for each search result taken from attributes from the response object
-        // Uses location param to decide which button to tack on, and where to put the element
-        const divContent = `<div class="list-group-item list-group-item-action row list-character justify-content-between" data-index="${i}">${rank}
-        <img src="${data[i]["image_url"]}" alt="Picture of ${data[i]["name"]}" class="col-8 search-char-image"> ${data[i]["name"]}
-        <button class="btn btn-sm ${btnClass}">${btnTitle}</button>${arrows}</div>`;
-        const div = document.createElement("div");
-        div.innerHTML = divContent;
+        const button = document.createElement("button");
         if (location == FOR_SEARCH) {
-            searchContainer.appendChild(div.childNodes[0]);
-            currentSearch.push(data[i]);
-        } else if (location == FOR_LIST) {
-            listContainer.appendChild(div.childNodes[0]);
+            button.className = "btn btn-sm btn-primary add-btn";
+            button.textContent = "Add";
+        } else {
+            button.className = "btn btn-sm btn-danger remove-btn";
+            button.textContent = "Remove";
         }
+        item.appendChild(button);
+
+        if (ranked) {
+            const arrows = document.createElement("span");
+            arrows.className = "arrow-btns float-right col-1";
+            arrows.style.fontSize = "1.5em";
+            arrows.style.color = "lightblue";
+            arrows.innerHTML = `<i class="fas fa-caret-square-up m-2"></i><i class="fas fa-caret-square-down m-2"></i>`;
+            item.appendChild(arrows);
+        }
+
+        fragment.appendChild(item);
     }
 
-    // Adds event listeners to the lists to listen for a new add or remove
-    searchContainer.addEventListener('click', handleAdd);
-    listContainer.addEventListener('click', handleRemove)
+    return fragment;
 }
 
 /************ EVENT HANDLERS ************************/
 
-// Function to listen for clicks of the search button and calls searchForCharacter with
-// inputs from search field
-async function handleSearch(evt) {
+const searchController = new SearchController(new SearchCache(CACHE_SIZE, CACHE_KEY));
+
+
+// Function to listen for clicks of the search button and the enter key in
+// the search field, and search straight away
+function handleSearch(evt) {
+    if (evt.type == "keydown" && evt.key != "Enter") {
+        return;
+    }
+
     evt.preventDefault();
-    searchVal = searchField.value;
-    await searchForCharacter(searchVal);
+    searchController.search(searchField.value);
 };
 
 
+// Searches as the user types, once they stop for a moment
+function handleTyping() {
+    searchController.schedule(searchField.value);
+}
+
+
 // Function to listen for clicks on character add buttons
 // If clicked, add corresponsing character to the list
 function handleAdd(evt) {
-    evt.preventDefault();
 
     // Should only work if the clicked element is an add button
-    classes = [...evt.target.classList];
-    if (classes.includes('add-btn')) {
-        const div = evt.target.closest("div");
-        const arrIndex = div.dataset.index;
-
-        char = currentSearch[arrIndex];
-        if (formCharacters.value.includes(char.guid)){
-            alert("Character already in list");
-            showList();
-            return
-        }
+    if (!evt.target.classList.contains('add-btn')) {
+        return;
+    }
 
-        currentList.push(char);
-        formCharacters.value = toForm(currentList);
+    evt.preventDefault();
 
-        showList();
+    const arrIndex = Number(evt.target.closest(".list-character").dataset.index);
+    const char = currentSearch[arrIndex];
+
+    if (currentList.some(listed => listed.guid == char.guid)) {
+        alert("Character already in list");
+        return;
     }
+
+    currentList.push(char);
+    formCharacters.value = toForm(currentList);
+
+    showList();
 };
 
+
+// Function to listen for clicks in the current list, on the "remove" buttons
+// and the arrows that move characters up or down
+function handleListClick(evt) {
+    const classes = evt.target.classList;
+
+    if (classes.contains("remove-btn")) {
+        evt.preventDefault();
+        handleRemove(evt);
+    } else if (classes.contains("fa-caret-square-up") || classes.contains("fa-caret-square-down")) {
+        handleMove(evt);
+    }
+}
+
 function handleMove(evt) {
-    const classes = [...evt.target.classList];
-    const div = evt.target.closest("div");
-    const arrIndex = div.dataset.index;
-
-    char = currentList[arrIndex];
-
-    if (classes.includes("fa-caret-square-up")) {
-        currentList.splice(arrIndex, 1)
-        currentList.splice((arrIndex - 1), 0, char)
-    } else if (classes.includes("fa-caret-square-down")) {
-        currentList.splice(arrIndex, 1)
-        currentList.splice((arrIndex + 1), 0, char)
+    const arrIndex = Number(evt.target.closest(".list-character").dataset.index);
+    const newIndex = evt.target.classList.contains("fa-caret-square-up") ? arrIndex - 1 : arrIndex + 1;
+
+    if (newIndex < 0 || newIndex >= currentList.length) {
+        return;
     }
 
+    const char = currentList[arrIndex];
+    currentList.splice(arrIndex, 1);
+    currentList.splice(newIndex, 0, char);
+
     formCharacters.value = toForm(currentList);
     showList();
 
 }
 
 
-// Function to listen for clicks on "remove button" on characters
-// that are already in the list. Should remove them from the UI and 
-// remove them from the array.
+// Removes a character that is already in the list from the UI and the array
 function handleRemove(evt) {
-    evt.preventDefault()
-
-    classes = [...evt.target.classList];
-    if (classes.includes('remove-btn')) {
-        const div = evt.target.closest("div");
-        const arrIndex = div.dataset.index;
+    const arrIndex = Number(evt.target.closest(".list-character").dataset.index);
 
-        if (currentList.length < 2 && arrIndex == 0) {
-            currentList = [];
-            formCharacters.value = "";
-        } else {
-            currentList.splice(arrIndex, 1);
-            formCharacters.value = toForm(currentList);
-        }
+    currentList.splice(arrIndex, 1);
+    formCharacters.value = toForm(currentList);
 
-        showList();
-    }
+    showList();
 }
 
 // Converts currentList to a string that can input to the hidden characters field
 function toForm(currList) {
-    let guidString = currList[0]["guid"];
-    for (let i = 1; i < currList.length; i++) {
-        guidString = guidString + ", " + currList[i]["guid"];
-    }
-    return guidString;
+    return currList.map(char => char["guid"]).join(", ");
 }
 
 
@@ -202,46 +340,29 @@ function toForm(currList) {
 // When on, show ranks and arrows to change ranks
 // When off, remove ranks and remove arrows
 function handleRankedCheckbox() {
-
-    const arrowContainer = document.getElementsByClassName("arrow-btns")
-
-    if (ranked_check.checked) {
-        const arrows = `<span class="arrow-btns float-right" style="font-size:2em; color:lightblue;"><i class="fas fa-caret-square-up m-2"></i><i class="fas fa-caret-square-down m-2"></i></span>`;
-        for (characterButton of arrowContainer) {
-            characterButton.innerHTML = arrows;
-        }
-    } else {
-        for (characterButton of arrowContainer) {
-            characterButton.innerHTML = "";
-        }
-    }
-    formCharacters.value = toForm(currentList);
     showList()
 }
 
-// If user is editing an already made list, this function will fill the 
+// If user is editing an already made list, this function will fill the
 // characters side with the characters in the list
 async function fillListForEdit() {
     if (window.location.href.includes("edit")) {
         const listId = document.getElementById("edit-list-title").dataset.listid;
 
         const req = await axios.get(`/get-list/${listId}`)
-        characters = req.data.characters
-        console.log(characters)
-        for (char of characters) {
-            currentList.push(char)
-        }
+        currentList = req.data.characters;
         formCharacters.value = toForm(currentList);
         showList()
     }
 
 }
 
-listContainer.addEventListener("click", handleMove);
+// Every listener is registered once here. Clicks on results and list items
+// are handled by their containers, so re-rendering doesn't add any.
+searchContainer.addEventListener("click", handleAdd);
+listContainer.addEventListener("click", handleListClick);
 searchButton.addEventListener("click", handleSearch);
+searchField.addEventListener("keydown", handleSearch);
+searchField.addEventListener("input", handleTyping);
 ranked_check.addEventListener("click", handleRankedCheckbox);
 fillListForEdit();
-
-
-
-
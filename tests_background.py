@@ -0,0 +1,93 @@
+from unittest import TestCase
+import threading
+import time
+
+from flask import Flask, current_app
+
+from background import BackgroundWorker
+
+
+class CountingWorker(BackgroundWorker):
+
+    name = "counting"
+
+    def __init__(self, app, interval=60, threads=1, fail=False):
+        super().__init__(app, interval, threads)
+        self.fail = fail
+        self.runs = []
+        self.ran = threading.Event()
+
+    def run_once(self):
+        self.runs.append(current_app.name)
+        self.ran.set()
+
+        if self.fail:
+            raise ValueError("mario")
+
+
+class BackgroundWorkerTestCase(TestCase):
+
+    """Test the threads running background work"""
+
+    def setUp(self):
+        self.app = Flask("background")
+
+    def test_start_stop(self):
+        """Are the threads started once, run in an app context, and joined
+        when stopped?"""
+
+        worker = CountingWorker(self.app, threads=2)
+        worker.start()
+        worker.start()
+
+        self.assertTrue(worker.is_running())
+        self.assertEqual(sorted(thread.name for thread in worker._threads),
+                         ["counting-0", "counting-1"])
+
+        deadline = time.monotonic() + 5
+        while len(worker.runs) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        worker.stop()
+
+        self.assertFalse(worker.is_running())
+        self.assertTrue(worker.stopping())
+        self.assertEqual(worker.runs, ["background", "background"])
+
+    def test_wake(self):
+        """Does wake() run the work straight away instead of after interval?"""
+
+        worker = CountingWorker(self.app)
+        worker.start()
+
+        try:
+            self.assertTrue(worker.ran.wait(5))
+            worker.ran.clear()
+
+            worker.wake()
+
+            self.assertTrue(worker.ran.wait(5))
+        finally:
+            worker.stop()
+
+        self.assertEqual(len(worker.runs), 2)
+
+    def test_failed_run(self):
+        """Does the worker keep going after a run fails?"""
+
+        worker = CountingWorker(self.app, fail=True)
+
+        with self.assertLogs("epiclist", "ERROR"):
+            worker.start()
+
+            try:
+                self.assertTrue(worker.ran.wait(5))
+                worker.ran.clear()
+
+                worker.wake()
+
+                self.assertTrue(worker.ran.wait(5))
+            finally:
+                worker.stop()
+
+        self.assertEqual(len(worker.runs), 2)
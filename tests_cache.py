@@ -0,0 +1,412 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows
+from unittest import TestCase
+import os
+import time
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from app import app, CURR_USER_KEY, search_cache, search_cache_key
+from cache import MemoryCache, RedisCache, SingleFlight, SharedFlight
+from mock_giantbomb import MockGiantBomb
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import fakeredis
+import giantbomb
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MemoryCacheTestCase(TestCase):
+
+    """Test the in-process cache"""
+
+    def test_get_set(self):
+        """Does the cache return what was set and count hits and misses?"""
+
+        cache = MemoryCache(ttl=60, max_entries=10)
+
+        self.assertIsNone(cache.get("mario"))
+        cache.set("mario", [{"name": "Mario"}])
+
+        self.assertEqual(cache.get("mario"), [{"name": "Mario"}])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+    def test_ttl(self):
+        """Do entries expire once their TTL has passed?"""
+
+        cache = MemoryCache(ttl=0.05, max_entries=10)
+        cache.set("mario", [])
+
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get("mario"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted when the cache is full?"""
+
+        cache = MemoryCache(ttl=60, max_entries=2)
+        cache.set("mario", 1)
+        cache.set("link", 2)
+
+        # Using mario makes link the least recently used entry
+        cache.get("mario")
+        cache.set("sonic", 3)
+
+        self.assertEqual(cache.get("mario"), 1)
+        self.assertIsNone(cache.get("link"))
+        self.assertEqual(cache.get("sonic"), 3)
+
+    def test_incr(self):
+        """Do counters count up until they expire?"""
+
+        cache = MemoryCache(ttl=0.05, max_entries=10)
+
+        self.assertEqual(cache.incr("mario"), 1)
+        self.assertEqual(cache.incr("mario"), 2)
+
+        time.sleep(0.1)
+
+        self.assertEqual(cache.incr("mario"), 1)
+
+
+class RedisCacheTestCase(TestCase):
+
+    """Test the cache shared through Redis, against a fake Redis server"""
+
+    def make_cache(self, ttl=60, max_entries=10):
+        cache = RedisCache("redis://localhost:6379/0", "test", ttl, max_entries)
+        cache.client = self.client
+        return cache
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+    def test_get_set(self):
+        """Does the cache return what was set and count hits and misses?"""
+
+        cache = self.make_cache()
+
+        self.assertIsNone(cache.get("mario"))
+        cache.set("mario", [{"name": "Mario"}])
+
+        self.assertEqual(cache.get("mario"), [{"name": "Mario"}])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+        cache.delete("mario")
+
+        self.assertIsNone(cache.get("mario"))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "entries": 0})
+
+    def test_shared_between_workers(self):
+        """Do caches with the same prefix on one server share entries?"""
+
+        self.make_cache().set("mario", 1)
+
+        self.assertEqual(self.make_cache().get("mario"), 1)
+
+    def test_get_many(self):
+        """Are several keys read at once, in order, with None for misses?"""
+
+        cache = self.make_cache()
+        cache.set("mario", 1)
+        cache.set("sonic", 3)
+
+        self.assertEqual(cache.get_many(["mario", "link", "sonic"]), [1, None, 3])
+        self.assertEqual(cache.get_many([]), [])
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "entries": 2})
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted when the cache is full?"""
+
+        cache = self.make_cache(max_entries=2)
+        cache.set("mario", 1)
+        cache.set("link", 2)
+
+        # Using mario makes link the least recently used entry
+        time.sleep(0.01)
+        cache.get("mario")
+        cache.set("sonic", 3)
+
+        self.assertEqual(cache.get("mario"), 1)
+        self.assertIsNone(cache.get("link"))
+        self.assertEqual(cache.get("sonic"), 3)
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_expired_not_counted(self):
+        """Are entries that expired left out of max_entries, so they don't
+        push out live ones?"""
+
+        cache = self.make_cache(ttl=1, max_entries=2)
+        cache.set("mario", 1)
+        time.sleep(0.5)
+        cache.set("sonic", 2)
+
+        # Used after sonic was set, but expires first
+        time.sleep(0.1)
+        cache.get("mario")
+        time.sleep(0.5)
+
+        cache.set("kirby", 3)
+
+        self.assertEqual(cache.get_many(["mario", "sonic", "kirby"]), [None, 2, 3])
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_incr(self):
+        """Do counters count up, expiring ttl seconds after they started?"""
+
+        cache = self.make_cache(ttl=1)
+
+        self.assertEqual(cache.incr("mario"), 1)
+        self.assertEqual(cache.incr("mario"), 2)
+        self.assertGreater(self.client.pttl("test:mario"), 0)
+
+        time.sleep(1.1)
+
+        self.assertEqual(cache.incr("mario"), 1)
+
+    def test_short_ttl(self):
+        """Do TTLs under a second work, like SEARCH_WAIT's search locks?"""
+
+        cache = self.make_cache(ttl=0.2)
+        cache.set("mario", 1)
+
+        self.assertEqual(cache.incr("lock"), 1)
+        self.assertEqual(cache.get("mario"), 1)
+
+        time.sleep(0.3)
+
+        self.assertIsNone(cache.get("mario"))
+        self.assertEqual(cache.incr("lock"), 1)
+
+    def test_clear(self):
+        """Does clearing remove the entries and counters of this cache only?"""
+
+        cache = self.make_cache()
+        other = RedisCache("redis://localhost:6379/0", "other", 60, 10)
+        other.client = self.client
+
+        cache.set("mario", 1)
+        other.set("mario", 2)
+        cache.clear()
+
+        self.assertIsNone(cache.get("mario"))
+        self.assertEqual(other.get("mario"), 2)
+
+
+class SingleFlightTestCase(TestCase):
+
+    """Test sharing loads between concurrent callers"""
+
+    def test_shared_load(self):
+        """Do callers asking for a key being loaded get that load's result?"""
+
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "mario"
+
+        with ThreadPoolExecutor(4) as pool:
+            leader = pool.submit(flights.do, "mario", load)
+            started.wait(5)
+            followers = [pool.submit(flights.do, "mario", load) for _ in range(3)]
+
+            time.sleep(0.05)
+            release.set()
+
+            self.assertEqual([f.result() for f in [leader] + followers], ["mario"] * 4)
+
+        self.assertEqual(len(calls), 1)
+
+        # Once finished, the next caller loads again
+        self.assertEqual(flights.do("mario", lambda: "luigi"), "luigi")
+
+    def test_shared_error(self):
+        """Is a failed load's exception raised for every caller?"""
+
+        flights = SingleFlight()
+
+        with self.assertRaises(ValueError):
+            flights.do("mario", lambda: int("mario"))
+
+
+class SharedFlightTestCase(TestCase):
+
+    """Test sharing loads between processes through shared caches"""
+
+    def setUp(self):
+        # Two flights sharing the caches stand in for two worker processes
+        # sharing Redis
+        self.locks = MemoryCache(5, 100)
+        self.results = MemoryCache(60, 100)
+        self.flights = [SharedFlight(self.locks, self.results, wait=2, poll=0.01)
+                        for _ in range(2)]
+
+    def test_shared_load(self):
+        """Does a caller in another process get the result stored by the
+        load already running?"""
+
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            self.results.set("mario", "mario")
+            return "mario"
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(self.flights[0].do, "mario", load)
+            started.wait(5)
+            follower = pool.submit(self.flights[1].do, "mario", load)
+
+            time.sleep(0.05)
+            release.set()
+
+            self.assertEqual([leader.result(), follower.result()], ["mario", "mario"])
+
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(self.locks.get("mario"))
+
+    def test_failed_load(self):
+        """Does a waiting caller load the key itself when the load it waited
+        on fails?"""
+
+        started = threading.Event()
+
+        def failing_load():
+            started.set()
+            time.sleep(0.05)
+            raise ValueError("mario")
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(self.flights[0].do, "mario", failing_load)
+            started.wait(5)
+            follower = pool.submit(self.flights[1].do, "mario", lambda: "luigi")
+
+            with self.assertRaises(ValueError):
+                leader.result()
+            self.assertEqual(follower.result(), "luigi")
+
+
+class SearchCacheTestCase(TestCase):
+
+    """Test caching of character searches"""
+
+    def setUp(self):
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        self.user1 = User.signup(username="tester1",
+                                    password="password123")
+        self.user1.id = 11111
+
+        db.session.commit()
+
+        search_cache.clear()
+        self.mock = MockGiantBomb().start()
+        self.api_url = giantbomb.API_URL
+        giantbomb.API_URL = self.mock.url
+
+    def tearDown(self):
+        res = super().tearDown()
+        giantbomb.API_URL = self.api_url
+        self.mock.stop()
+        db.session.rollback()
+        return res
+
+    def search(self, client, term, **params):
+        return client.post("/search-characters", json={"term": term, **params})
+
+    def test_search_cache_key(self):
+        """Do searches that only differ by case or spacing share a cache key?"""
+
+        key1 = search_cache_key("Mario", 10, 1)
+        key2 = search_cache_key("  mario ", 10, 1)
+        key3 = search_cache_key("Luigi", 10, 1)
+        key4 = search_cache_key("Mario", 10, 2)
+
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+        self.assertNotEqual(key1, key4)
+
+    def test_repeated_search_cached(self):
+        """Is a repeated search answered from the cache without calling the API?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            res1 = self.search(c, "Mario")
+            res2 = self.search(c, "mario")
+
+            self.assertEqual(res1.status_code, 200)
+            self.assertEqual(res1.json, res2.json)
+            self.assertEqual(len(res1.json["character_results"]), 10)
+            self.assertEqual(len(self.mock.requests), 1)
+            self.assertEqual(search_cache.stats()["hits"], 1)
+            self.assertEqual(search_cache.stats()["misses"], 1)
+
+    def test_upstream_query(self):
+        """Is the API called with the server's key and a bounded limit and page?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            res = self.search(c, "Mario  Kart", limit=500, page=3)
+
+        self.assertEqual(len(res.json["character_results"]), 10)
+
+        path = self.mock.requests[0]
+        self.assertIn(f"api_key={giantbomb.API_KEY}", path)
+        self.assertIn("query=mario+kart", path)
+        self.assertIn("limit=10", path)
+        self.assertIn("page=3", path)
+
+    def test_bad_search(self):
+        """Are searches without a term or with a bad limit refused?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            self.assertEqual(self.search(c, "  ").status_code, 400)
+            self.assertEqual(self.search(c, "m" * 101).status_code, 400)
+            self.assertEqual(self.search(c, "mario", limit="ten").status_code, 400)
+            self.assertEqual(c.post("/search-characters", json={"data": "{}"}).status_code, 400)
+
+        self.assertEqual(self.mock.requests, [])
+
+    def test_concurrent_searches_coalesced(self):
+        """Do identical searches arriving together share one API call?"""
+
+        self.mock.delay = 0.2
+
+        def search(term):
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 11111
+
+                return self.search(c, term).json
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(search, ["Mario", "mario", " MARIO", "Mario"]))
+
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(len(self.mock.requests), 1)
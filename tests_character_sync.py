@@ -0,0 +1,155 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows, RateLimit
+from unittest import TestCase
+from datetime import datetime, timedelta
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from app import app
+from character_sync import CharacterSync, SharedTokenBucket
+from giantbomb import GiantBombClient
+from mock_giantbomb import MockGiantBomb
+import giantbomb
+
+db.create_all()
+
+
+class CharacterSyncTestCase(TestCase):
+
+    """Test the background sync of characters from GiantBomb"""
+
+    def setUp(self):
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+
+        user = User.signup(username="tester1", password="password123")
+        user.id = 11111
+
+        # Fetched long ago, with details that have since changed on GiantBomb
+        mario = Character(guid="3005-177", name="Mario", game="Super Mario 64",
+                          last_fetched=datetime.utcnow() - timedelta(days=30))
+        mario.id = 1111
+
+        # Fetched just now
+        link = Character(guid="3005-191", name="Link", game="Zelda")
+        link.id = 2222
+
+        lst = List(title="title1", user_id=11111, is_ranked=False, is_private=False)
+        lst.id = 111111
+        lst.characters.append(mario)
+
+        db.session.add_all([user, mario, link, lst])
+        db.session.commit()
+
+        self.mock = MockGiantBomb().start()
+        self.api_url = giantbomb.API_URL
+        giantbomb.API_URL = self.mock.url
+
+        self.sync = CharacterSync(app, GiantBombClient(),
+                                  SharedTokenBucket("test-sync", rate=100, capacity=10),
+                                  max_age=timedelta(days=7), batch_size=10)
+
+    def tearDown(self):
+        res = super().tearDown()
+        giantbomb.API_URL = self.api_url
+        self.mock.stop()
+        db.session.rollback()
+
+        # Later test modules seed characters with the same ids
+        ListCharacter.query.delete()
+        List.query.delete()
+        Character.query.delete()
+        RateLimit.query.delete()
+        db.session.commit()
+
+        self.ctx.pop()
+        return res
+
+    def test_refresh_stale(self):
+        """Are only stale characters refreshed, moving their lists on to a new revision?"""
+
+        self.assertEqual(self.sync.run_once(), 1)
+        self.assertEqual(self.mock.requests, ["/api/character/3005-177/?api_key=7257597392c1160f53ddc5354ec336518380ec17&format=json"])
+
+        mario = Character.query.get(1111)
+        self.assertEqual(mario.name, "Character 3005-177")
+        self.assertEqual(mario.game, "Game 3005-177, Sequel 3005-177")
+        self.assertGreater(mario.last_fetched, datetime.utcnow() - timedelta(minutes=1))
+
+        self.assertEqual(Character.query.get(2222).name, "Link")
+        self.assertEqual(List.query.get(111111).revision, 2)
+
+        # Nothing is stale anymore
+        self.assertEqual(self.sync.run_once(), 0)
+
+    def test_prefetch(self):
+        """Are queued characters that aren't stored yet fetched and stored?"""
+
+        self.sync.batch_size = 2
+        self.sync.prefetch(["3005-191", "3005-501", "3005-502"])
+
+        # Link is already stored, so the queued new characters fill the batch
+        self.assertEqual(self.sync.run_once(), 2)
+        self.assertEqual(Character.query.filter(Character.guid.in_(["3005-501", "3005-502"])).count(), 2)
+        self.assertEqual(Character.query.get(1111).name, "Mario")
+
+    def test_claim_stale(self):
+        """Are claimed characters left out of the next claim?"""
+
+        claims = Character.claim_stale(timedelta(days=7), 10)
+
+        self.assertEqual(list(claims), ["3005-177"])
+        self.assertLess(claims["3005-177"], datetime.utcnow() - timedelta(days=29))
+        self.assertEqual(Character.claim_stale(timedelta(days=7), 10), {})
+
+    def test_api_errors(self):
+        """Does a character that can't be fetched get skipped?"""
+
+        self.mock.fail_with = 404
+
+        self.assertEqual(self.sync.run_once(), 0)
+        self.assertEqual(Character.query.get(1111).name, "Mario")
+
+    def test_failed_refresh_retried(self):
+        """Is a character that couldn't be refreshed claimed again by the
+        next sync instead of waiting out max_age?"""
+
+        self.mock.fail_with = 503
+        self.mock.fail_times = 4
+        self.sync.client = GiantBombClient(retries=0)
+
+        self.assertEqual(self.sync.run_once(), 0)
+        self.assertLess(Character.query.get(1111).last_fetched,
+                        datetime.utcnow() - timedelta(days=29))
+
+        self.sync.client = GiantBombClient(backoff=0.01)
+
+        self.assertEqual(self.sync.run_once(), 1)
+        self.assertEqual(Character.query.get(1111).name, "Character 3005-177")
+
+    def test_shared_bucket(self):
+        """Do buckets with the same name draw on the same tokens?"""
+
+        first = SharedTokenBucket("test", rate=0.001, capacity=2)
+        second = SharedTokenBucket("test", rate=0.001, capacity=2)
+        other = SharedTokenBucket("other", rate=0.001, capacity=1)
+
+        self.assertTrue(first.try_acquire())
+        self.assertTrue(second.try_acquire())
+        self.assertFalse(first.try_acquire())
+        self.assertFalse(second.acquire(timeout=0.05))
+        self.assertTrue(other.try_acquire())
+
+        # Refilled over time
+        fast = SharedTokenBucket("fast", rate=20, capacity=1)
+
+        self.assertTrue(fast.try_acquire())
+        self.assertTrue(fast.acquire(timeout=1))
+
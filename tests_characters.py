@@ -2,6 +2,7 @@ from models import db, connect_db, User, Character, List, ListCharacter, Follows
 from unittest import TestCase
 import os
 os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
 
 from app import app, CURR_USER_KEY
 
@@ -1,7 +1,8 @@
-from models import db, connect_db, User, Character, List, ListCharacter, Follows, DEFAULT_IMAGE_URL
+from models import db, connect_db, User, Character, List, ListCharacter, Follows, FeedEntry, DEFAULT_IMAGE_URL
 from unittest import TestCase
 import os
 os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
 
 from app import app, CURR_USER_KEY
 
@@ -16,6 +17,7 @@ class FollowsTestCase(TestCase):
     def setUp(self):
 
         User.query.delete()
+        Character.query.delete()
         List.query.delete()
         ListCharacter.query.delete()
 
@@ -101,6 +103,114 @@ class FollowsTestCase(TestCase):
             self.assertTrue(after_unfollow_len == empty_following_len)
             self.assertNotIn(followed_user, test_user.following)
 
+    def test_follow_counts(self):
+        """Do following and unfollowing keep both users' counters in sync,
+        without counting a repeated follow twice?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            c.post("/users/22222/follow")
+            c.post("/users/22222/follow")
+
+            self.assertEqual(User.query.get(11111).following_count, 1)
+            self.assertEqual(User.query.get(22222).followers_count, 1)
+            self.assertEqual(Follows.query.count(), 1)
+
+            c.post("/users/22222/unfollow")
+            c.post("/users/22222/unfollow")
+
+            self.assertEqual(User.query.get(11111).following_count, 0)
+            self.assertEqual(User.query.get(22222).followers_count, 0)
+
+    def test_delete_user_follow_counts(self):
+        """Does deleting a user take them out of other users' counters?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            c.post("/users/22222/follow")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 33333
+
+            c.post("/users/11111/follow")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+
+            c.post("/users/tester1/delete")
+
+            self.assertIsNone(User.query.get(11111))
+            self.assertEqual(User.query.get(22222).followers_count, 0)
+            self.assertEqual(User.query.get(33333).following_count, 0)
+
+    def feed_list_ids(self, user_id):
+        return sorted(entry.list_id for entry in FeedEntry.query.filter(
+            FeedEntry.user_id == user_id).all())
+
+    def test_follow_backfills_feed(self):
+        """Does following a user add their public lists to the follower's
+        feed, and unfollowing take them out again?"""
+
+        private_list = List(id=222222, title="private", user_id=11111,
+                            is_ranked=False, is_private=True)
+        db.session.add(private_list)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 22222
+
+            c.post("/users/11111/follow")
+
+            self.assertEqual(self.feed_list_ids(22222), [111111])
+
+            res = c.get("/?filter=true")
+
+            self.assertIn("title1", res.get_data(as_text=True))
+
+            c.post("/users/11111/unfollow")
+
+            self.assertEqual(self.feed_list_ids(22222), [])
+
+    def test_publish_fans_out(self):
+        """Are new public lists added to followers' feeds, and removed when
+        made private or deleted?"""
+
+        db.session.add(Character(guid="3005-177", name="Mario", game="Super Mario 64"))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 22222
+
+            c.post("/users/11111/follow")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+
+            c.post("/lists/new", data={"title": "private list", "is_private": "y",
+                                       "characters": "3005-177"})
+            c.post("/lists/new", data={"title": "public list", "characters": "3005-177"})
+
+            private_list = List.query.filter(List.title == "private list").first()
+            public_list = List.query.filter(List.title == "public list").first()
+
+            self.assertEqual(self.feed_list_ids(22222), sorted([111111, public_list.id]))
+
+            c.post(f"/lists/{private_list.id}/edit",
+                   data={"title": "private list", "characters": "3005-177"})
+            c.post(f"/lists/{public_list.id}/edit",
+                   data={"title": "public list", "is_private": "y", "characters": "3005-177"})
+
+            self.assertEqual(self.feed_list_ids(22222), sorted([111111, private_list.id]))
+
+            c.post(f"/lists/{private_list.id}/delete")
+
+            self.assertEqual(self.feed_list_ids(22222), [111111])
+            self.assertEqual(self.feed_list_ids(33333), [])
+
     def test_repr(self):
         """Does the __repr__ display as expectd?"""
         with self.client as c:
@@ -0,0 +1,104 @@
+from unittest import TestCase
+import requests
+import time
+
+from giantbomb import GiantBombClient, character_url
+from mock_giantbomb import MockGiantBomb
+
+
+class GiantBombClientTestCase(TestCase):
+
+    """Test the pooled GiantBomb client against a local mock of the API"""
+
+    def setUp(self):
+        self.mock = None
+
+    def tearDown(self):
+        res = super().tearDown()
+        if self.mock:
+            self.mock.stop()
+        return res
+
+    def test_keep_alive(self):
+        """Do repeated calls reuse the same connection?"""
+
+        self.mock = MockGiantBomb().start()
+        client = GiantBombClient()
+
+        for i in range(5):
+            client.search(f"{self.mock.url}/search/?query=mario")
+
+        self.assertEqual(len(self.mock.requests), 5)
+        self.assertEqual(len(self.mock.connections), 1)
+
+    def test_retry_server_errors(self):
+        """Are rate limited and server error responses retried?"""
+
+        self.mock = MockGiantBomb(fail_with=503, fail_times=2).start()
+        client = GiantBombClient(backoff=0.01)
+
+        character = client.get_character(f"{self.mock.url}/character/3005-177/")
+
+        self.assertEqual(character["guid"], "3005-177")
+        self.assertEqual(len(self.mock.requests), 3)
+
+    def test_retries_exhausted(self):
+        """Does the client give up once it is out of retries?"""
+
+        self.mock = MockGiantBomb(fail_with=429).start()
+        client = GiantBombClient(retries=2, backoff=0.01)
+
+        with self.assertRaises(requests.exceptions.RequestException):
+            client.get_character(f"{self.mock.url}/character/3005-177/")
+
+        self.assertEqual(len(self.mock.requests), 3)
+        self.assertEqual(client.metrics.snapshot()["character"]["errors"], 1)
+
+    def test_retry_after_ignored(self):
+        """Is a long Retry-After ignored, so the request fails fast?"""
+
+        self.mock = MockGiantBomb(fail_with=429, retry_after=30).start()
+        client = GiantBombClient(retries=2, backoff=0.01)
+
+        start = time.perf_counter()
+
+        with self.assertRaises(requests.exceptions.RequestException):
+            client.get_character(f"{self.mock.url}/character/3005-177/")
+
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(len(self.mock.requests), 3)
+
+    def test_not_found(self):
+        """Are client errors raised straight away without retrying?"""
+
+        self.mock = MockGiantBomb().start()
+        client = GiantBombClient(backoff=0.01)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.get(f"{self.mock.url}/not-a-resource/")
+
+        self.assertEqual(len(self.mock.requests), 1)
+
+    def test_metrics(self):
+        """Is the latency of every call recorded by call type?"""
+
+        self.mock = MockGiantBomb(delay=0.05).start()
+        client = GiantBombClient()
+
+        client.search(f"{self.mock.url}/search/?query=mario")
+        client.search(f"{self.mock.url}/search/?query=link")
+        client.get_character(f"{self.mock.url}/character/3005-177/")
+
+        metrics = client.metrics.snapshot()
+
+        self.assertEqual(metrics["search"]["count"], 2)
+        self.assertEqual(metrics["character"]["count"], 1)
+        self.assertEqual(metrics["search"]["errors"], 0)
+        self.assertGreaterEqual(metrics["search"]["p50_ms"], 50)
+        self.assertGreaterEqual(metrics["search"]["max_ms"], metrics["search"]["p50_ms"])
+
+    def test_character_url(self):
+        """Does character_url build the API url for a character?"""
+
+        self.assertEqual(character_url("3005-177"),
+                         "https://www.giantbomb.com/api/character/3005-177/?api_key=7257597392c1160f53ddc5354ec336518380ec17&format=json")
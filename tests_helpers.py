@@ -1,11 +1,16 @@
-from models import db, connect_db, User, Character, List, ListCharacter, Follows, DEFAULT_IMAGE_URL
+from models import db, connect_db, User, Character, List, ListCharacter, Follows, DEFAULT_IMAGE_URL, game_list_to_string
 from unittest import TestCase
 from flask import json
+from sqlalchemy import event
 import os
 import requests
 os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
 
-from app import app, CURR_USER_KEY, HEADERS, format_list, format_lists, convert_guids_to_api_queries, organize_characters, initialize_character, game_list_to_string
+from app import app, CURR_USER_KEY, format_list, format_lists, convert_guids_to_api_queries, organize_characters, initialize_character, resolve_characters, insert_characters, api_client
+from giantbomb import HEADERS
+from mock_giantbomb import MockGiantBomb, fake_character
+import time
 
 db.create_all()
 
@@ -18,6 +23,10 @@ class HelperFunctionsTestCase(TestCase):
 
     def setUp(self):
 
+        # Helpers read the config of the app handling the request
+        self.ctx = app.app_context()
+        self.ctx.push()
+
         User.query.delete()
         Character.query.delete()
         List.query.delete()
@@ -108,6 +117,7 @@ class HelperFunctionsTestCase(TestCase):
     def tearDown(self):
         res = super().tearDown()
         db.session.rollback()
+        self.ctx.pop()
         return res
 
 
@@ -167,6 +177,27 @@ class HelperFunctionsTestCase(TestCase):
         self.assertIn(expected3, str(l))
         self.assertIn(expected4, str(l))
     
+    def test_format_lists_single_query(self):
+        """Does format_lists load the characters of every list with one query
+        instead of one query per list?"""
+
+        lists = List.query.all()
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            l = format_lists(lists)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+
+        ranks = {item["list"].id: [c["rank"] for c in item["characters"]] for item in l}
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(ranks, {111111: [1, 2, 3], 222222: [None, None]})
+
     def test_convert_guids_to_api_queries(self):
         """Does the function take a string of guids and create an object containing a
         formatted query ready to call the API with along with a the guid to check
@@ -224,6 +255,78 @@ class HelperFunctionsTestCase(TestCase):
         self.assertEqual(expected, str(char))
         self.assertTrue(Character.query.filter(Character.guid == "3005-177").first())
     
+    def test_resolve_characters_concurrent(self):
+        """Are characters missing from the db fetched from the API at the same
+        time, and characters already in the db not fetched at all?"""
+
+        mock = MockGiantBomb(delay=0.5).start()
+        try:
+            guids = ["3005-177", "3005-501", "3005-502", "3005-503", "3005-504"]
+            queries = [{"guid": guid, "query": f"{mock.url}/character/{guid}/"}
+                       for guid in guids]
+
+            start = time.time()
+            characters = resolve_characters(queries)
+            elapsed = time.time() - start
+        finally:
+            mock.stop()
+
+        # Fetching the four new characters one after another would take 2 seconds
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(len(mock.requests), 4)
+        self.assertEqual(characters["3005-177"].id, 1111)
+        self.assertEqual(characters["3005-501"].name, "Character 3005-501")
+        self.assertEqual(characters["3005-501"].game, "Game 3005-501, Sequel 3005-501")
+        self.assertEqual(Character.query.filter(Character.guid.in_(guids)).count(), 5)
+
+    def test_resolve_characters_known(self):
+        """Are characters that are all in the db found with one query and
+        without calling the API?"""
+
+        queries = convert_guids_to_api_queries("3005-177, 3005-191, 3005-73")
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            characters = resolve_characters(queries)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+
+        self.assertEqual(len(statements), 1)
+        self.assertIn(" IN ", statements[0])
+        self.assertEqual({c.id for c in characters.values()}, {1111, 2222, 3333})
+
+    def test_insert_characters_no_duplicates(self):
+        """Does adding a character that is already in the db leave the
+        existing row alone instead of creating a duplicate?"""
+
+        insert_characters([fake_character("3005-177"), fake_character("3005-501")])
+
+        marios = Character.query.filter(Character.guid == "3005-177").all()
+
+        self.assertEqual(len(marios), 1)
+        self.assertEqual(marios[0].name, "Mario")
+        self.assertTrue(Character.query.filter(Character.guid == "3005-501").first())
+
+    def test_resolve_characters_timeout(self):
+        """Does a slow API response time out instead of holding the request?"""
+
+        mock = MockGiantBomb(delay=1).start()
+        api_client.timeout = 0.2
+        try:
+            query = {"guid": "3005-501", "query": f"{mock.url}/character/3005-501/"}
+
+            with self.assertRaises(requests.exceptions.Timeout):
+                resolve_characters([query])
+        finally:
+            api_client.timeout = app.config["GIANTBOMB_TIMEOUT"]
+            mock.stop()
+
+        self.assertFalse(Character.query.filter(Character.guid == "3005-501").first())
+
     def test_organize_characters_ranked_new(self):
         """Does the function organize and rank characters of a new ranked list?"""
 
@@ -324,6 +427,49 @@ class HelperFunctionsTestCase(TestCase):
         self.assertIn(str(char2), str(list1.characters))
         self.assertIn(str(char3), str(list1.characters))
 
+    def test_organize_characters_diff(self):
+        """Does editing a list add, remove and rerank characters with one
+        statement of each kind instead of one per character?"""
+
+        list1 = List.query.get(111111)
+        db.session.add(Character(id=4444, guid="3005-370", name="Luigi", game="Luigi's Mansion"))
+        db.session.commit()
+
+        # Link is removed, Luigi is added, Sonic and Mario swap places
+        queries = convert_guids_to_api_queries("3005-73, 3005-370, 3005-177")
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if "lists_characters" in statement:
+                statements.append(statement.split()[0])
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            organize_characters(queries, list1, False)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+
+        ranks = dict(db.session.query(ListCharacter.character_id, ListCharacter.rank).filter(
+            ListCharacter.list_id == 111111).all())
+
+        self.assertEqual(ranks, {3333: 1, 4444: 2, 1111: 3})
+        self.assertEqual(sorted(statements), ["DELETE", "INSERT", "SELECT", "UPDATE"])
+
+    def test_organize_characters_ranked_to_unranked(self):
+        """Are ranks cleared when a ranked list is made unranked?"""
+
+        list1 = List.query.get(111111)
+        list1.is_ranked = False
+
+        queries = convert_guids_to_api_queries("3005-177, 3005-191, 3005-73")
+
+        organize_characters(queries, list1, False)
+
+        ranks = [lc.rank for lc in ListCharacter.query.filter(ListCharacter.list_id == 111111).all()]
+
+        self.assertEqual(ranks, [None, None, None])
+        self.assertFalse(List.query.get(111111).is_ranked)
+
     def test_game_list_to_string(self):
         """Does the function create a correctly formatted string of games?"""
 
@@ -0,0 +1,221 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows
+from unittest import TestCase
+import io
+import os
+import re
+import shutil
+import socket
+import tempfile
+import time
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+import app as epiclist
+from app import app, CURR_USER_KEY, card_cache, remember_identity
+from cache import MemoryCache
+from images import ImageProxy, ImageFetchError, sniff_image_type
+from mock_giantbomb import MockGiantBomb
+from PIL import Image
+
+db.create_all()
+
+
+class ImageProxyTestCase(TestCase):
+
+    """Test the image proxy"""
+
+    def setUp(self):
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.mock = MockGiantBomb().start()
+
+        self.image_proxy = epiclist.image_proxy
+        epiclist.image_proxy = ImageProxy(app.config["SECRET_KEY"], self.cache_dir,
+                                          failures=MemoryCache(60, 100), allow_private=True)
+
+        app.config["IMAGE_PROXY_ENABLED"] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        app.config["IMAGE_PROXY_ENABLED"] = False
+        epiclist.image_proxy = self.image_proxy
+        self.mock.stop()
+        shutil.rmtree(self.cache_dir)
+        return res
+
+    def proxied_url(self, url, size="thumb"):
+        with app.test_request_context():
+            return epiclist.proxied_image_url(url, size)
+
+    def test_proxy_image(self):
+        """Is an image fetched once, stored and served with immutable cache
+        headers?"""
+
+        url = self.proxied_url(self.mock.image_url(100, 80))
+        self.assertTrue(url.startswith("/images/thumb/"))
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content_type, "image/png")
+        self.assertEqual(res.headers["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(sniff_image_type(res.data), "image/png")
+
+        res = self.client.get(url, headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.mock.requests, ["/images/100x80.png"])
+
+    def test_downscale(self):
+        """Are large images downscaled to fit the size asked for?"""
+
+        res = self.client.get(self.proxied_url(self.mock.image_url(800, 600)))
+        image = Image.open(io.BytesIO(res.data))
+
+        self.assertEqual(image.size, (200, 150))
+
+    def test_bad_signature(self):
+        """Are urls that weren't signed by us refused?"""
+
+        url = self.proxied_url(self.mock.image_url(100, 80))
+        other = self.mock.image_url(200, 80)
+
+        res = self.client.get(re.sub(r"url=.*", f"url={other}", url))
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(self.mock.requests, [])
+
+    def test_not_an_image(self):
+        """Is a url that isn't an image left for the browser to load?"""
+
+        url = f"{self.mock.url}/character/3005-177/"
+        res = self.client.get(self.proxied_url(url))
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(res.location, url)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_failure_remembered(self):
+        """Is a url that couldn't be fetched redirected to straight away the
+        next time, until the failure expires?"""
+
+        url = f"{self.mock.url}/character/3005-177/"
+
+        self.assertEqual(self.client.get(self.proxied_url(url)).status_code, 302)
+        self.assertEqual(self.client.get(self.proxied_url(url, "full")).status_code, 302)
+        self.assertEqual(len(self.mock.requests), 1)
+
+        epiclist.image_proxy.failures.clear()
+
+        self.assertEqual(self.client.get(self.proxied_url(url)).status_code, 302)
+        self.assertEqual(len(self.mock.requests), 2)
+
+    def test_deadline(self):
+        """Is a fetch given up once it's taken longer than the deadline, even
+        when every read is quick?"""
+
+        self.mock.drip = 0.05
+        proxy = ImageProxy("secret", self.cache_dir, timeout=1, deadline=0.5, allow_private=True)
+
+        start = time.monotonic()
+
+        with self.assertRaises(ImageFetchError):
+            proxy.fetch(self.mock.image_url(100, 80))
+
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_private_address(self):
+        """Are urls of private addresses refused?"""
+
+        proxy = ImageProxy("secret", self.cache_dir)
+
+        with self.assertRaises(ImageFetchError):
+            proxy.fetch(self.mock.image_url(100, 80))
+
+        with self.assertRaises(ImageFetchError):
+            proxy.fetch("file:///etc/passwd")
+
+        self.assertEqual(self.mock.requests, [])
+
+    def test_dns_rebinding(self):
+        """Is the address checked the one connected to, when the host would
+        resolve to a private address the second time?"""
+
+        host, port = self.mock.server.server_address
+        getaddrinfo = socket.getaddrinfo
+        lookups = []
+
+        def rebinding_getaddrinfo(name, *args, **kwargs):
+            if name != "images.example.com":
+                return getaddrinfo(name, *args, **kwargs)
+
+            lookups.append(name)
+            address = "93.184.216.34" if len(lookups) == 1 else host
+            return getaddrinfo(address, *args, **kwargs)
+
+        proxy = ImageProxy("secret", self.cache_dir, timeout=0.2)
+        socket.getaddrinfo = rebinding_getaddrinfo
+
+        try:
+            with self.assertRaises(ImageFetchError):
+                proxy.fetch(f"http://images.example.com:{port}/images/100x80.png")
+        finally:
+            socket.getaddrinfo = getaddrinfo
+
+        self.assertEqual(self.mock.requests, [])
+
+
+class ProxiedTemplatesTestCase(TestCase):
+
+    """Test pages linking to images through the proxy"""
+
+    def setUp(self):
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+        card_cache.clear()
+
+        user = User.signup(username="tester1", password="password123",
+                           image_url="https://images.example.com/avatar.png")
+        user.id = 11111
+
+        mario = Character(guid="3005-177", name="Mario", game="Super Mario 64",
+                          image_url="https://images.example.com/mario.png")
+
+        lst = List(title="title1", user_id=11111, is_ranked=False, is_private=False)
+        lst.id = 111111
+        lst.characters.append(mario)
+
+        db.session.add_all([user, mario, lst])
+        db.session.commit()
+
+        app.config["IMAGE_PROXY_ENABLED"] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        app.config["IMAGE_PROXY_ENABLED"] = False
+        db.session.rollback()
+        return res
+
+    def test_proxied_images(self):
+        """Do cards and profiles link to images through the proxy?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            html = c.get("/users/tester1").get_data(as_text=True)
+
+            self.assertIn('src="/images/avatar/', html)
+            self.assertIn('src="/images/thumb/', html)
+            self.assertNotIn('src="https://images.example.com', html)
+
+            html = c.get("/lists/111111").get_data(as_text=True)
+            self.assertIn('src="/images/full/', html)
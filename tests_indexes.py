@@ -0,0 +1,157 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows, FeedEntry
+from unittest import TestCase
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from app import (app, CURR_USER_KEY, remember_identity, load_profile, load_list_contents,
+                 search_local_characters)
+
+db.create_all()
+
+# create_all doesn't add or drop indexes of tables that already exist, so a
+# test database made before the latest migrations gets them applied
+app.test_cli_runner().invoke(args=["migrate"])
+
+
+class IndexTestCase(TestCase):
+
+    """Test the hot path queries are planned with their indexes"""
+
+    def setUp(self):
+
+        # Truncated rather than deleted, so rows left dead by earlier tests
+        # don't change the sizes the planner sees
+        db.session.execute("""TRUNCATE users, characters, lists, lists_characters,
+            follows, feed_entries, list_jobs CASCADE""")
+
+        db.session.execute("""INSERT INTO users (id, username, password)
+            SELECT g, 'tester' || g, 'password' FROM generate_series(1, 50) g""")
+        # Searches for "charac" only match the first 100 of 5000 characters
+        db.session.execute("""INSERT INTO characters (id, guid, name, game)
+            SELECT g, '3005-' || g, CASE WHEN g <= 100 THEN 'Character ' ELSE 'Filler ' END || g,
+                'Game' FROM generate_series(1, 5000) g""")
+        db.session.execute("""INSERT INTO lists (id, title, user_id, is_ranked, is_private)
+            SELECT g, 'title' || g, g % 50 + 1, true, g % 10 = 0 FROM generate_series(1, 1000) g""")
+        db.session.execute("""INSERT INTO lists_characters (list_id, character_id, rank)
+            SELECT l, (l + n) % 100 + 1, n FROM generate_series(1, 1000) l, generate_series(1, 4) n""")
+        db.session.execute("""INSERT INTO follows (user_being_followed, user_following)
+            SELECT g % 50 + 1, g FROM generate_series(1, 50) g""")
+        db.session.commit()
+
+        db.session.execute("ANALYZE")
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def explain(self, run):
+        """
+        Plans of every statement the app runs in run(), joined together
+
+        The statements are captured as the app builds and sends them, then
+        explained with sequential scans discouraged, so the planner shows
+        which index it would use on a large table.
+        """
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            with app.test_request_context():
+                run()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        plans = []
+
+        with db.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for statement, parameters in statements:
+                if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT")):
+                    cursor.execute(f"EXPLAIN {statement}", parameters)
+                    plans.extend(row[0] for row in cursor.fetchall())
+
+        return "\n".join(plans)
+
+    def visit(self, path):
+        """Function requesting path as tester7, for explain()"""
+
+        def run():
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 7
+                    remember_identity(7, "tester7")
+
+                self.assertEqual(c.get(path).status_code, 200)
+
+        return run
+
+    def test_public_feed(self):
+        """Does the public feed walk the primary key back from its cursor?"""
+
+        plan = self.explain(self.visit("/?before=500"))
+
+        self.assertIn("Index Scan Backward using lists_pkey", plan)
+        self.assertIn("(id < 500)", plan)
+
+    def test_user_lists(self):
+        """Do a user's profile and private lists pages use the user index?"""
+
+        plan = self.explain(lambda: load_profile("tester7", 8))
+
+        self.assertIn("ix_lists_user_private_id", plan)
+        self.assertIn("ix_lists_user_private_id",
+                      self.explain(self.visit("/users/tester7/private-lists")))
+
+    def test_list_characters(self):
+        """Are lists' characters found by list id?"""
+
+        plan = self.explain(lambda: load_list_contents([1, 2, 3]))
+
+        self.assertRegex(plan, "ix_lists_characters_list_rank|uq_lists_characters_list_character")
+
+    def test_character_lists(self):
+        """Are a character's lists found by character id?"""
+
+        plan = self.explain(lambda: List.bump_revisions(List.containing_characters([5])))
+
+        self.assertIn("ix_lists_characters_character_id", plan)
+
+    def test_following(self):
+        """Are the users someone follows found by follower?"""
+
+        plan = self.explain(lambda: User.query.get(7).remove_from_follow_counts())
+
+        self.assertIn("ix_follows_user_following", plan)
+
+    def test_feed_retract(self):
+        """Are a list's feed entries found by list id?"""
+
+        plan = self.explain(lambda: FeedEntry.retract(List.query.get(5)))
+
+        self.assertIn("ix_feed_entries_list_id", plan)
+
+    def test_character_search(self):
+        """Does full text search of characters use the search index?"""
+
+        plan = self.explain(lambda: search_local_characters("charac 5", 10))
+
+        self.assertIn("ix_characters_search", plan)
+
+    def test_character_once_per_list(self):
+        """Is a character prevented from being in the same list twice?"""
+
+        # List 1 was given characters 3 to 6
+        db.session.add(ListCharacter(list_id=1, character_id=3, rank=9))
+
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
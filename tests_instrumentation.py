@@ -0,0 +1,141 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows
+from unittest import TestCase
+import json
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+import app as epiclist
+from app import app, CURR_USER_KEY, card_cache, remember_identity
+from instrumentation import QueryStats
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+
+    """Test per-request SQL instrumentation"""
+
+    def setUp(self):
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+        card_cache.clear()
+
+        self.client = app.test_client()
+
+        self.user1 = User.signup(username="tester1",
+                                    password="password123")
+        self.user1.id = 11111
+
+        list1 = List(title="title1",
+                            user_id=11111,
+                            is_ranked=True,
+                            is_private=False
+        )
+        list1.id = 111111
+
+        db.session.add(list1)
+        db.session.commit()
+
+    def tearDown(self):
+        res = super().tearDown()
+        app.config["SQL_QUERY_WARN_THRESHOLD"] = 15
+        app.config["SQL_QUERY_HEADERS"] = True
+        db.session.rollback()
+        return res
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 11111
+            remember_identity(sess[CURR_USER_KEY], "tester1")
+
+    def test_query_headers(self):
+        """Are the query count and time of a request added to the response?"""
+        with self.client as c:
+            self.login(c)
+
+            res = c.get("/lists/111111")
+
+            self.assertEqual(res.status_code, 200)
+            self.assertGreater(int(res.headers["X-DB-Query-Count"]), 0)
+            self.assertGreater(float(res.headers["X-DB-Time-Ms"]), 0)
+
+            res = c.get("/register-home")
+
+            self.assertEqual(res.headers["X-DB-Query-Count"], "0")
+
+    def test_no_query_headers(self):
+        """Are the query headers left out unless SQL_QUERY_HEADERS is on, while
+        the request is still logged?"""
+
+        app.config["SQL_QUERY_HEADERS"] = False
+
+        with self.client as c:
+            self.login(c)
+
+            with self.assertLogs("epiclist.sql", "INFO") as logs:
+                res = c.get("/lists/111111")
+
+            self.assertNotIn("X-DB-Query-Count", res.headers)
+            self.assertNotIn("X-DB-Time-Ms", res.headers)
+            self.assertIn('"endpoint": "epiclist.view_list"', logs.output[0])
+
+    def test_log_line(self):
+        """Is every request logged with its query stats?"""
+        with self.client as c:
+            self.login(c)
+
+            with self.assertLogs("epiclist.sql", "INFO") as logs:
+                c.get("/lists/111111")
+
+            self.assertIn('"endpoint": "epiclist.view_list"', logs.output[0])
+            self.assertIn('"slowest": "SELECT', logs.output[0])
+
+    def test_many_queries_warning(self):
+        """Is a warning logged when a request runs more queries than the threshold?"""
+        app.config["SQL_QUERY_WARN_THRESHOLD"] = 1
+
+        with self.client as c:
+            self.login(c)
+
+            with self.assertLogs("epiclist.sql", "WARNING") as logs:
+                c.get("/lists/111111")
+
+            self.assertIn("Possible N+1 queries: GET /lists/111111", logs.output[0])
+
+    def test_query_stats(self):
+        """Does QueryStats keep the slowest statement?"""
+
+        stats = QueryStats()
+        stats.record("SELECT 1", 0.002)
+        stats.record("SELECT 2", 0.005)
+        stats.record("SELECT 3", 0.001)
+
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.total, 0.008)
+        self.assertEqual(stats.slowest_statement, "SELECT 2")
+
+    def test_metrics_log_line(self):
+        """Does the metrics reporter log the GiantBomb latencies and cache
+        stats?"""
+
+        epiclist.api_client.metrics.reset()
+        epiclist.api_client.metrics.record("character", 0.05, False)
+        card_cache.set("mario", "card")
+        card_cache.get("mario")
+
+        with self.assertLogs("epiclist.metrics", "INFO") as logs:
+            epiclist.metrics_reporter.run_once()
+
+        line = json.loads(logs.records[0].getMessage())
+
+        self.assertEqual(line["giantbomb"]["character"]["count"], 1)
+        self.assertEqual(line["card_cache"]["hits"], 1)
+        self.assertIn("search_cache", line)
+        self.assertIn("identity_cache", line)
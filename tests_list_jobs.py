@@ -0,0 +1,181 @@
+from models import db, connect_db, User, Character, List, ListCharacter, ListJob, Follows
+from unittest import TestCase
+from datetime import datetime, timedelta
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from app import app, CURR_USER_KEY, run_list_job
+from list_jobs import ListJobRunner
+from mock_giantbomb import MockGiantBomb
+import requests
+import giantbomb
+
+db.create_all()
+
+
+class ListJobsTestCase(TestCase):
+
+    """Test list submissions queued for a job worker"""
+
+    def setUp(self):
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        ListJob.query.delete()
+        Follows.query.delete()
+
+        user = User.signup(username="tester1", password="password123")
+        user.id = 11111
+
+        mario = Character(guid="3005-177", name="Mario", game="Super Mario 64")
+        mario.id = 1111
+
+        db.session.add_all([user, mario])
+        db.session.commit()
+
+        self.mock = MockGiantBomb().start()
+        self.api_url = giantbomb.API_URL
+        giantbomb.API_URL = self.mock.url
+
+        app.config["LIST_JOB_MODE"] = "worker"
+        self.runner = ListJobRunner(app, run_list_job, max_attempts=3, backoff=30)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        app.config["LIST_JOB_MODE"] = "inline"
+        giantbomb.API_URL = self.api_url
+        self.mock.stop()
+        db.session.rollback()
+
+        # Later test modules seed characters with the same ids
+        ListJob.query.delete()
+        ListCharacter.query.delete()
+        List.query.delete()
+        Character.query.delete()
+        db.session.commit()
+
+        self.ctx.pop()
+        return res
+
+    def submit(self, characters, list_id=None):
+        url = f"/lists/{list_id}/edit" if list_id else "/lists/new"
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+
+            return c.post(url, data={"title": "Mario and friends", "characters": characters})
+
+    def test_queued_list(self):
+        """Is a new list saved pending without calling the API, then filled in
+        by the job?"""
+
+        res = self.submit("3005-177, 3005-501")
+        lst = List.query.one()
+
+        self.assertEqual(res.status_code, 302)
+        self.assertTrue(res.location.endswith(f"/lists/{lst.id}"))
+        self.assertEqual(lst.status, "pending")
+        self.assertEqual(lst.characters, [])
+        self.assertEqual(self.mock.requests, [])
+
+        page = self.client.get(f"/lists/{lst.id}").get_data(as_text=True)
+        self.assertIn("Adding characters: 1 of 2 ready", page)
+
+        self.assertEqual(self.runner.run_once(), 1)
+
+        lst = List.query.get(lst.id)
+        self.assertEqual(lst.status, "ready")
+        self.assertEqual(lst.revision, 2)
+        self.assertEqual([char.guid for char in lst.characters], ["3005-177", "3005-501"])
+        self.assertEqual(ListJob.query.count(), 0)
+
+        page = self.client.get(f"/lists/{lst.id}").get_data(as_text=True)
+        self.assertNotIn("Adding characters", page)
+
+    def test_edit_replaces_queued_job(self):
+        """Does editing a list before its job ran replace the job?"""
+
+        self.submit("3005-177, 3005-501")
+        lst = List.query.one()
+
+        self.submit("3005-502", lst.id)
+
+        self.assertEqual(ListJob.query.count(), 1)
+        self.assertEqual(self.runner.run_once(), 1)
+        self.assertEqual([char.guid for char in List.query.get(lst.id).characters], ["3005-502"])
+
+    def test_retry(self):
+        """Is a job failing on GiantBomb retried later, then left dead once
+        it's out of attempts?"""
+
+        def handler(job):
+            raise requests.exceptions.ConnectionError("GiantBomb is down")
+
+        self.runner.handler = handler
+        self.submit("3005-177")
+        lst = List.query.one()
+
+        self.assertEqual(self.runner.run_once(), 1)
+
+        job = ListJob.query.one()
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("GiantBomb is down", job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow() + timedelta(seconds=25))
+        self.assertEqual(List.query.get(lst.id).status, "pending")
+
+        # Not due yet
+        self.assertEqual(self.runner.run_once(), 0)
+
+        for attempt in range(2):
+            ListJob.query.update({ListJob.run_at: datetime.utcnow()})
+            db.session.commit()
+            self.assertEqual(self.runner.run_once(), 1)
+
+        self.assertEqual(ListJob.query.one().status, "dead")
+        self.assertEqual(List.query.get(lst.id).status, "failed")
+
+        page = self.client.get(f"/lists/{lst.id}").get_data(as_text=True)
+        self.assertIn("couldn't be added", page)
+
+        # Dead jobs can be queued again once GiantBomb is back
+        self.runner.handler = run_list_job
+        self.assertEqual(ListJob.requeue_dead(), 1)
+        db.session.commit()
+
+        self.assertEqual(self.runner.run_once(), 1)
+        self.assertEqual(List.query.get(lst.id).status, "ready")
+
+    def test_unknown_character(self):
+        """Is a job GiantBomb refuses left dead without retrying?"""
+
+        self.mock.fail_with = 404
+        self.submit("3005-177, 3005-501")
+        lst = List.query.one()
+
+        self.assertEqual(self.runner.run_once(), 1)
+
+        job = ListJob.query.one()
+        self.assertEqual(job.status, "dead")
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(List.query.get(lst.id).status, "failed")
+
+    def test_claim(self):
+        """Are jobs claimed once, and claimed again when their worker died?"""
+
+        self.submit("3005-177")
+
+        job = ListJob.claim(timedelta(minutes=5))
+        db.session.commit()
+
+        self.assertEqual(job.status, "running")
+        self.assertIsNone(ListJob.claim(timedelta(minutes=5)))
+        self.assertEqual(ListJob.claim(timedelta(0)).id, job.id)
@@ -1,9 +1,13 @@
 from models import db, connect_db, User, Character, List, ListCharacter, Follows, DEFAULT_IMAGE_URL
 from unittest import TestCase
 import os
+import requests
 os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, card_cache, remember_identity
+from mock_giantbomb import fake_character
+import app as epiclist
 
 db.create_all()
 
@@ -20,6 +24,7 @@ class ListTestCase(TestCase):
         List.query.delete()
         ListCharacter.query.delete()
         Follows.query.delete()
+        card_cache.clear()
 
         self.client = app.test_client()
 
@@ -79,6 +84,121 @@ class ListTestCase(TestCase):
             self.assertNotEqual(old_length, new_length)
             self.assertNotEqual(old_user_list_length, new_user_list_length)
 
+    def test_new_list_committed_with_characters(self):
+        """Is a new list only seen once its characters are saved with it?"""
+
+        seen_during_fetch = []
+        fetch_characters = epiclist.fetch_characters
+
+        def fetch(queries):
+            # From another connection, as other requests would see it
+            seen_during_fetch.append(db.engine.execute(
+                "SELECT count(*) FROM lists WHERE title = 'new list'").scalar())
+            return {query["guid"]: fake_character(query["guid"]) for query in queries}
+
+        epiclist.fetch_characters = fetch
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 11111
+
+                res = c.post("/lists/new", data={"title": "new list",
+                                                 "characters": "3005-1, 3005-2"})
+        finally:
+            epiclist.fetch_characters = fetch_characters
+
+        lst = List.query.filter(List.title == "new list").one()
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(seen_during_fetch, [0])
+        self.assertEqual([char.guid for char in lst.characters], ["3005-1", "3005-2"])
+
+    def test_edit_list_new_revision(self):
+        """Is an edit's new revision only seen once its characters are saved?"""
+
+        revisions_seen = []
+        fetch_characters = epiclist.fetch_characters
+        insert_characters = epiclist.insert_characters
+
+        def insert(char_infos):
+            insert_characters(char_infos)
+
+            # From another connection, as other requests would see it
+            revisions_seen.append(db.engine.execute(
+                "SELECT revision FROM lists WHERE id = 111111").scalar())
+
+        epiclist.fetch_characters = lambda queries: {
+            query["guid"]: fake_character(query["guid"]) for query in queries}
+        epiclist.insert_characters = insert
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 11111
+
+                c.post("/lists/111111/edit", data={"title": "title1",
+                                                   "characters": "3005-1"})
+        finally:
+            epiclist.fetch_characters = fetch_characters
+            epiclist.insert_characters = insert_characters
+
+        lst = List.query.get(111111)
+
+        self.assertEqual([char.guid for char in lst.characters], ["3005-1"])
+        self.assertEqual(revisions_seen, [1])
+        self.assertEqual(lst.revision, 2)
+
+    def test_new_list_api_error(self):
+        """Is the form shown again with an error, and nothing saved, when
+        GiantBomb can't be reached?"""
+
+        def fetch(queries):
+            raise requests.exceptions.HTTPError("503 Server Error")
+
+        fetch_characters = epiclist.fetch_characters
+        epiclist.fetch_characters = fetch
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 11111
+
+                res = c.post("/lists/new", data={"title": "new list",
+                                                 "characters": "3005-1, 3005-2"})
+        finally:
+            epiclist.fetch_characters = fetch_characters
+
+        html = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Couldn&#39;t get the characters from GiantBomb", html)
+        self.assertIn('value="new list"', html)
+        self.assertEqual(List.query.filter(List.title == "new list").count(), 0)
+
+    def test_edit_list_api_error(self):
+        """Is an edit left unsaved, with an error, when GiantBomb can't be
+        reached?"""
+
+        def fetch(queries):
+            raise requests.exceptions.ConnectTimeout("timed out")
+
+        fetch_characters = epiclist.fetch_characters
+        epiclist.fetch_characters = fetch
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 11111
+
+                res = c.post("/lists/111111/edit", data={"title": "new title",
+                                                         "characters": "3005-1"})
+        finally:
+            epiclist.fetch_characters = fetch_characters
+
+        lst = List.query.get(111111)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Couldn&#39;t get the characters from GiantBomb", res.get_data(as_text=True))
+        self.assertEqual(lst.title, "title1")
+        self.assertEqual(lst.revision, 1)
+
     def test_private_lists(self):
         """Are private lists only viewable by the list creator?"""
         with self.client as c:
@@ -161,6 +281,106 @@ class ListTestCase(TestCase):
 
             self.assertEqual(res.status_code, 302)
     
+    def test_public_lists_count(self):
+        """Is the public list counter kept in sync when lists are created,
+        made private or public and deleted?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            char = Character(guid="3005-177", name="Mario", game="Super Mario 64")
+            db.session.add(char)
+            db.session.commit()
+
+            c.post("/lists/new", data={"title": "new list", "characters": "3005-177"})
+            new_list = List.query.filter(List.title == "new list").first()
+
+            self.assertEqual(User.query.get(11111).public_lists_count, 1)
+
+            c.post(f"/lists/{new_list.id}/edit",
+                   data={"title": "new list", "is_private": "y", "characters": "3005-177"})
+
+            self.assertEqual(User.query.get(11111).public_lists_count, 0)
+
+            c.post(f"/lists/{new_list.id}/edit",
+                   data={"title": "new list", "characters": "3005-177"})
+
+            self.assertEqual(User.query.get(11111).public_lists_count, 1)
+
+            c.post(f"/lists/{new_list.id}/delete")
+
+            self.assertEqual(User.query.get(11111).public_lists_count, 0)
+
+    def test_batched_lists(self):
+        """Are many lists sent at once, in rank order and without other users'
+        private lists?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            mario = Character(guid="3005-177", name="Mario", game="Super Mario 64")
+            link = Character(guid="3005-191", name="Link", game="Zelda")
+            db.session.add_all([mario, link])
+            db.session.flush()
+
+            db.session.add_all([
+                ListCharacter(list_id=111111, character_id=link.id, rank=2),
+                ListCharacter(list_id=111111, character_id=mario.id, rank=1),
+                List(id=222222, title="title2", user_id=11111, is_ranked=False, is_private=True),
+                List(id=333333, title="title3", user_id=22222, is_ranked=False, is_private=True)
+            ])
+            db.session.commit()
+
+            res = c.get("/api/lists?ids=111111,222222,333333")
+            lists = res.json["lists"]
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([lst["id"] for lst in lists], [222222, 111111])
+            self.assertEqual(lists[0]["characters"], [])
+            self.assertEqual(lists[1]["username"], "tester1")
+            self.assertEqual([(char["name"], char["rank"]) for char in lists[1]["characters"]],
+                             [("Mario", 1), ("Link", 2)])
+
+            # One query for the revisions, one for the lists and characters
+            self.assertEqual(res.headers["X-DB-Query-Count"], "2")
+
+            res = c.get("/api/lists?user_id=22222")
+            self.assertEqual(res.json["lists"], [])
+
+            self.assertEqual(c.get("/api/lists?ids=1,a").status_code, 400)
+            self.assertEqual(c.get("/api/lists").status_code, 400)
+
+    def test_batched_lists_etag(self):
+        """Is a 304 sent when none of the lists changed since the client's copy?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user1.id
+
+            res = c.get("/api/lists?user_id=11111")
+            etag = res.headers["ETag"]
+
+            res = c.get("/api/lists?user_id=11111", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.data, b"")
+
+            res = c.get("/get-list/111111", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+
+            List.bump_revisions(List.id == 111111)
+            db.session.commit()
+
+            res = c.get("/api/lists?user_id=11111", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers["ETag"], etag)
+
+            # Another user gets their own copy
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 22222
+
+            res = c.get("/api/lists?user_id=11111", headers={"If-None-Match": res.headers["ETag"]})
+            self.assertEqual(res.status_code, 200)
+
     def test_repr(self):
         """Does the __repr__ display as expected?"""
 
@@ -0,0 +1,132 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows
+from unittest import TestCase
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import app, login_throttle
+from config import CONFIGS
+from passwords import PasswordHasher, PasswordHasherBusy, hasher, hash_rounds
+
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+
+    """Test hashing passwords in a pool of processes"""
+
+    def test_hash_check(self):
+        """Are passwords hashed and checked by the pool at the configured cost?"""
+
+        pool_hasher = PasswordHasher(rounds=5, workers=1)
+        pw_hash = pool_hasher.hash("password123")
+
+        self.assertEqual(hash_rounds(pw_hash), 5)
+        self.assertTrue(pool_hasher.check(pw_hash, "password123"))
+        self.assertFalse(pool_hasher.check(pw_hash, "password124"))
+
+    def test_needs_rehash(self):
+        """Are hashes made with another cost flagged for rehashing?"""
+
+        pw_hash = PasswordHasher(rounds=4).hash("password123")
+
+        self.assertFalse(PasswordHasher(rounds=4).needs_rehash(pw_hash))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash(pw_hash))
+
+    def test_busy(self):
+        """Are passwords turned away once too many are waiting?"""
+
+        busy_hasher = PasswordHasher(rounds=4, workers=1, max_pending=0)
+
+        with self.assertRaises(PasswordHasherBusy):
+            busy_hasher.hash("password123")
+
+
+class LoginTestCase(TestCase):
+
+    """Test logging in through the throttle"""
+
+    def setUp(self):
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+        login_throttle.cache.clear()
+
+        user = User.signup(username="tester1", password="password123")
+        user.id = 11111
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        hasher.rounds = app.config["BCRYPT_LOG_ROUNDS"]
+        login_throttle.cache.clear()
+        db.session.rollback()
+        return res
+
+    def login(self, password, address="127.0.0.1"):
+        return self.client.post("/login", data={"username": "tester1", "password": password},
+                                environ_base={"REMOTE_ADDR": address})
+
+    def test_rehash_on_login(self):
+        """Is the password rehashed at the new cost when the user logs in?"""
+
+        hasher.rounds = 5
+
+        res = self.login("password123")
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(hash_rounds(User.query.get(11111).password), 5)
+
+    def test_username_throttle(self):
+        """Are logins to one username refused once over the limit, from any
+        address?"""
+
+        for attempt in range(app.config["LOGIN_THROTTLE_PER_USERNAME"]):
+            self.assertEqual(self.login("wrong", f"10.0.0.{attempt}").status_code, 200)
+
+        res = self.login("password123", "10.0.1.1")
+
+        self.assertEqual(res.status_code, 429)
+        self.assertIn("Retry-After", res.headers)
+        self.assertIn("Too many attempts", res.get_data(as_text=True))
+
+    def test_address_throttle(self):
+        """Are logins from one address refused once over the limit?"""
+
+        login_throttle.per_address, per_address = 2, login_throttle.per_address
+
+        try:
+            self.assertEqual(self.client.post("/login", data={"username": "tester2", "password": "x"}).status_code, 200)
+            self.assertEqual(self.client.post("/login", data={"username": "tester3", "password": "x"}).status_code, 200)
+            self.assertEqual(self.login("password123").status_code, 429)
+            self.assertEqual(self.login("password123", "10.0.0.1").status_code, 302)
+        finally:
+            login_throttle.per_address = per_address
+
+    def test_forwarded_address(self):
+        """Behind the router in production, are clients throttled by their
+        own address rather than the router's?"""
+
+        login_throttle.per_address, per_address = 1, login_throttle.per_address
+        app.wsgi_app, wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=CONFIGS["production"].TRUSTED_PROXIES), app.wsgi_app
+
+        def login(client_address):
+            return self.client.post("/login", data={"username": "tester1", "password": "password123"},
+                                    environ_base={"REMOTE_ADDR": "10.1.0.1"},
+                                    headers={"X-Forwarded-For": client_address})
+
+        try:
+            self.assertEqual(login("203.0.113.1").status_code, 302)
+            self.assertEqual(login("203.0.113.2").status_code, 302)
+            self.assertEqual(login("203.0.113.1").status_code, 429)
+        finally:
+            login_throttle.per_address = per_address
+            app.wsgi_app = wsgi_app
@@ -0,0 +1,90 @@
+from models import db, connect_db, User, Character, List, ListCharacter, Follows
+from unittest import TestCase
+import os
+os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
+
+from app import app, CURR_USER_KEY, search_cache, search_local_characters
+from mock_giantbomb import MockGiantBomb
+import giantbomb
+
+db.create_all()
+
+
+class LocalSearchTestCase(TestCase):
+
+    """Test searches answered from the characters stored locally"""
+
+    def setUp(self):
+
+        User.query.delete()
+        Character.query.delete()
+        List.query.delete()
+        ListCharacter.query.delete()
+        Follows.query.delete()
+
+        user = User.signup(username="tester1", password="password123")
+        user.id = 11111
+
+        for i in range(1, 7):
+            db.session.add(Character(guid=f"3005-{i}", name=f"Super Mario {i}", game="Game"))
+        db.session.add(Character(guid="3005-7", name="Mario", game="Super Mario 64"))
+        db.session.add(Character(guid="3005-8", name="Toad", game="Super Mario 64, Mario Kart"))
+        db.session.add(Character(guid="3005-9", name="Link", game="The Legend of Zelda"))
+        db.session.commit()
+
+        search_cache.clear()
+        self.client = app.test_client()
+        self.mock = MockGiantBomb().start()
+        self.api_url = giantbomb.API_URL
+        giantbomb.API_URL = self.mock.url
+
+    def tearDown(self):
+        res = super().tearDown()
+        giantbomb.API_URL = self.api_url
+        self.mock.stop()
+        db.session.rollback()
+        return res
+
+    def search(self, term, limit=10):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+
+            return c.post("/search-characters", json={"term": term, "limit": limit})
+
+    def test_ranking(self):
+        """Do exact name matches come first, and game matches after name matches?"""
+
+        names = [char["name"] for char in search_local_characters("mario", 10)]
+
+        self.assertEqual(names[0], "Mario")
+        self.assertEqual(names[-1], "Toad")
+        self.assertEqual(len(names), 8)
+
+    def test_prefix(self):
+        """Do partly typed words match, with every word needed?"""
+
+        names = [char["name"] for char in search_local_characters("sup mar 3", 10)]
+
+        self.assertEqual(names, ["Super Mario 3"])
+        self.assertEqual(search_local_characters("zel", 10)[0]["guid"], "3005-9")
+        self.assertEqual(search_local_characters("  !! ", 10), [])
+
+    def test_local_results(self):
+        """Is a search with enough local matches answered without the API?"""
+
+        res = self.search("mario")
+
+        self.assertEqual(len(res.json["character_results"]), 8)
+        self.assertEqual(res.json["character_results"][0],
+                         {"name": "Mario", "image_url": None, "guid": "3005-7"})
+        self.assertEqual(self.mock.requests, [])
+
+    def test_too_few_local_results(self):
+        """Does a search go to the API when too few characters match locally?"""
+
+        res = self.search("zelda")
+
+        self.assertEqual(len(res.json["character_results"]), 10)
+        self.assertEqual(len(self.mock.requests), 1)
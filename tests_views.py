@@ -2,8 +2,11 @@ from models import db, connect_db, User, Character, List, ListCharacter, Follows
 from unittest import TestCase
 import os
 os.environ['DATABASE_URL'] = "postgres:///epiclist_test"
+os.environ.setdefault('EPICLIST_CONFIG', "testing")
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, card_cache, identity_cache, remember_identity
+from sqlalchemy import event
+import re
 
 db.create_all()
 
@@ -21,6 +24,8 @@ class UserViewsTestCase(TestCase):
         List.query.delete()
         ListCharacter.query.delete()
         Follows.query.delete()
+        card_cache.clear()
+        identity_cache.clear()
 
         self.client = app.test_client()
 
@@ -152,4 +157,267 @@ class UserViewsTestCase(TestCase):
 
             self.assertEqual(res.status_code, 302)
 
-        
\ No newline at end of file
+    def test_index_pagination(self):
+        """Does the home feed only show one page of lists, newest first, with
+        a link to load the next page?"""
+
+        for i in range(2, 5):
+            lst = List(title=f"title{i}",
+                        user_id=11111,
+                        is_ranked=False,
+                        is_private=False)
+            lst.id = 111111 * i
+            db.session.add(lst)
+        db.session.commit()
+
+        app.config["FEED_PAGE_SIZE"] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user1.id
+
+                res = c.get("/")
+                html = res.get_data(as_text=True)
+
+                self.assertEqual(res.status_code, 200)
+                self.assertIn("title4", html)
+                self.assertIn("title3", html)
+                self.assertNotIn("title2", html)
+                self.assertIn('href="/?before=333333"', html)
+
+                res = c.get("/?before=333333")
+                html = res.get_data(as_text=True)
+
+                self.assertIn("title2", html)
+                self.assertIn("title1", html)
+                self.assertNotIn("title3", html)
+                self.assertNotIn("Load more", html)
+        finally:
+            app.config["FEED_PAGE_SIZE"] = 20
+
+    def test_identity_without_query(self):
+        """Are requests that only need the logged in user's id and username
+        served without loading the user from the db?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            statements = []
+
+            def count_statement(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                res = c.get("/register-home")
+                c.get("/static/style.css")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+
+            self.assertEqual(res.status_code, 302)
+            self.assertEqual(statements, [])
+
+    def test_deleted_user_session(self):
+        """Is a session for a user that no longer exists logged out?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 99999
+
+            res = c.get("/")
+
+            self.assertEqual(res.status_code, 302)
+            self.assertIn("/register-home", res.location)
+
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+    def test_deleted_user_other_session(self):
+        """Is another session of a deleted user logged out before it can
+        do anything?"""
+
+        other = app.test_client()
+
+        with other.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 11111
+        other.get("/")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+
+            c.post("/users/tester1/delete")
+
+        res = other.post("/lists/new", data={"title": "title", "characters": ""})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertIn("/register-home", res.location)
+
+        with other.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
+
+    def test_edit_profile_updates_identity(self):
+        """Does changing username update the username of every session?"""
+
+        other = app.test_client()
+
+        with other.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 11111
+        other.get("/")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            res = c.post("/users/tester1/edit", data={"username": "renamed",
+                                                      "password": "password123"})
+
+            self.assertEqual(res.status_code, 302)
+            self.assertIn("/users/renamed", res.location)
+            self.assertEqual(identity_cache.get("11111"), "renamed")
+
+            res = c.get("/users/tester1/private-lists")
+
+            self.assertEqual(res.status_code, 302)
+
+        html = other.get("/").get_data(as_text=True)
+
+        self.assertIn("Logged in as renamed", html)
+
+    def test_list_cards_cached(self):
+        """Are list cards rendered once and reused until the list changes?"""
+        mario = Character(name="Mario", guid="3005-177", game="Super Mario Bros.")
+        db.session.add(mario)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            c.get("/")
+            res = c.get("/")
+
+            self.assertIn("title1", res.get_data(as_text=True))
+            self.assertEqual(card_cache.stats()["hits"], 1)
+
+            c.post("/lists/111111/edit", data={"title": "new title",
+                                               "is_ranked": True,
+                                               "characters": "3005-177"})
+            res = c.get("/")
+            html = res.get_data(as_text=True)
+
+            self.assertIn("new title", html)
+            self.assertNotIn("title1", html)
+            self.assertIn("Mario", html)
+
+    def test_list_cards_follow_username(self):
+        """Do cached list cards show the new username after it changes?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            c.get("/users/tester1")
+            c.post("/users/tester1/edit", data={"username": "renamed",
+                                                "password": "password123"})
+
+            res = c.get("/users/renamed")
+            html = res.get_data(as_text=True)
+
+            self.assertNotIn("tester1", html)
+
+    def test_list_page_not_modified(self):
+        """Is a 304 sent for a list page that hasn't changed since the
+        visitor's copy, until the list is edited?"""
+        mario = Character(name="Mario", guid="3005-177", game="Super Mario Bros.")
+        db.session.add(mario)
+        db.session.commit()
+
+        res = self.client.get("/lists/111111")
+        etag = res.headers["ETag"]
+        last_modified = res.headers["Last-Modified"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Cache-Control"], "public, no-cache")
+
+        res = self.client.get("/lists/111111", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+
+        res = self.client.get("/lists/111111",
+                              headers={"If-Modified-Since": last_modified})
+        self.assertEqual(res.status_code, 304)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 11111
+                remember_identity(sess[CURR_USER_KEY], "tester1")
+
+            # The author sees their own copy, with the edit buttons
+            res = c.get("/lists/111111", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.headers["Cache-Control"], "private, no-cache")
+
+            c.post("/lists/111111/edit", data={"title": "new title",
+                                               "characters": "3005-177"})
+
+        res = self.client.get("/lists/111111", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("new title", res.get_data(as_text=True))
+
+    def test_profile_not_modified(self):
+        """Is a 304 sent for a profile that hasn't changed, until the viewer
+        follows the user?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 22222
+                remember_identity(sess[CURR_USER_KEY], "tester2")
+
+            etag = c.get("/users/tester1").headers["ETag"]
+
+            res = c.get("/users/tester1", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+
+            c.post("/users/11111/follow")
+
+            res = c.get("/users/tester1", headers={"If-None-Match": etag})
+            html = res.get_data(as_text=True)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Followers: 1", html)
+            self.assertIn("Following</button>", html)
+
+    def test_profile_loader(self):
+        """Is the profile loaded in a fixed number of queries, one page of
+        lists at a time, with the viewer's follow status?"""
+        for index in range(30):
+            db.session.add(List(title=f"list {index}", user_id=11111,
+                                is_ranked=False, is_private=False))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 22222
+                remember_identity(sess[CURR_USER_KEY], "tester2")
+
+            c.post("/users/11111/follow")
+
+            res = c.get("/users/tester1")
+            html = res.get_data(as_text=True)
+
+            # The user and follow status, the page of lists, their characters
+            self.assertEqual(res.headers["X-DB-Query-Count"], "3")
+            self.assertIn("Following</button>", html)
+            self.assertIn("list 29", html)
+            self.assertNotIn("list 9<", html)
+
+            next_page = re.search(r'href="(/users/tester1\?before=\d+)"', html).group(1)
+            html = c.get(next_page).get_data(as_text=True)
+
+            self.assertIn("list 9<", html)
+            self.assertNotIn("list 11<", html)
+
+            self.assertEqual(c.get("/users/nobody").status_code, 404)